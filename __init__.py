@@ -1,11 +1,14 @@
 import os
 import logging
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
+from db_profiles import get_engine_options, configure_engine
+from logging_config import configure_logging
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging (per environment, see EVA_ENV)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Set up database 
@@ -17,16 +20,26 @@ db = SQLAlchemy(model_class=Base)
 # Initialize Flask app
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
 
+# Behind reverse proxies, trust this many X-Forwarded-For/-Proto/-Host hops so
+# request.remote_addr is the real client (the rate limit is keyed on it)
+proxy_hops = int(os.environ.get("EVA_PROXY_HOPS", 0))
+if proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops, x_host=proxy_hops)
+
 # Configure the app
 app.secret_key = os.environ.get("FLASK_SECRET_KEY") or "a secret key"
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 
 # Initialize database with app
 db.init_app(app)
 
+# Apply per-connection settings (SQLite pragmas) for the database profile, and
+# create missing tables before the routes load the knowledge snapshot from them
+import models  # noqa: E402,F401
+with app.app_context():
+    configure_engine(db.engine)
+    db.create_all()
+
 # Import routes (must be after app initialization)
 from app import routes
\ No newline at end of file
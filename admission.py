@@ -0,0 +1,281 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Admission control for /chat can be switched off with EVA_ADMISSION=0
+ADMISSION_ENABLED = os.environ.get("EVA_ADMISSION", "1") != "0"
+
+# Token bucket per conversation (or IP): sustained messages per second and burst size
+RATE_LIMIT_RATE = float(os.environ.get("EVA_RATE_LIMIT_RATE", 1.0))
+RATE_LIMIT_BURST = float(os.environ.get("EVA_RATE_LIMIT_BURST", 10))
+
+# Local SQLite file holding the buckets, shared by every worker on the machine
+RATE_LIMIT_PATH = os.environ.get("EVA_RATE_LIMIT_PATH", "data/rate_limit.sqlite3")
+
+# Requests processed at once per worker, requests allowed to wait for a slot,
+# and how long they may wait before being shed
+MAX_CONCURRENT = int(os.environ.get("EVA_ADMISSION_MAX_CONCURRENT", 4))
+MAX_QUEUE = int(os.environ.get("EVA_ADMISSION_MAX_QUEUE", 16))
+QUEUE_TIMEOUT = float(os.environ.get("EVA_ADMISSION_QUEUE_TIMEOUT", 2.0))
+
+# Buckets idle long enough to be full again are pruned every PRUNE_INTERVAL seconds
+PRUNE_INTERVAL = 60.0
+
+
+class TokenBucketStore:
+    """
+    Token buckets kept in a local SQLite file
+
+    Each take is one short write transaction (BEGIN IMMEDIATE), so workers
+    on the same machine share buckets without an external service. Buckets
+    are refilled lazily from the time of their last update, and a missing
+    bucket counts as full, so idle buckets can be dropped at any time.
+    """
+
+    def __init__(self, path=RATE_LIMIT_PATH, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST):
+        """
+        Initialize the store (the file is opened on first use, once per process)
+
+        Args:
+            path (str): SQLite file
+            rate (float): Tokens added per second
+            burst (float): Bucket capacity
+        """
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._last_prune = 0.0
+
+    def _connect(self):
+        # A connection inherited through fork must not be reused
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS token_bucket ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def take(self, key, now=None):
+        """
+        Take one token from a bucket
+
+        Args:
+            key (str): Bucket key (user or client address)
+            now (float, optional): Current time, for tests
+
+        Returns:
+            tuple: (allowed, seconds until a token is available)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT tokens, updated_at FROM token_bucket WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    tokens = self.burst
+                else:
+                    tokens = min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+
+                allowed = tokens >= 1.0
+                if allowed:
+                    tokens -= 1.0
+                connection.execute(
+                    "INSERT OR REPLACE INTO token_bucket (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+
+                if now - self._last_prune > PRUNE_INTERVAL:
+                    self._last_prune = now
+                    connection.execute(
+                        "DELETE FROM token_bucket WHERE updated_at < ?", (now - self.burst / self.rate,)
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        retry_after = 0.0 if allowed else (1.0 - tokens) / self.rate
+        return allowed, retry_after
+
+    def close(self):
+        """Close the connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class ConcurrencyLimiter:
+    """
+    Caps requests in flight per process, with a bounded wait queue
+
+    Up to max_concurrent requests run at once; up to max_queue more wait at
+    most queue_timeout for a slot, and anything beyond that is refused at
+    once instead of piling up on the worker's threads.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        """
+        Initialize the limiter
+
+        Args:
+            max_concurrent (int): Requests processed at once
+            max_queue (int): Requests allowed to wait for a slot
+            queue_timeout (float): Seconds a request may wait
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue if there is room
+
+        Returns:
+            bool: Whether a slot was taken (release() it when done)
+        """
+        if self._slots.acquire(blocking=False):
+            return True
+
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+        try:
+            with metrics.span("admission.queue_wait"):
+                return self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def release(self):
+        """Give a slot back"""
+        self._slots.release()
+
+
+class Admission:
+    """
+    Outcome of an admission check
+
+    Used as a context manager around the admitted work so the concurrency
+    slot is always given back.
+    """
+
+    __slots__ = ("admitted", "status", "reason", "retry_after", "_limiter")
+
+    def __init__(self, admitted, status=200, reason=None, retry_after=0.0, limiter=None):
+        self.admitted = admitted
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+        self._limiter = limiter
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._limiter is not None:
+            self._limiter.release()
+            self._limiter = None
+        return False
+
+
+class AdmissionController:
+    """
+    Decides, before any work is done, whether a request may run
+
+    A request is first charged against its client's token bucket (429 when
+    empty), then needs a concurrency slot (503 when the queue is full or the
+    wait times out). Both checks are cheap, so under overload the worker
+    spends its time refusing requests instead of running the NLP pipeline
+    for requests that would time out anyway.
+    """
+
+    def __init__(self, buckets=None, limiter=None, enabled=ADMISSION_ENABLED):
+        """
+        Initialize the controller
+
+        Args:
+            buckets (TokenBucketStore, optional): Per-client token buckets
+            limiter (ConcurrencyLimiter, optional): Per-process concurrency limit
+            enabled (bool): Admit everything when False
+        """
+        self.buckets = buckets or TokenBucketStore()
+        self.limiter = limiter or ConcurrencyLimiter()
+        self.enabled = enabled
+
+    def admit(self, key):
+        """
+        Check whether a request from a client may run now
+
+        Args:
+            key (str): Client key, e.g. "user:<id>" or "ip:<address>"
+
+        Returns:
+            Admission: Admitted (use it as a context manager) or refused,
+            with the HTTP status and Retry-After to answer with
+        """
+        if not self.enabled:
+            return Admission(True)
+
+        try:
+            allowed, retry_after = self.buckets.take(key)
+        except sqlite3.Error as e:
+            # The rate limiter must never take the chat down with it
+            logger.warning("Rate limit store unavailable, admitting request: %s", e)
+            allowed, retry_after = True, 0.0
+        if not allowed:
+            metrics.increment("admission.shed.rate_limited")
+            return Admission(False, 429, "rate_limited", retry_after)
+
+        if not self.limiter.acquire():
+            metrics.increment("admission.shed.overloaded")
+            return Admission(False, 503, "overloaded", self.limiter.queue_timeout)
+
+        metrics.increment("admission.admitted")
+        return Admission(True, limiter=self.limiter)
+
+
+def client_key(session, request):
+    """
+    Bucket key for a request: the session's conversation, or the client address
+
+    Each browser session gets its own bucket once it has a conversation, so
+    users behind one proxy or NAT don't share a bucket. A client discarding
+    its cookie starts a new conversation, and that first request is counted
+    against its address. Set EVA_PROXY_HOPS behind a reverse proxy so the
+    address is the client's and not the proxy's.
+
+    Args:
+        session (SecureCookieSession): Flask session
+        request (Request): Flask request
+
+    Returns:
+        str: Bucket key
+    """
+    conversation_id = session.get("conversation_id")
+    if conversation_id:
+        return f"conversation:{conversation_id}"
+    return f"ip:{request.remote_addr}"
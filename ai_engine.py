@@ -1,62 +1,171 @@
 import logging
 import random
+import metrics
 from knowledge_base import KnowledgeBase
+from knowledge_shard import ShardedKnowledgeBase, KNOWLEDGE_SHARDS
 from nlp_utils import NLPProcessor
 from response_generator import ResponseGenerator
+from conversation_context import ConversationContext
+from analytics import ResponseDecision
+from llm_client import get_llm_client
+from knowledge_ingest import detect_language
 
 logger = logging.getLogger(__name__)
 
+# Intents whose messages go into the conversation context: questions provide
+# its topics and last question, conversation turns read it. Greetings,
+# farewells and commands neither read nor meaningfully add to it.
+CONTEXT_INTENTS = ("question", "conversation")
+
+# System prompt for questions the knowledge base can't answer
+FALLBACK_SYSTEM_PROMPT = (
+    "Você é uma assistente chamada Eve. Responda de forma breve e no mesmo idioma da pergunta."
+)
+
 class AIEngine:
     """Main AI engine that coordinates between different components"""
     
-    def __init__(self):
-        """Initialize the AI engine components"""
+    def __init__(self, knowledge_base=None):
+        """
+        Initialize the AI engine components
+        
+        Args:
+            knowledge_base (KnowledgeBase, optional): Initial knowledge
+                snapshot (e.g. loaded from the database); when not given it is
+                read from the JSON file, or scattered to the shard servers
+        """
         logger.info("Initializing AI Engine...")
-        self.knowledge_base = KnowledgeBase()
+        # With EVA_KNOWLEDGE_SHARDS the knowledge lives on shard servers and
+        # searches are scattered to them; otherwise it is loaded locally
+        self.sharded = bool(KNOWLEDGE_SHARDS)
+        if self.sharded:
+            self.knowledge_base = ShardedKnowledgeBase(KNOWLEDGE_SHARDS)
+        else:
+            self.knowledge_base = knowledge_base if knowledge_base is not None else KnowledgeBase()
+        self.knowledge_version = 0
         self.nlp_processor = NLPProcessor()
         self.response_generator = ResponseGenerator()
+        # Shared LLM client for the fallback tier (None when not configured)
+        self.llm_client = get_llm_client()
         logger.info("AI Engine initialization complete")
     
-    def generate_response(self, user_input, conversation_history):
+    def swap_knowledge_base(self, knowledge_base, version=None):
+        """
+        Atomically replace the knowledge snapshot used for new requests
+        
+        Requests already running keep the snapshot they pinned; the old one is
+        freed once the last of them finishes.
+        
+        Args:
+            knowledge_base (KnowledgeBase): Fully built replacement
+            version (int, optional): Version of the new snapshot
+        """
+        self.knowledge_base = knowledge_base
+        self.knowledge_version = version if version is not None else self.knowledge_version + 1
+        logger.info("Knowledge snapshot %s swapped in (%d entries)", self.knowledge_version, len(knowledge_base.knowledge))
+    
+    def build_context(self, conversation_history):
+        """
+        Rebuild a conversation context by replaying the user messages of a history
+        
+        Only needed when no stored context exists (e.g. sessions created before
+        contexts were kept); otherwise contexts are updated one message at a
+        time. Replayed messages aren't classified, so this one-off rebuild
+        includes messages of every intent.
+        
+        Args:
+            conversation_history (list): List of previous messages
+            
+        Returns:
+            ConversationContext: The rebuilt context
+        """
+        context = ConversationContext()
+        for message in conversation_history:
+            if message["role"] == "user":
+                self.update_context(context, message["content"])
+        return context
+    
+    def update_context(self, context, user_input):
+        """
+        Add a new user message to a conversation context
+        
+        Args:
+            context (ConversationContext): Context to update
+            user_input (str): The user's message
+        """
+        with metrics.span("engine.update_context"):
+            context.observe(
+                user_input,
+                self.nlp_processor.extract_topics(user_input),
+                self.nlp_processor.is_question(user_input),
+            )
+    
+    def generate_response(self, user_input, conversation_history, context=None, decision=None):
         """
         Generate a response based on user input and conversation history
         
         Args:
             user_input (str): The user's message
             conversation_history (list): List of previous messages
+            context (ConversationContext, optional): Running context of the
+                conversation, updated in place with user_input when its
+                intent is in CONTEXT_INTENTS; rebuilt from the history when
+                not given
+            decision (ResponseDecision, optional): Filled in with how the
+                response was chosen (intent, language, best knowledge hit
+                and fallback), for analytics
             
         Returns:
             str: The AI's response
         """
+        # Pin the current knowledge snapshot so a concurrent reload can't swap it mid-request
+        knowledge_base = self.knowledge_base
+        if decision is None:
+            decision = ResponseDecision()
+        decision.language = detect_language(user_input)
+        
         try:
-            # Process the user input
-            processed_input = self.nlp_processor.preprocess_text(user_input)
-            
-            # Determine intent
-            intent = self.nlp_processor.classify_intent(processed_input)
-            logger.debug(f"Classified intent: {intent}")
-            
-            # Extract entities if needed
-            entities = self.nlp_processor.extract_entities(processed_input)
-            logger.debug(f"Extracted entities: {entities}")
-            
-            # Handle different intents
-            if intent == "greeting":
-                return self._handle_greeting()
-            elif intent == "farewell":
-                return self._handle_farewell()
-            elif intent == "question":
-                return self._handle_question(processed_input, entities)
-            elif intent == "command":
-                return self._handle_command(processed_input, entities)
-            elif intent == "conversation":
-                return self._handle_conversation(processed_input, conversation_history)
-            else:
-                # Default response generation
-                return self.response_generator.generate_generic_response(intent)
+            with metrics.span("engine.generate_response"):
+                if context is None:
+                    context = self.build_context(conversation_history[:-1])
+                
+                # Process the user input
+                with metrics.span("engine.preprocess"):
+                    processed_input = self.nlp_processor.preprocess_text(user_input)
+                
+                # Determine intent
+                with metrics.span("engine.classify_intent"):
+                    intent = self.nlp_processor.classify_intent(processed_input)
+                logger.debug("Classified intent: %s", intent)
+                decision.intent = intent
+                
+                # Track the conversation context incrementally, only for the intents that use it
+                if intent in CONTEXT_INTENTS:
+                    self.update_context(context, user_input)
+                
+                # Extract entities if needed
+                with metrics.span("engine.extract_entities"):
+                    entities = self.nlp_processor.extract_entities(processed_input)
+                logger.debug("Extracted entities: %s", entities)
+                
+                # Handle different intents
+                with metrics.span(f"engine.handle.{intent}"):
+                    if intent == "greeting":
+                        return self._handle_greeting()
+                    elif intent == "farewell":
+                        return self._handle_farewell()
+                    elif intent == "question":
+                        return self._handle_question(processed_input, entities, knowledge_base, user_input, decision)
+                    elif intent == "command":
+                        return self._handle_command(processed_input, entities, knowledge_base, decision)
+                    elif intent == "conversation":
+                        return self._handle_conversation(processed_input, context)
+                    else:
+                        # Default response generation
+                        return self.response_generator.generate_generic_response(intent)
                 
         except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
+            logger.error("Error generating response: %s", e)
             return "Peço desculpas, mas estou tendo problemas para processar sua solicitação no momento."
     
     def _handle_greeting(self):
@@ -79,68 +188,45 @@ class AIEngine:
         ]
         return random.choice(farewells)
     
-    def _handle_question(self, processed_input, entities):
+    def _handle_question(self, processed_input, entities, knowledge_base, user_input, decision):
         """Handle question intents"""
         # Search knowledge base for relevant information
-        relevant_info = self.knowledge_base.search(processed_input)
+        scored = knowledge_base.search_scored(processed_input)
         
-        if relevant_info:
+        if scored:
+            # Record the best hit, which the response is built from
+            best, score = scored[0]
+            decision.knowledge_hit = True
+            decision.score = score
+            decision.entry_id = best.get("id")
+            
             # Generate response based on retrieved information
-            return self.response_generator.generate_from_knowledge(relevant_info, entities)
-        else:
-            # No relevant information found
-            return self.response_generator.generate_unknown_response()
+            return self.response_generator.generate_from_knowledge([entry for entry, _ in scored], entities)
+        
+        # No relevant information found: ask the LLM fallback tier, if configured
+        if self.llm_client is not None:
+            answer = self.llm_client.complete(user_input, system=FALLBACK_SYSTEM_PROMPT)
+            if answer:
+                decision.fallback = "llm"
+                return answer
+        
+        decision.fallback = "unknown"
+        return self.response_generator.generate_unknown_response()
     
-    def _handle_command(self, processed_input, entities):
+    def _handle_command(self, processed_input, entities, knowledge_base, decision):
         """Handle command intents"""
         # Identify the type of command
         if "define" in processed_input or "what is" in processed_input or "o que" in processed_input or "definir" in processed_input:
             term = next((entity for entity in entities if entity["type"] == "term"), None)
             if term:
-                definition = self.knowledge_base.get_definition(term["value"])
+                definition = knowledge_base.get_definition(term["value"])
                 if definition:
+                    decision.knowledge_hit = True
                     return definition
             
         return "Não tenho certeza de como processar esse comando. Você poderia tentar formulá-lo de outra maneira?"
     
-    def _handle_conversation(self, processed_input, conversation_history):
+    def _handle_conversation(self, processed_input, context):
         """Handle conversational intents"""
-        # Use contextual information from conversation history
-        context = self._extract_context(conversation_history)
-        
-        # Generate a contextually appropriate response
-        return self.response_generator.generate_contextual_response(processed_input, context)
-    
-    def _extract_context(self, conversation_history):
-        """
-        Extract context from conversation history
-        
-        Args:
-            conversation_history (list): List of previous messages
-            
-        Returns:
-            dict: Contextual information
-        """
-        context = {"topics": [], "sentiment": "neutral", "last_question": None}
-        
-        # Only process if we have history
-        if len(conversation_history) < 2:
-            return context
-        
-        # Extract topics from the last few messages
-        last_messages = conversation_history[-5:] if len(conversation_history) >= 5 else conversation_history
-        
-        for message in last_messages:
-            if message["role"] == "user":
-                # Extract topics from user messages
-                topics = self.nlp_processor.extract_topics(message["content"])
-                context["topics"].extend(topics)
-                
-                # Check if the last user message was a question
-                if message == conversation_history[-2] and self.nlp_processor.is_question(message["content"]):
-                    context["last_question"] = message["content"]
-        
-        # Remove duplicates and keep only the most recent topics
-        context["topics"] = list(set(context["topics"]))[:3]
-        
-        return context
+        # Use contextual information tracked for this conversation
+        return self.response_generator.generate_contextual_response(processed_input, context.as_dict())
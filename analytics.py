@@ -0,0 +1,298 @@
+import os
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the pending counts to the rollup table
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get("EVA_ANALYTICS_FLUSH_INTERVAL", 5))
+
+# Flush early once this many (day, intent, language) keys are pending
+ANALYTICS_MAX_PENDING = int(os.environ.get("EVA_ANALYTICS_MAX_PENDING", 500))
+
+# Counters kept per rollup row, in the order they are added up
+COUNTERS = ("messages", "knowledge_hits", "knowledge_misses", "llm_fallbacks", "unknown_responses", "scored_hits",
+            "score_sum")
+
+
+class ResponseDecision:
+    """
+    How the engine answered one message
+
+    Filled in by AIEngine.generate_response and recorded into the rollups.
+    knowledge_hit is set when a knowledge entry answered (score is its
+    similarity, None for direct definition lookups). fallback is "llm" when
+    the LLM fallback tier answered a question the knowledge base missed,
+    "unknown" when the generic unknown reply was used, and None otherwise.
+    """
+
+    __slots__ = ("intent", "language", "knowledge_hit", "score", "entry_id", "fallback")
+
+    def __init__(self):
+        self.intent = None
+        self.language = None
+        self.knowledge_hit = False
+        self.score = None
+        self.entry_id = None
+        self.fallback = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def decision_counts(decision):
+    """
+    Rollup counters contributed by one decision
+
+    Args:
+        decision (ResponseDecision): Recorded decision
+
+    Returns:
+        dict: Increment for every counter in COUNTERS
+    """
+    return {
+        "messages": 1,
+        "knowledge_hits": 1 if decision.knowledge_hit else 0,
+        "knowledge_misses": 1 if decision.fallback is not None else 0,
+        "llm_fallbacks": 1 if decision.fallback == "llm" else 0,
+        "unknown_responses": 1 if decision.fallback == "unknown" else 0,
+        # Definition lookups hit without a score; the mean only covers scored hits
+        "scored_hits": 1 if decision.knowledge_hit and decision.score is not None else 0,
+        "score_sum": decision.score or 0.0,
+    }
+
+
+def ensure_rollup_columns(db, rollup_model):
+    """
+    Add counter columns missing from a rollup table created by an older version
+
+    scored_hits is backfilled with knowledge_hits, so the mean score of older
+    rows stays what it was. Must be called inside an application context.
+
+    Args:
+        db (SQLAlchemy): Database handle
+        rollup_model (Model): The IntentRollup model
+    """
+    table = rollup_model.__tablename__
+    columns = {column["name"] for column in inspect(db.engine).get_columns(table)}
+    if "scored_hits" in columns:
+        return
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN scored_hits INTEGER NOT NULL DEFAULT 0"))
+            connection.execute(text(f"UPDATE {table} SET scored_hits = knowledge_hits"))
+        logger.info("Added scored_hits to %s", table)
+    except Exception as e:
+        # Another worker added it first
+        logger.debug("scored_hits not added to %s: %s", table, e)
+
+
+def upsert_rollups(db, rollup_model, rows):
+    """
+    Add counts to the rollup rows in one statement per batch
+
+    Uses INSERT ... ON CONFLICT DO UPDATE on SQLite and PostgreSQL, so each
+    flush is a single round trip whatever the number of keys; other databases
+    update row by row. Must be called inside an application context.
+
+    Args:
+        db (SQLAlchemy): Database handle
+        rollup_model (Model): The IntentRollup model
+        rows (list): Dicts with day, intent, language and the COUNTERS increments
+    """
+    if not rows:
+        return
+
+    table = rollup_model.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.intent, table.c.language],
+            set_={name: table.c[name] + statement.excluded[name] for name in COUNTERS},
+        )
+        with db.engine.begin() as connection:
+            connection.execute(statement)
+        return
+
+    with db.engine.begin() as connection:
+        for row in rows:
+            key = (table.c.day == row["day"]) & (table.c.intent == row["intent"]) & (table.c.language == row["language"])
+            updated = connection.execute(
+                table.update().where(key).values({name: table.c[name] + row[name] for name in COUNTERS})
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert().values(row))
+
+
+class AnalyticsRecorder:
+    """
+    Aggregates response decisions in memory and flushes them as rollups
+
+    Recording a decision only adds to an in-memory counter under a lock.
+    A background thread, started on the first record so it is created in
+    the worker process, upserts the pending counts every flush interval (or
+    sooner when many keys are pending), so the rollup table takes one small
+    batched write every few seconds instead of one per message.
+    """
+
+    def __init__(self, app, db, rollup_model, flush_interval=ANALYTICS_FLUSH_INTERVAL,
+                 max_pending=ANALYTICS_MAX_PENDING):
+        """
+        Initialize the recorder
+
+        Args:
+            app (Flask): Application, used for an app context in the flush thread
+            db (SQLAlchemy): Database handle
+            rollup_model (Model): The IntentRollup model
+            flush_interval (float): Seconds between flushes
+            max_pending (int): Pending keys that trigger an early flush
+        """
+        self.app = app
+        self.db = db
+        self.rollup_model = rollup_model
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._schema_checked = False
+
+    def record(self, decision, at=None):
+        """
+        Count one decision
+
+        Args:
+            decision (ResponseDecision): Decision to record
+            at (datetime, optional): When the message was answered (UTC now by default)
+        """
+        day = (at or datetime.utcnow()).date()
+        key = (day, decision.intent or "unknown", decision.language or "en")
+        counts = decision_counts(decision)
+
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = counts
+            else:
+                for name in COUNTERS:
+                    pending[name] += counts[name]
+            full = len(self._pending) >= self.max_pending
+
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        # A thread started before a fork doesn't exist in the child
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="eva-analytics-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending counts to the rollup table
+
+        On failure the counts are put back and retried on the next flush.
+
+        Returns:
+            int: Number of rollup keys written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            rows = [
+                {"day": day, "intent": intent, "language": language, **counts}
+                for (day, intent, language), counts in pending.items()
+            ]
+            try:
+                with self.app.app_context():
+                    if not self._schema_checked:
+                        ensure_rollup_columns(self.db, self.rollup_model)
+                        self._schema_checked = True
+                    upsert_rollups(self.db, self.rollup_model, rows)
+            except Exception as e:
+                logger.error("Error flushing analytics rollups: %s", e)
+                with self._lock:
+                    for key, counts in pending.items():
+                        current = self._pending.setdefault(key, dict.fromkeys(COUNTERS, 0))
+                        for name in COUNTERS:
+                            current[name] += counts[name]
+                return 0
+
+            logger.debug("Flushed %d analytics rollup rows", len(rows))
+            return len(rows)
+
+
+def rollup_report(db, rollup_model, days=30):
+    """
+    Summarize the rollups of the last days
+
+    Reads only the rollup table, so the cost depends on the number of days,
+    intents and languages, not on the number of messages.
+
+    Args:
+        db (SQLAlchemy): Database handle
+        rollup_model (Model): The IntentRollup model
+        days (int): Days to include, today included
+
+    Returns:
+        dict: since, rows (per day, intent and language with the unknown and
+        miss rates and the mean best score) and totals per intent
+    """
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    model = rollup_model
+    rollups = db.session.execute(
+        select(model).where(model.day >= since).order_by(model.day.desc(), model.intent, model.language)
+    ).scalars().all()
+
+    def summarize(counts):
+        messages = counts["messages"]
+        return {
+            **counts,
+            "miss_rate": counts["knowledge_misses"] / messages if messages else 0.0,
+            "unknown_rate": counts["unknown_responses"] / messages if messages else 0.0,
+            "mean_score": counts["score_sum"] / counts["scored_hits"] if counts["scored_hits"] else None,
+        }
+
+    rows = []
+    totals = {}
+    for rollup in rollups:
+        counts = {name: getattr(rollup, name) for name in COUNTERS}
+        rows.append({"day": rollup.day.isoformat(), "intent": rollup.intent, "language": rollup.language,
+                     **summarize(counts)})
+        total = totals.setdefault(rollup.intent, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            total[name] += counts[name]
+
+    return {
+        "since": since.isoformat(),
+        "rows": rows,
+        "totals": {intent: summarize(counts) for intent, counts in sorted(totals.items())},
+    }
@@ -0,0 +1,384 @@
+import os
+import gzip
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, exists
+from sqlalchemy.orm import aliased
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; segments fall back to gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Where segment files and their index live
+ARCHIVE_DIR = os.environ.get("EVA_ARCHIVE_DIR", "archive")
+
+# Conversations idle for longer than this are moved out of the live tables
+ARCHIVE_AFTER_DAYS = int(os.environ.get("EVA_ARCHIVE_AFTER_DAYS", 30))
+
+# One segment file per month (or per day) of conversation start time
+ARCHIVE_BUCKET = os.environ.get("EVA_ARCHIVE_BUCKET", "month")
+
+# zstd when the zstandard package is installed, gzip otherwise
+ARCHIVE_COMPRESSION = os.environ.get("EVA_ARCHIVE_COMPRESSION", "zstd" if zstandard else "gzip")
+
+# Conversations per compressed block; reading one conversation decompresses its block
+ARCHIVE_BLOCK_SIZE = int(os.environ.get("EVA_ARCHIVE_BLOCK_SIZE", 100))
+
+INDEX_FILE = "index.sqlite3"
+PREVIEW_LENGTH = 50
+
+BUCKET_FORMATS = {"month": "%Y-%m", "day": "%Y-%m-%d"}
+EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class ConversationArchive:
+    """
+    Append-only archive of old conversations
+
+    Conversations are stored as NDJSON (one conversation with its messages per
+    line) in compressed segment files, one per time bucket of their start
+    date. Each archival run appends new compressed blocks to the segments and
+    never rewrites them. A small SQLite index maps every archived conversation
+    to its block (segment, offset, length) and keeps the fields /history
+    needs, so listing conversations never touches the segments and reading
+    one decompresses a single block.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, compression=ARCHIVE_COMPRESSION, bucket=ARCHIVE_BUCKET,
+                 block_size=ARCHIVE_BLOCK_SIZE):
+        """
+        Initialize the archive (files are only created on the first write)
+
+        Args:
+            directory (str): Directory for segments and the index
+            compression (str): "zstd" or "gzip"
+            bucket (str): "month" or "day"
+            block_size (int): Conversations per compressed block
+        """
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, archiving with gzip")
+            compression = "gzip"
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown archive compression: {compression}")
+        if bucket not in BUCKET_FORMATS:
+            raise ValueError(f"Unknown archive bucket: {bucket}")
+
+        self.directory = directory
+        self.compression = compression
+        self.bucket = bucket
+        self.block_size = block_size
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _connect(self, create=False):
+        """Open the index, optionally creating it; None if it doesn't exist yet"""
+        if self._connection is None:
+            if not create and not os.path.exists(self.index_path):
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(self.index_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS archived_conversation ("
+                "id INTEGER PRIMARY KEY, user_id TEXT, started_at TEXT, message_count INTEGER NOT NULL, "
+                "preview TEXT, segment TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_archived_conversation_user "
+                "ON archived_conversation (user_id, started_at)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _compress(self, data):
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data)
+
+    @staticmethod
+    def _decompress(segment, data):
+        if segment.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to read {segment}")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _segment_name(self, started_at):
+        label = started_at.strftime(BUCKET_FORMATS[self.bucket]) if started_at else "undated"
+        return f"{label}.ndjson.{EXTENSIONS[self.compression]}"
+
+    def write(self, conversations):
+        """
+        Append conversations to their segments and index them
+
+        Segment data is flushed to disk before the index is committed, so an
+        indexed conversation is always readable.
+
+        Args:
+            conversations (list): Dicts with id, user_id, started_at (datetime)
+                and messages (list of dicts with role, content and timestamp)
+        """
+        by_segment = {}
+        for conversation in conversations:
+            by_segment.setdefault(self._segment_name(conversation["started_at"]), []).append(conversation)
+
+        rows = []
+        os.makedirs(self.directory, exist_ok=True)
+        for segment, segment_conversations in by_segment.items():
+            with open(os.path.join(self.directory, segment), "ab") as f:
+                for start in range(0, len(segment_conversations), self.block_size):
+                    block = segment_conversations[start:start + self.block_size]
+                    lines = [
+                        json.dumps({
+                            "id": conversation["id"],
+                            "user_id": conversation["user_id"],
+                            "started_at": conversation["started_at"].isoformat() if conversation["started_at"] else None,
+                            "messages": [
+                                {
+                                    "role": message["role"],
+                                    "content": message["content"],
+                                    "timestamp": message["timestamp"].isoformat() if message["timestamp"] else None,
+                                }
+                                for message in conversation["messages"]
+                            ],
+                        }, ensure_ascii=False)
+                        for conversation in block
+                    ]
+                    data = self._compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+                    f.seek(0, os.SEEK_END)
+                    offset = f.tell()
+                    f.write(data)
+
+                    for conversation in block:
+                        preview = next((m["content"] for m in conversation["messages"] if m["role"] == "user"), None)
+                        if preview and len(preview) > PREVIEW_LENGTH:
+                            preview = preview[:PREVIEW_LENGTH] + "..."
+                        rows.append((
+                            conversation["id"], conversation["user_id"],
+                            conversation["started_at"].isoformat() if conversation["started_at"] else None,
+                            len(conversation["messages"]), preview, segment, offset, len(data),
+                        ))
+                f.flush()
+                os.fsync(f.fileno())
+
+        with self._lock:
+            connection = self._connect(create=True)
+            # A conversation archived twice (e.g. after an interrupted run) points at its latest copy
+            connection.executemany(
+                "INSERT OR REPLACE INTO archived_conversation "
+                "(id, user_id, started_at, message_count, preview, segment, offset, length) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            connection.commit()
+
+    def get_conversation(self, conversation_id):
+        """
+        Read an archived conversation
+
+        Args:
+            conversation_id (int): Conversation id
+
+        Returns:
+            dict: id, user_id, started_at and messages (timestamps as
+            datetimes), or None if the conversation isn't archived
+        """
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return None
+            row = connection.execute(
+                "SELECT segment, offset, length FROM archived_conversation WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        segment, offset, length = row
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+
+        for line in self._decompress(segment, data).decode("utf-8").splitlines():
+            conversation = json.loads(line)
+            if conversation["id"] == conversation_id:
+                conversation["started_at"] = _parse_datetime(conversation["started_at"])
+                for message in conversation["messages"]:
+                    message["timestamp"] = _parse_datetime(message["timestamp"])
+                return conversation
+
+        logger.error("Archived conversation %d missing from %s at offset %d", conversation_id, segment, offset)
+        return None
+
+    def list_conversations(self, user_id):
+        """
+        List a user's archived conversations from the index, newest first
+
+        Args:
+            user_id (str): User id (None for anonymous conversations)
+
+        Returns:
+            list: Dicts with id, started_at (datetime), message_count and preview
+        """
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return []
+            rows = connection.execute(
+                "SELECT id, started_at, message_count, preview FROM archived_conversation "
+                "WHERE user_id IS ? ORDER BY started_at DESC",
+                (user_id,),
+            ).fetchall()
+        return [
+            {"id": row[0], "started_at": _parse_datetime(row[1]), "message_count": row[2], "preview": row[3]}
+            for row in rows
+        ]
+
+    def archive_old_conversations(self, db, conversation_model, message_model,
+                                  older_than_days=ARCHIVE_AFTER_DAYS, batch_size=500):
+        """
+        Move conversations without recent messages out of the live tables
+
+        Runs in batches: each batch is written to the segments and indexed,
+        and only then deleted from the database, so an interrupted run never
+        loses conversations (at worst some are archived again next time).
+        Only the messages that were written are deleted, and only while their
+        conversation is still idle; a conversation that received a message
+        after it was read stays live and is dropped from the index again.
+        Must be called inside an application context.
+
+        Args:
+            db (SQLAlchemy): Database handle
+            conversation_model (Model): The Conversation model
+            message_model (Model): The Message model
+            older_than_days (int): Minimum age of the newest message
+            batch_size (int): Conversations moved per transaction
+
+        Returns:
+            int: Number of conversations archived
+        """
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        recent_message = exists().where(
+            message_model.conversation_id == conversation_model.id,
+            message_model.timestamp >= cutoff,
+        )
+        statement = (
+            select(conversation_model.id, conversation_model.user_id, conversation_model.started_at)
+            .where(conversation_model.started_at < cutoff, ~recent_message)
+            .order_by(conversation_model.id)
+            .limit(batch_size)
+        )
+
+        newer = aliased(message_model)
+
+        total = 0
+        last_id = None
+        while True:
+            # Walk forward by id, so conversations kept live below aren't read again
+            batch = statement if last_id is None else statement.where(conversation_model.id > last_id)
+            conversations = [
+                {"id": row.id, "user_id": row.user_id, "started_at": row.started_at, "messages": []}
+                for row in db.session.execute(batch)
+            ]
+            if not conversations:
+                break
+
+            last_id = conversations[-1]["id"]
+            by_id = {conversation["id"]: conversation for conversation in conversations}
+            message_ids = []
+            messages = db.session.execute(
+                select(message_model.id, message_model.conversation_id, message_model.role,
+                       message_model.content, message_model.timestamp)
+                .where(message_model.conversation_id.in_(by_id))
+                .order_by(message_model.conversation_id, message_model.timestamp, message_model.id)
+            )
+            for message in messages:
+                message_ids.append(message.id)
+                by_id[message.conversation_id]["messages"].append(
+                    {"role": message.role, "content": message.content, "timestamp": message.timestamp}
+                )
+            # End the read transaction so the deletes below re-check activity
+            db.session.commit()
+
+            self.write(conversations)
+
+            # Lock the conversation rows where supported (PostgreSQL), so no
+            # message can be added to them until the deletes commit
+            db.session.execute(
+                select(conversation_model.id).where(conversation_model.id.in_(by_id)).with_for_update()
+            )
+            # Delete exactly the archived messages, skipping conversations that
+            # became active since they were read (checked in the same statement)
+            still_idle = (
+                select(conversation_model.id)
+                .where(conversation_model.id.in_(by_id), ~exists().where(
+                    newer.conversation_id == conversation_model.id, newer.timestamp >= cutoff,
+                ))
+            )
+            for start in range(0, len(message_ids), batch_size):
+                db.session.execute(
+                    delete(message_model).where(
+                        message_model.id.in_(message_ids[start:start + batch_size]),
+                        message_model.conversation_id.in_(still_idle),
+                    )
+                )
+            # Conversations keep their row while any message is left
+            db.session.execute(
+                delete(conversation_model).where(
+                    conversation_model.id.in_(by_id),
+                    ~exists().where(message_model.conversation_id == conversation_model.id),
+                )
+            )
+            kept = set(db.session.execute(
+                select(conversation_model.id).where(conversation_model.id.in_(by_id))
+            ).scalars())
+            db.session.commit()
+
+            if kept:
+                # Still live: listed from the database, not the archive
+                self.forget(kept)
+                logger.info("Kept %d conversations that became active while archiving", len(kept))
+
+            archived = len(conversations) - len(kept)
+            total += archived
+            logger.info("Archived %d conversations (%d so far)", archived, total)
+
+        return total
+
+    def forget(self, conversation_ids):
+        """
+        Remove conversations from the index (their segment data stays)
+
+        Args:
+            conversation_ids (iterable): Conversation ids
+        """
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return
+            connection.executemany(
+                "DELETE FROM archived_conversation WHERE id = ?", [(conversation_id,) for conversation_id in conversation_ids]
+            )
+            connection.commit()
+
+    def close(self):
+        """Close the index connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,98 @@
+"""
+Knowledge ingestion rate and peak memory
+
+Writes a synthetic knowledge file as a JSON array and as NDJSON, then builds
+a KnowledgeBase from each in a fresh process, the way the app loads its
+knowledge file (streamed parse, validation and language tagging into the
+compact store, spelling dictionary, TF-IDF fit), and reports entries per
+second and peak RSS. The legacy path (json.load of the whole file, then the
+same build from the decoded entries) is measured the same way for comparison.
+
+Usage:
+    python benchmarks/ingest_throughput.py --entries 200000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from support import peak_rss_bytes
+from synthetic import generate_knowledge, write_knowledge_file
+
+
+def write_ndjson(path, size):
+    """Write a synthetic knowledge base as NDJSON"""
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in generate_knowledge(size):
+            f.write(json.dumps(entry, ensure_ascii=False))
+            f.write("\n")
+
+
+def _run(mode, path, queue):
+    """Run one ingestion mode in this (fresh) process and report the result"""
+    from knowledge_base import KnowledgeBase
+    from knowledge_ingest import validate_entry
+
+    baseline_rss = peak_rss_bytes()
+
+    start = time.perf_counter()
+    if mode == "json.load":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        knowledge_base = KnowledgeBase(path, entries=[entry for entry in (validate_entry(raw) for raw in data) if entry])
+    else:
+        knowledge_base = KnowledgeBase(path)
+    elapsed = time.perf_counter() - start
+    entries = len(knowledge_base.knowledge)
+
+    queue.put({
+        "mode": mode,
+        "entries": entries,
+        "vocabulary": len(knowledge_base.vectorizer.vocabulary_),
+        "elapsed_s": round(elapsed, 3),
+        "entries_per_s": round(entries / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / 1e6, 1),
+        "peak_rss_growth_mb": round((peak_rss_bytes() - baseline_rss) / 1e6, 1),
+    })
+
+
+def run_isolated(mode, path):
+    """Run a mode in a spawned process so its peak RSS isn't shared with others"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(mode, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure knowledge ingestion rate and peak RSS")
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        array_path = os.path.join(tmp, "knowledge.json")
+        ndjson_path = os.path.join(tmp, "knowledge.ndjson")
+        write_knowledge_file(array_path, args.entries)
+        write_ndjson(ndjson_path, args.entries)
+        print(f"File size: {os.path.getsize(array_path) / 1e6:.1f} MB")
+
+        for mode, path in (("json.load", array_path), ("stream-array", array_path), ("stream-ndjson", ndjson_path)):
+            result = run_isolated(mode, path)
+            results.append(result)
+            print(f"{mode:<15} {result['entries_per_s']:>10} entries/s  "
+                  f"peak RSS growth {result['peak_rss_growth_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
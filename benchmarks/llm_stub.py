@@ -0,0 +1,124 @@
+"""
+Local stub of the Anthropic Messages API for exercising the LLM fallback tier
+
+Answers POST /v1/messages with a canned message after a configurable delay,
+and fails a configurable share of requests with 529 (overloaded), so the
+client's pooling, concurrency cap, retries, coalescing and cache can be
+tested without network access or an API key.
+
+Usage:
+    python benchmarks/llm_stub.py --port 8765 --latency 0.2 --error-rate 0.1
+    EVA_LLM_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=stub python main.py
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    """Counters shared by the request handlers"""
+
+    def __init__(self, latency, error_rate):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.peak_active = 0
+
+
+def make_handler(state):
+    """Build a request handler class bound to the given state"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            with state.lock:
+                state.requests += 1
+                state.active += 1
+                state.peak_active = max(state.peak_active, state.active)
+            try:
+                time.sleep(state.latency)
+                if random.random() < state.error_rate:
+                    with state.lock:
+                        state.errors += 1
+                    self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+                    return
+
+                prompt = request.get("messages", [{}])[-1].get("content", "")
+                self._send_json(200, {
+                    "id": f"msg_stub_{state.requests}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request.get("model", "stub"),
+                    "content": [{"type": "text", "text": f"Stub answer to: {prompt}"}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": 1, "output_tokens": 1},
+                })
+            finally:
+                with state.lock:
+                    state.active -= 1
+
+    return Handler
+
+
+def start_stub(port=0, latency=0.1, error_rate=0.0):
+    """
+    Start the stub server in a background thread
+
+    Args:
+        port (int): Port to listen on (0 picks a free one)
+        latency (float): Seconds to wait before answering
+        error_rate (float): Share of requests answered with 529
+
+    Returns:
+        tuple: (server, state); the base URL is http://127.0.0.1:<server.server_port>
+    """
+    state = StubState(latency, error_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server, state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds before each answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failed with 529")
+    args = parser.parse_args(argv)
+
+    server, state = start_stub(args.port, args.latency, args.error_rate)
+    print(f"LLM stub listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"requests={state.requests} errors={state.errors} peak_active={state.peak_active}")
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Logging overhead on the chat path
+
+Runs AIEngine.generate_response over synthetic chat traffic under the legacy
+logging setup (basicConfig at DEBUG, synchronous stream handler) and under
+each environment of logging_config, writing all output to os.devnull, and
+reports messages per second. Also reports the per-call cost of a disabled
+debug call with an eager f-string versus lazy %-style arguments.
+
+Usage:
+    python benchmarks/logging_overhead.py --messages 2000
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import timeit
+
+from support import percentile
+from synthetic import generate_chat_traffic
+
+import logging_config
+
+
+def _reset_root():
+    logging_config.shutdown_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+
+def run_chat_path(engine, messages):
+    """Run the messages through the engine and return (msg/s, p99 ms)"""
+    latencies = []
+    history = []
+    start = time.perf_counter()
+    for message in messages:
+        history.append({"role": "user", "content": message})
+        request_start = time.perf_counter()
+        response = engine.generate_response(message, history[-20:])
+        latencies.append(time.perf_counter() - request_start)
+        history.append({"role": "assistant", "content": response})
+    elapsed = time.perf_counter() - start
+    return len(messages) / elapsed, percentile(latencies, 0.99) * 1000
+
+
+def micro_benchmark(number):
+    """Cost per call of a disabled debug log with eager and lazy formatting"""
+    logger = logging.getLogger("bench.micro")
+    logger.setLevel(logging.INFO)
+    entities = [{"type": "term", "value": f"term {i}"} for i in range(10)]
+
+    eager = timeit.timeit(lambda: logger.debug(f"Extracted entities: {entities}"), number=number)
+    lazy = timeit.timeit(lambda: logger.debug("Extracted entities: %s", entities), number=number)
+    return eager / number * 1e9, lazy / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure logging overhead on the chat path")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    from ai_engine import AIEngine
+
+    messages = generate_chat_traffic(args.messages)
+    devnull = open(os.devnull, "w")
+    results = {}
+
+    _reset_root()
+    engine = AIEngine()
+
+    logging.basicConfig(level=logging.DEBUG, stream=devnull, force=True)
+    results["legacy-debug"] = run_chat_path(engine, messages)
+
+    for environment in ("development", "production"):
+        _reset_root()
+        logging_config.configure_logging(environment, stream=devnull)
+        results[environment] = run_chat_path(engine, messages)
+
+    _reset_root()
+    logging.disable(logging.CRITICAL)
+    results["disabled"] = run_chat_path(engine, messages)
+    logging.disable(logging.NOTSET)
+
+    for name, (rate, p99) in results.items():
+        print(f"{name:<15} {rate:>10.1f} msg/s  p99={p99:.3f}ms")
+
+    eager_ns, lazy_ns = micro_benchmark(200000)
+    print(f"disabled debug call: f-string {eager_ns:.0f}ns, lazy {lazy_ns:.0f}ns")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "chat_path": {name: {"msg_per_s": rate, "p99_ms": p99} for name, (rate, p99) in results.items()},
+                "disabled_debug_call_ns": {"f_string": eager_ns, "lazy": lazy_ns},
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
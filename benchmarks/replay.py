@@ -0,0 +1,340 @@
+"""
+Replay recorded conversations against /chat
+
+Reads the user turns of recorded conversations from the database or from
+NDJSON export files (export.py), and replays every conversation as its own
+session, with its own cookies and therefore its own server-side
+conversation, keeping the original inter-arrival times, optionally sped up
+and multiplied. Reports throughput, latency percentiles, status codes and
+errors per route.
+
+Runs against the Flask app in process (one test client per session) or
+against a running server. The rate limit is per conversation, so each
+replayed session has its own bucket; only the first message of every
+session is counted against this machine's address. Start the server with
+EVA_ADMISSION=0 to measure the pipeline without admission control.
+
+Usage:
+    python benchmarks/replay.py --database-url sqlite:///instance/eva.db --speed 60 --copies 5
+    python benchmarks/replay.py --export exports/ --url http://127.0.0.1:5000 --speed 10 --concurrency 64
+    python benchmarks/replay.py --export exports/messages-20261019T100720.ndjson --max-gap 5 --output replay.json
+"""
+import argparse
+import glob
+import http.cookiejar
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from support import percentile
+
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def read_export(path):
+    """
+    Read user turns from NDJSON export files
+
+    Args:
+        path (str): Export file, or a directory of them
+
+    Yields:
+        tuple: (conversation_id, timestamp, content)
+    """
+    paths = sorted(glob.glob(os.path.join(path, "messages-*.ndjson"))) if os.path.isdir(path) else [path]
+    for file_path in paths:
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if row["role"] == "user":
+                    yield row["conversation_id"], _parse_timestamp(row["timestamp"]), row["content"]
+
+
+def read_database(database_url):
+    """
+    Read user turns from the Message table
+
+    Args:
+        database_url (str): SQLAlchemy database URL
+
+    Yields:
+        tuple: (conversation_id, timestamp, content)
+    """
+    from sqlalchemy import create_engine
+    from export import iter_batches
+
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as connection:
+            for batch in iter_batches(connection, None, datetime.utcnow()):
+                for row in batch:
+                    if row.role == "user":
+                        yield row.conversation_id, row.timestamp, row.content
+    finally:
+        engine.dispose()
+
+
+def build_sessions(turns, speed=1.0, copies=1, max_gap=None, limit=None):
+    """
+    Turn recorded user messages into a replay schedule
+
+    Offsets are measured from the first recorded message and divided by
+    speed; gaps between consecutive messages longer than max_gap (in
+    recorded seconds) are shortened to max_gap, so days of history can be
+    replayed without long idle periods. Each copy replays every conversation
+    again as a separate session.
+
+    Args:
+        turns (iterable): (conversation_id, timestamp, content) tuples
+        speed (float): Time compression factor
+        copies (int): Sessions per recorded conversation
+        max_gap (float, optional): Longest gap kept between messages, in seconds
+        limit (int, optional): Only replay the first conversations
+
+    Returns:
+        list: Sessions as (label, [(offset seconds, content), ...]), by first offset
+    """
+    turns = sorted((t for t in turns if t[1] is not None), key=lambda t: (t[1], t[0]))
+
+    # Map recorded times to replay offsets, shortening long idle periods
+    offsets = []
+    offset = 0.0
+    previous = None
+    for conversation_id, timestamp, content in turns:
+        if previous is not None:
+            gap = (timestamp - previous).total_seconds()
+            offset += min(gap, max_gap) if max_gap is not None else gap
+        previous = timestamp
+        offsets.append((conversation_id, offset / speed, content))
+
+    conversations = {}
+    for conversation_id, replay_offset, content in offsets:
+        if conversation_id not in conversations and limit is not None and len(conversations) >= limit:
+            continue
+        conversations.setdefault(conversation_id, []).append((replay_offset, content))
+
+    sessions = []
+    for copy in range(copies):
+        for conversation_id, schedule in conversations.items():
+            sessions.append((f"{conversation_id}.{copy}", schedule))
+    sessions.sort(key=lambda session: session[1][0][0])
+    return sessions
+
+
+class Stats:
+    """Thread-safe per-route latencies, status codes and errors"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.lateness = []
+
+    def record(self, route, status, latency):
+        with self.lock:
+            route_stats = self.routes.setdefault(route, {"latencies": [], "statuses": {}, "errors": 0})
+            route_stats["latencies"].append(latency)
+            route_stats["statuses"][str(status)] = route_stats["statuses"].get(str(status), 0) + 1
+            if status == "error" or int(status) >= 500:
+                route_stats["errors"] += 1
+
+    def record_lateness(self, seconds):
+        with self.lock:
+            self.lateness.append(seconds)
+
+    def report(self, elapsed):
+        """
+        Summarize the run
+
+        Args:
+            elapsed (float): Wall time of the replay in seconds
+
+        Returns:
+            dict: Per-route requests, rps, error rate, status codes and
+            latency percentiles (ms), plus how late turns started
+        """
+        routes = {}
+        for route, route_stats in sorted(self.routes.items()):
+            latencies = route_stats["latencies"]
+            routes[route] = {
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+                "errors": route_stats["errors"],
+                "error_rate": route_stats["errors"] / len(latencies) if latencies else 0.0,
+                "statuses": route_stats["statuses"],
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p90_ms": percentile(latencies, 0.90) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "max_ms": max(latencies) * 1000 if latencies else 0.0,
+            }
+        return {
+            "seconds": elapsed,
+            "routes": routes,
+            # How far behind schedule turns were sent; large values mean the
+            # replayer (or its concurrency) couldn't keep up with the timeline
+            "lateness_p50_ms": percentile(self.lateness, 0.50) * 1000,
+            "lateness_p99_ms": percentile(self.lateness, 0.99) * 1000,
+        }
+
+
+class HTTPSession:
+    """Client for a running server, keeping the session cookie like a browser"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def post(self, path, payload=None):
+        data = json.dumps(payload or {}).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class AppSession:
+    """
+    Client for the in-process Flask app; the test client keeps its own cookies
+
+    Each session gets its own client address, so per-client rate limits see
+    separate users rather than one busy client.
+    """
+
+    _count = 0
+    _count_lock = threading.Lock()
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        with AppSession._count_lock:
+            AppSession._count += 1
+            number = AppSession._count
+        self.environ = {"REMOTE_ADDR": f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"}
+
+    def post(self, path, payload=None):
+        return self.client.post(path, json=payload or {}, environ_base=self.environ).status_code
+
+
+def replay_session(make_client, schedule, start, stats):
+    """
+    Replay one session: reset its conversation, then send each turn on time
+
+    A turn is never sent before the previous one of the same session was
+    answered, as a user waits for the reply before typing again.
+    """
+    client = make_client()
+
+    def send(route, payload=None):
+        request_start = time.perf_counter()
+        try:
+            status = client.post(route, payload)
+        except Exception:
+            status = "error"
+        stats.record(route, status, time.perf_counter() - request_start)
+
+    send("/reset")
+    for offset, content in schedule:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            stats.record_lateness(-delay)
+        send("/chat", {"message": content})
+
+
+def run_replay(sessions, make_client, concurrency):
+    """
+    Replay sessions on a thread pool
+
+    Args:
+        sessions (list): Output of build_sessions
+        make_client (callable): Returns a new client (own cookies) per session
+        concurrency (int): Sessions replayed at once
+
+    Returns:
+        dict: Report from Stats.report
+    """
+    stats = Stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(replay_session, make_client, schedule, start, stats) for _, schedule in sessions]
+        for future in futures:
+            future.result()
+    return stats.report(time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--database-url", help="Read recorded conversations from this database")
+    source.add_argument("--export", help="Read recorded conversations from an NDJSON export file or directory")
+    parser.add_argument("--url", help="Replay against a running server instead of the in-process app")
+    parser.add_argument("--app-database-url",
+                        help="Database of the in-process app (defaults to a temporary SQLite file)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay N times faster than recorded")
+    parser.add_argument("--copies", type=int, default=1, help="Sessions per recorded conversation")
+    parser.add_argument("--max-gap", type=float, help="Shorten recorded gaps longer than this many seconds")
+    parser.add_argument("--limit", type=int, help="Only replay the first N conversations")
+    parser.add_argument("--concurrency", type=int, default=32, help="Sessions replayed at once")
+    parser.add_argument("--timeout", type=float, default=30.0, help="HTTP timeout per request")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    turns = read_database(args.database_url) if args.database_url else read_export(args.export)
+    sessions = build_sessions(turns, args.speed, args.copies, args.max_gap, args.limit)
+    if not sessions:
+        print("No recorded user messages to replay")
+        return 1
+
+    if args.url:
+        def make_client():
+            return HTTPSession(args.url, args.timeout)
+    else:
+        from support import load_app
+        database_url = args.app_database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'replay.db')}"
+        package = load_app(database_url)
+
+        def make_client():
+            return AppSession(package.app)
+
+    turn_count = sum(len(schedule) for _, schedule in sessions)
+    duration = max(schedule[-1][0] for _, schedule in sessions)
+    print(f"Replaying {turn_count} turns in {len(sessions)} sessions over ~{duration:.1f}s "
+          f"against {args.url or 'the in-process app'}")
+
+    report = run_replay(sessions, make_client, args.concurrency)
+
+    print(f"Finished in {report['seconds']:.1f}s "
+          f"(turns started late: p50 {report['lateness_p50_ms']:.0f} ms, p99 {report['lateness_p99_ms']:.0f} ms)")
+    print(f"  {'route':<10} {'requests':>9} {'rps':>8} {'errors':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}  statuses")
+    for route, route_report in report["routes"].items():
+        print(f"  {route:<10} {route_report['requests']:>9} {route_report['rps']:>8.1f} "
+              f"{route_report['errors']:>7} {route_report['p50_ms']:>9.1f} {route_report['p90_ms']:>9.1f} "
+              f"{route_report['p99_ms']:>9.1f}  {route_report['statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Benchmark suite for the chat pipeline
+
+Measures KnowledgeBase build time and memory, search and query normalization
+latency, NLPProcessor throughput, end-to-end /chat requests per second and
+database write throughput over synthetic corpora, writes the results as JSON
+and compares them against a stored baseline.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 1k,10k --output results.json
+    python benchmarks/run_benchmarks.py --sizes 1k,10k,100k,1m --baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+
+Exits with status 1 when any metric regresses past its threshold.
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from support import ROOT, percentile, current_rss_bytes, load_app
+from synthetic import write_knowledge_file, generate_queries, generate_chat_traffic, add_typos
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def parse_size(value):
+    """Parse sizes such as 1000, 10k or 1m"""
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith("k"):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith("m"):
+        multiplier, value = 1000000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def size_label(size):
+    """Format a corpus size for metric names"""
+    if size >= 1000000 and size % 1000000 == 0:
+        return f"{size // 1000000}m"
+    if size >= 1000 and size % 1000 == 0:
+        return f"{size // 1000}k"
+    return str(size)
+
+
+class Results:
+    """Collects benchmark metrics with their unit and direction"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        """
+        Record a metric
+
+        Args:
+            name (str): Metric name
+            value (float): Measured value
+            unit (str): Unit of the value
+            better (str): "lower" or "higher"
+        """
+        self.metrics[name] = {"value": round(value, 6), "unit": unit, "better": better}
+        print(f"  {name:<45} {value:>14.4f} {unit}")
+
+
+def bench_knowledge_base(results, size, workdir, query_count):
+    """Build a KnowledgeBase over a synthetic corpus and time searches against it"""
+    from knowledge_base import KnowledgeBase
+
+    label = size_label(size)
+    path = os.path.join(workdir, f"knowledge-{label}.json")
+    write_knowledge_file(path, size)
+
+    gc.collect()
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    kb = KnowledgeBase(path)
+    build_time = time.perf_counter() - start
+    rss_after = current_rss_bytes()
+
+    results.add(f"kb.{label}.build_time", build_time, "s", "lower")
+    results.add(f"kb.{label}.build_rss", (rss_after - rss_before) / 1e6, "MB", "lower")
+
+    latencies = []
+    for query in generate_queries(query_count, size):
+        start = time.perf_counter()
+        kb.search(query)
+        latencies.append(time.perf_counter() - start)
+
+    results.add(f"kb.{label}.search_p50", percentile(latencies, 0.50) * 1000, "ms", "lower")
+    results.add(f"kb.{label}.search_p99", percentile(latencies, 0.99) * 1000, "ms", "lower")
+
+    # Query normalization stage alone, on misspelled queries
+    latencies = []
+    for query in add_typos(generate_queries(query_count, size, seed=17)):
+        start = time.perf_counter()
+        kb.normalizer.normalize(query)
+        latencies.append(time.perf_counter() - start)
+
+    results.add(f"kb.{label}.normalize_p50", percentile(latencies, 0.50) * 1e6, "us", "lower")
+    results.add(f"kb.{label}.normalize_p99", percentile(latencies, 0.99) * 1e6, "us", "lower")
+
+    del kb
+    gc.collect()
+    os.remove(path)
+
+
+def bench_nlp(results, messages):
+    """Measure NLPProcessor preprocessing and intent classification throughput"""
+    from nlp_utils import NLPProcessor
+
+    nlp = NLPProcessor()
+
+    start = time.perf_counter()
+    processed = [nlp.preprocess_text(message) for message in messages]
+    elapsed = time.perf_counter() - start
+    results.add("nlp.preprocess_text", len(messages) / elapsed, "msg/s", "higher")
+
+    start = time.perf_counter()
+    for text in processed:
+        nlp.classify_intent(text)
+    elapsed = time.perf_counter() - start
+    results.add("nlp.classify_intent", len(processed) / elapsed, "msg/s", "higher")
+
+
+def bench_chat(results, workdir, messages, kb_size):
+    """Measure end-to-end /chat requests per second through Flask's test client"""
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    write_knowledge_file(os.path.join(data_dir, "knowledge.json"), kb_size)
+
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        package = load_app(f"sqlite:///{os.path.join(workdir, 'chat.db')}")
+        client = package.app.test_client()
+
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        for index, message in enumerate(messages):
+            # Start a fresh conversation every 20 turns, like a user reloading the page
+            if index % 20 == 0:
+                client.post("/reset")
+            request_start = time.perf_counter()
+            response = client.post("/chat", json={"message": message})
+            latencies.append(time.perf_counter() - request_start)
+            if response.status_code != 200:
+                errors += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(previous_cwd)
+
+    results.add("chat.rps", len(messages) / elapsed, "req/s", "higher")
+    results.add("chat.p50", percentile(latencies, 0.50) * 1000, "ms", "lower")
+    results.add("chat.p99", percentile(latencies, 0.99) * 1000, "ms", "lower")
+    results.add("chat.errors", errors, "count", "lower")
+
+
+def bench_db_writes(results, threads, turns):
+    """Measure committed message inserts per second with the tuned SQLite profile"""
+    from db_write_concurrency import run_profile
+    from db_profiles import get_engine_options
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'writes.db')}"
+        result = run_profile("sqlite-wal", url, get_engine_options(url), True, threads, turns)
+
+    results.add("db.write_commits", result["commits_per_s"], "commits/s", "higher")
+    results.add("db.write_p99", result["p99_ms"], "ms", "lower")
+
+
+def load_thresholds(path):
+    """Load per-metric thresholds: a JSON object of metric glob patterns to fractions"""
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def threshold_for(name, default, overrides):
+    """Find the regression threshold that applies to a metric"""
+    for pattern, value in overrides.items():
+        if fnmatch.fnmatch(name, pattern):
+            return value
+    return default
+
+
+def compare(current, baseline, default_threshold, overrides):
+    """
+    Compare results against a baseline
+
+    Args:
+        current (dict): Current metrics
+        baseline (dict): Baseline metrics
+        default_threshold (float): Allowed relative regression, e.g. 0.1 for 10%
+        overrides (dict): Metric glob pattern -> threshold
+
+    Returns:
+        list: Regressions as (name, baseline value, current value, relative change)
+    """
+    regressions = []
+    for name, metric in current.items():
+        base = baseline.get(name)
+        if not base or not base["value"]:
+            continue
+
+        change = (metric["value"] - base["value"]) / base["value"]
+        if metric["better"] == "higher":
+            change = -change
+
+        if change > threshold_for(name, default_threshold, overrides):
+            regressions.append((name, base["value"], metric["value"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat pipeline")
+    parser.add_argument("--sizes", default="1k,10k,100k,1m", help="Comma separated corpus sizes")
+    parser.add_argument("--queries", type=int, default=200, help="Search queries per corpus")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages for the NLP benchmark")
+    parser.add_argument("--chat-requests", type=int, default=500, help="Requests for the /chat benchmark")
+    parser.add_argument("--chat-kb-size", default="1k", help="Knowledge base size behind /chat")
+    parser.add_argument("--db-threads", type=int, default=8)
+    parser.add_argument("--db-turns", type=int, default=100)
+    parser.add_argument("--skip", default="", help="Comma separated groups to skip: kb,nlp,chat,db")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against this baseline JSON")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Store results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Default allowed regression (fraction)")
+    parser.add_argument("--thresholds", help="JSON file with per-metric thresholds (glob patterns)")
+    args = parser.parse_args()
+
+    skip = {group.strip() for group in args.skip.split(",") if group.strip()}
+    results = Results()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if "kb" not in skip:
+            for size in [parse_size(size) for size in args.sizes.split(",")]:
+                print(f"KnowledgeBase ({size_label(size)} entries)")
+                bench_knowledge_base(results, size, workdir, args.queries)
+
+        if "nlp" not in skip:
+            print("NLPProcessor")
+            bench_nlp(results, generate_chat_traffic(args.messages))
+
+        if "chat" not in skip:
+            print("/chat")
+            bench_chat(results, workdir, generate_chat_traffic(args.chat_requests, seed=13),
+                       parse_size(args.chat_kb_size))
+
+        if "db" not in skip:
+            print("Database writes")
+            bench_db_writes(results, args.db_threads, args.db_turns)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+        },
+        "metrics": results.metrics,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results.metrics, baseline["metrics"], args.threshold, load_thresholds(args.thresholds))
+        if regressions:
+            print("Regressions:")
+            for name, base, current, change in regressions:
+                print(f"  {name}: {base} -> {current} ({change:+.1%})")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
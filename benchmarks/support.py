@@ -0,0 +1,92 @@
+"""
+Shared helpers for the benchmark scripts
+"""
+import importlib.util
+import os
+import resource
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers
+
+    Args:
+        values (list): Samples
+        fraction (float): Percentile as a fraction (0-1)
+
+    Returns:
+        float: The percentile, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def current_rss_bytes():
+    """
+    Resident set size of this process
+
+    Reads /proc/self/statm where available and falls back to the peak RSS
+    reported by getrusage elsewhere.
+
+    Returns:
+        int: RSS in bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process
+
+    Returns:
+        int: Peak RSS in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def load_app(database_url):
+    """
+    Import the Flask application package from the repository root
+
+    The application modules live flat in the repository but import each other
+    as the "app" package, so the package is registered under that name
+    regardless of the checkout's directory name.
+
+    Args:
+        database_url (str): Database URL to configure before the app is created
+
+    Returns:
+        module: The imported app package (exposes app and db)
+    """
+    os.environ["DATABASE_URL"] = database_url
+    if "app" in sys.modules and hasattr(sys.modules["app"], "db"):
+        return sys.modules["app"]
+
+    spec = importlib.util.spec_from_file_location(
+        "app", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["app"] = package
+    spec.loader.exec_module(package)
+
+    import models  # noqa: F401
+
+    with package.app.app_context():
+        package.db.create_all()
+    return package
@@ -0,0 +1,171 @@
+"""
+Synthetic corpora and chat traffic for the benchmarks
+
+Everything is generated from a seeded random.Random, so the same size and
+seed always produce the same knowledge base and the same traffic.
+"""
+import json
+import random
+
+EN_WORDS = [
+    "protein", "enzyme", "cell", "membrane", "nucleus", "ribosome", "genome", "mutation",
+    "receptor", "antibody", "virus", "bacteria", "molecule", "network", "algorithm", "energy",
+    "signal", "pathway", "structure", "sequence", "transport", "memory", "learning", "model",
+    "computer", "storage", "planet", "climate", "ocean", "water", "light", "carbon",
+]
+
+PT_WORDS = [
+    "proteína", "enzima", "célula", "membrana", "núcleo", "ribossomo", "genoma", "mutação",
+    "receptor", "anticorpo", "vírus", "bactéria", "molécula", "rede", "algoritmo", "energia",
+    "sinal", "via", "estrutura", "sequência", "transporte", "memória", "aprendizado", "modelo",
+    "computador", "armazenamento", "planeta", "clima", "oceano", "água", "luz", "carbono",
+]
+
+EN_FILLER = [
+    "is", "a", "process", "that", "controls", "how", "the", "system", "changes", "over", "time",
+    "and", "depends", "on", "many", "factors", "inside", "living", "organisms", "with", "data",
+]
+
+PT_FILLER = [
+    "é", "um", "processo", "que", "controla", "como", "o", "sistema", "muda", "ao", "longo",
+    "do", "tempo", "e", "depende", "de", "muitos", "fatores", "em", "organismos", "vivos",
+]
+
+CATEGORIES = ["science", "technology", "biology", "medicine", "geography", "chemistry", "physics", "identity"]
+
+EN_QUESTIONS = ["What is {topic}?", "How does {topic} work?", "Why is {topic} important?", "Explain {topic}"]
+PT_QUESTIONS = ["O que é {topic}?", "Como funciona {topic}?", "Por que {topic} é importante?", "Explique {topic}"]
+
+CHAT_MESSAGES = {
+    "greeting": ["hello", "hi there", "good morning", "olá", "oi tudo bem", "bom dia"],
+    "farewell": ["bye", "see you later", "tchau", "até logo", "até mais"],
+    "conversation": ["I think {topic} is fascinating", "eu acho {topic} interessante", "let's talk about {topic}"],
+    "command": ["tell me about {topic}", "me fale sobre {topic}", "find {topic}", "define {topic}"],
+}
+
+
+def _topic(words, index):
+    """Build a topic name that is unique per index"""
+    first = words[index % len(words)]
+    second = words[(index // len(words)) % len(words)]
+    return f"{first} {second} {index}"
+
+
+def _sentence(rng, filler, topic, length):
+    """Build a filler sentence that mentions the topic"""
+    words = [rng.choice(filler) for _ in range(length)]
+    words.insert(rng.randrange(len(words) + 1), topic)
+    return " ".join(words).capitalize() + "."
+
+
+def generate_knowledge(size, seed=42):
+    """
+    Generate knowledge entries alternating between English and Portuguese
+
+    Args:
+        size (int): Number of entries
+        seed (int): Random seed
+
+    Yields:
+        dict: Knowledge entry with question, answer and category
+    """
+    rng = random.Random(seed)
+    for index in range(size):
+        if index % 2 == 0:
+            words, filler, templates = EN_WORDS, EN_FILLER, EN_QUESTIONS
+        else:
+            words, filler, templates = PT_WORDS, PT_FILLER, PT_QUESTIONS
+        topic = _topic(words, index // 2)
+        yield {
+            "question": rng.choice(templates).format(topic=topic),
+            "answer": _sentence(rng, filler, topic, rng.randint(12, 30)),
+            "category": rng.choice(CATEGORIES),
+        }
+
+
+def write_knowledge_file(path, size, seed=42):
+    """
+    Write a synthetic knowledge base as a JSON array without building it in memory
+
+    Args:
+        path (str): Destination file
+        size (int): Number of entries
+        seed (int): Random seed
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for index, entry in enumerate(generate_knowledge(size, seed)):
+            if index:
+                f.write(",\n")
+            f.write(json.dumps(entry, ensure_ascii=False))
+        f.write("\n]\n")
+
+
+def generate_queries(count, size, seed=7):
+    """
+    Generate search queries about topics that exist in a corpus of the given size
+
+    Args:
+        count (int): Number of queries
+        size (int): Size of the corpus the queries target
+        seed (int): Random seed
+
+    Returns:
+        list: Query strings
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        index = rng.randrange(max(size, 1))
+        words = EN_WORDS if index % 2 == 0 else PT_WORDS
+        queries.append(_topic(words, index // 2))
+    return queries
+
+
+def add_typos(queries, seed=13):
+    """
+    Swap two adjacent letters in one word of each query, like a hurried typist
+
+    Args:
+        queries (list): Query strings
+        seed (int): Random seed
+
+    Returns:
+        list: Queries with one transposition each (words of 4+ letters only)
+    """
+    rng = random.Random(seed)
+    typoed = []
+    for query in queries:
+        words = query.split()
+        candidates = [index for index, word in enumerate(words) if len(word) >= 4 and word.isalpha()]
+        if candidates:
+            index = rng.choice(candidates)
+            word = words[index]
+            position = rng.randrange(len(word) - 1)
+            words[index] = word[:position] + word[position + 1] + word[position] + word[position + 2:]
+        typoed.append(" ".join(words))
+    return typoed
+
+
+def generate_chat_traffic(count, seed=11):
+    """
+    Generate a mix of chat messages covering every intent in both languages
+
+    Args:
+        count (int): Number of messages
+        seed (int): Random seed
+
+    Returns:
+        list: Chat messages
+    """
+    rng = random.Random(seed)
+    messages = []
+    for index in range(count):
+        if rng.random() < 0.5:
+            words, templates = (EN_WORDS, EN_QUESTIONS) if index % 2 == 0 else (PT_WORDS, PT_QUESTIONS)
+            messages.append(rng.choice(templates).format(topic=rng.choice(words)))
+        else:
+            intent = rng.choice(list(CHAT_MESSAGES))
+            template = rng.choice(CHAT_MESSAGES[intent])
+            messages.append(template.format(topic=rng.choice(EN_WORDS + PT_WORDS)))
+    return messages
@@ -49,6 +49,10 @@ document.addEventListener('DOMContentLoaded', function() {
             body: JSON.stringify({ message: message })
         })
         .then(response => {
+            // Rate limited or overloaded: the server explains in the response body
+            if (response.status === 429 || response.status === 503) {
+                return response.json();
+            }
             if (!response.ok) {
                 throw new Error('Resposta da rede não foi ok');
             }
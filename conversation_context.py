@@ -0,0 +1,104 @@
+import logging
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# User messages whose topics make up the context (the current one included)
+CONTEXT_WINDOW = 3
+
+# Topics exposed to the response generator
+MAX_TOPICS = 3
+
+
+class ConversationContext:
+    """
+    Running context of one conversation, updated once per user message
+
+    Keeps the topics of the last CONTEXT_WINDOW user messages together with
+    their running counts, and a pointer to the previous user message when it
+    was a question. Each message is analysed once, when it arrives, so the
+    cost of a turn doesn't grow with the history. The state is plain JSON and
+    is stored in the session next to the conversation.
+    """
+
+    def __init__(self, window=None, counts=None, last_question=None, latest_question=None):
+        """
+        Initialize the context
+
+        Args:
+            window (list, optional): Topic lists of the most recent user messages
+            counts (dict, optional): Topic -> occurrences within the window
+            last_question (str, optional): Previous user message, if it was a question
+            latest_question (str, optional): Latest user message, if it was a question
+        """
+        self.window = deque(window or [], maxlen=CONTEXT_WINDOW)
+        self.counts = Counter(counts or {})
+        self.last_question = last_question
+        self.latest_question = latest_question
+
+    def observe(self, message, topics, is_question):
+        """
+        Add a user message to the context
+
+        Args:
+            message (str): The user's message
+            topics (list): Topics extracted from the message
+            is_question (bool): Whether the message is a question
+        """
+        if len(self.window) == self.window.maxlen:
+            # Drop the oldest message's topics from the running counts
+            self.counts.subtract(self.window[0])
+            self.counts += Counter()
+        self.window.append(list(topics))
+        self.counts.update(topics)
+
+        self.last_question = self.latest_question
+        self.latest_question = message if is_question else None
+
+    @property
+    def topics(self):
+        """Most frequent topics in the window, most recent first on ties"""
+        recency = {}
+        for position, topics in enumerate(self.window):
+            for topic in topics:
+                recency[topic] = position
+        ranked = sorted(self.counts, key=lambda topic: (self.counts[topic], recency.get(topic, -1)), reverse=True)
+        return ranked[:MAX_TOPICS]
+
+    def as_dict(self):
+        """
+        Context in the format expected by ResponseGenerator.generate_contextual_response
+
+        Returns:
+            dict: Topics, sentiment and last question
+        """
+        return {"topics": self.topics, "sentiment": "neutral", "last_question": self.last_question}
+
+    def to_dict(self):
+        """Serialize the state for the session"""
+        return {
+            "window": list(self.window),
+            "counts": dict(self.counts),
+            "last_question": self.last_question,
+            "latest_question": self.latest_question,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Restore a context serialized with to_dict
+
+        Args:
+            data (dict): Serialized state, or None for an empty context
+
+        Returns:
+            ConversationContext: The context
+        """
+        if not data:
+            return cls()
+        return cls(
+            window=data.get("window"),
+            counts=data.get("counts"),
+            last_question=data.get("last_question"),
+            latest_question=data.get("latest_question"),
+        )
@@ -0,0 +1,139 @@
+import re
+import bisect
+import logging
+from query_normalizer import fold_accents
+
+logger = logging.getLogger(__name__)
+
+# Questions that define a term, matched after normalization (accents folded)
+DEFINITION_PATTERNS = [
+    re.compile(r"^what (?:is|are) (?:(?:a|an|the) )?(.+)$"),
+    re.compile(r"^o que (?:e|sao|significa) (?:(?:o|a|os|as|um|uma) )?(.+)$"),
+]
+
+# Shortest partial last word allowed to be completed by prefix
+MIN_PREFIX_LENGTH = 3
+
+
+def normalize_term(text):
+    """
+    Normalize a term for lookups: lowercase, accents folded, punctuation removed
+
+    Args:
+        text (str): Raw term or question
+
+    Returns:
+        str: Normalized text with single spaces
+    """
+    text = fold_accents(text.lower())
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+def extract_defined_term(question):
+    """
+    Extract the term a "What is X?" / "O que é X?" question defines
+
+    Args:
+        question (str): Knowledge base question
+
+    Returns:
+        str: Normalized term, or None if the question isn't a definition
+    """
+    normalized = normalize_term(question)
+    for pattern in DEFINITION_PATTERNS:
+        match = pattern.match(normalized)
+        if match:
+            return match.group(1)
+    return None
+
+
+class DefinitionIndex:
+    """
+    Sorted index of defined terms to knowledge rows
+
+    Built once per knowledge snapshot. Lookups are a binary search for an exact
+    match, then for a term the query completes, so no vector scoring is
+    involved. A completion only finishes the query's last word within a term
+    of as many words ("photosynth" -> "photosynthesis", "neural network" ->
+    "neural networks") and must be the only one; a query is never extended
+    with more words ("capital" doesn't match "capital of france") and an
+    ambiguous partial word matches nothing.
+    """
+
+    def __init__(self, terms=None, rows=None):
+        """
+        Initialize the index
+
+        Args:
+            terms (list, optional): Sorted normalized terms
+            rows (list, optional): Knowledge row for each term
+        """
+        self.terms = terms or []
+        self.rows = rows or []
+
+        # Terms (still sorted) and rows by number of words, for completions
+        self._by_words = {}
+        for term, row in zip(self.terms, self.rows):
+            words_terms, words_rows = self._by_words.setdefault(term.count(" ") + 1, ([], []))
+            words_terms.append(term)
+            words_rows.append(row)
+
+    @classmethod
+    def build(cls, store):
+        """
+        Build the index from the questions of a knowledge store
+
+        The first entry defining a term wins, matching the order search results
+        would have on a tie.
+
+        Args:
+            store (CompactKnowledgeStore): Knowledge entries
+
+        Returns:
+            DefinitionIndex: The index
+        """
+        definitions = {}
+        for index in range(len(store)):
+            term = extract_defined_term(store.question(index))
+            if term and term not in definitions:
+                definitions[term] = index
+
+        terms = sorted(definitions)
+        index = cls(terms, [definitions[term] for term in terms])
+        logger.info("Definition index built with %d terms", len(terms))
+        return index
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, term):
+        """
+        Find the knowledge row defining a term
+
+        Args:
+            term (str): Term as typed or extracted from the user input
+
+        Returns:
+            int: Knowledge row, or None if no term matches exactly or is its
+            only completion
+        """
+        key = normalize_term(term)
+        if not key:
+            return None
+
+        position = bisect.bisect_left(self.terms, key)
+        if position < len(self.terms) and self.terms[position] == key:
+            return self.rows[position]
+
+        if len(key.rsplit(" ", 1)[-1]) < MIN_PREFIX_LENGTH:
+            return None
+
+        terms, rows = self._by_words.get(key.count(" ") + 1, ((), ()))
+        position = bisect.bisect_left(terms, key)
+        if position < len(terms) and terms[position].startswith(key):
+            if position + 1 < len(terms) and terms[position + 1].startswith(key):
+                # Ambiguous: more than one term completes the query
+                return None
+            return rows[position]
+
+        return None
@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Retrieval backend used by KnowledgeBase.search: tfidf (default), dense or hybrid
+RETRIEVAL_MODE = os.environ.get("EVA_RETRIEVAL_MODE", "tfidf")
+
+# Directory holding the precomputed embeddings (see "python dense_retrieval.py build")
+DENSE_INDEX_DIR = os.environ.get("EVA_DENSE_INDEX_DIR", "data/dense")
+
+# Weight of the dense score in hybrid mode; TF-IDF gets the rest
+HYBRID_DENSE_WEIGHT = float(os.environ.get("EVA_HYBRID_DENSE_WEIGHT", 0.5))
+
+# Results kept after scoring in dense and hybrid modes
+RETRIEVAL_TOP_K = int(os.environ.get("EVA_RETRIEVAL_TOP_K", 10))
+
+DEFAULT_DIMENSIONS = 512
+DEFAULT_NGRAM_RANGE = (3, 5)
+
+# Whether to keep a float32 copy of the matrix, which makes each query a
+# single matrix product (~9x faster than converting float16 blocks per query).
+# Unset, matrices built in memory are upcast and memory-mapped ones are scored
+# from the shared float16 pages; EVA_DENSE_UPCAST=1 or 0 forces either way.
+DENSE_UPCAST = {"1": True, "0": False}.get(os.environ.get("EVA_DENSE_UPCAST"))
+
+# Rows converted to float32 and multiplied per block when not upcast
+SCORE_BLOCK_ROWS = 65536
+
+EMBEDDINGS_FILE = "embeddings.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+class HashedNgramEmbedder:
+    """
+    Stateless text embedder based on hashed character n-grams
+
+    Character n-grams within word boundaries are hashed into a fixed number of
+    dimensions and L2-normalized, so the dot product of two embeddings is
+    their cosine similarity. Accents are folded, which makes "inteligencia"
+    and "inteligência" match, and no vocabulary has to be fitted or stored.
+    """
+
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS, ngram_range=DEFAULT_NGRAM_RANGE):
+        """
+        Initialize the embedder
+
+        Args:
+            dimensions (int): Embedding size
+            ngram_range (tuple): Min and max character n-gram lengths
+        """
+        self.dimensions = dimensions
+        self.ngram_range = tuple(ngram_range)
+        self.vectorizer = HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=self.ngram_range,
+            n_features=dimensions,
+            strip_accents="unicode",
+            lowercase=True,
+            norm="l2",
+            dtype=np.float32,
+        )
+
+    def embed(self, texts):
+        """
+        Embed a batch of texts
+
+        Args:
+            texts (list): Texts to embed
+
+        Returns:
+            numpy.ndarray: float32 matrix of shape (len(texts), dimensions)
+        """
+        return self.vectorizer.transform(texts).toarray()
+
+
+def store_fingerprint(store):
+    """
+    Fingerprint the questions of a knowledge store
+
+    Used to check that precomputed embeddings belong to the snapshot loading
+    them.
+
+    Args:
+        store (CompactKnowledgeStore): Knowledge entries
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(store.question_offsets).tobytes())
+    digest.update(np.ascontiguousarray(store.question_buffer).tobytes())
+    return digest.hexdigest()
+
+
+def _iter_question_batches(store, batch_size):
+    for start in range(0, len(store), batch_size):
+        end = min(start + batch_size, len(store))
+        yield start, end, [store.question(index) for index in range(start, end)]
+
+
+def write_index(store, directory, embedder=None, batch_size=4096):
+    """
+    Precompute the question embeddings of a store into a float16 .npy file
+
+    Embeddings are written batch by batch into a memory-mapped file, so the
+    full float32 matrix never has to fit in memory.
+
+    Args:
+        store (CompactKnowledgeStore): Knowledge entries
+        directory (str): Destination directory (created if needed)
+        embedder (HashedNgramEmbedder, optional): Embedder to use
+        batch_size (int): Questions embedded per batch
+    """
+    embedder = embedder or HashedNgramEmbedder()
+    os.makedirs(directory, exist_ok=True)
+
+    embeddings = np.lib.format.open_memmap(
+        os.path.join(directory, EMBEDDINGS_FILE), mode="w+", dtype=np.float16,
+        shape=(len(store), embedder.dimensions),
+    )
+    for start, end, questions in _iter_question_batches(store, batch_size):
+        embeddings[start:end] = embedder.embed(questions)
+    embeddings.flush()
+    del embeddings
+
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump({
+            "dimensions": embedder.dimensions,
+            "ngram_range": list(embedder.ngram_range),
+            "count": len(store),
+            "fingerprint": store_fingerprint(store),
+        }, f)
+    logger.info("Wrote %d dense embeddings to %s", len(store), directory)
+
+
+class DenseIndex:
+    """
+    Question embeddings of a knowledge snapshot, scored with a matrix product
+
+    The float16 matrix is memory-mapped from a directory written by
+    write_index or embedded in memory by build(). An upcast index converts it
+    to float32 once, when it is created, and each query is a single
+    matrix-vector product; otherwise blocks are converted on every query,
+    which keeps a memory-mapped matrix shared between processes. By default
+    only in-memory matrices, already private to the process, are upcast.
+    """
+
+    def __init__(self, embeddings, embedder, upcast=None):
+        """
+        Initialize the index
+
+        Args:
+            embeddings (numpy.ndarray): float16 matrix, one row per entry
+            embedder (HashedNgramEmbedder): Embedder used for the rows
+            upcast (bool, optional): Keep a float32 copy; defaults to
+                EVA_DENSE_UPCAST, or to whether the matrix isn't memory-mapped
+        """
+        self.embeddings = embeddings
+        self.embedder = embedder
+        if upcast is None:
+            upcast = DENSE_UPCAST if DENSE_UPCAST is not None else not isinstance(embeddings, np.memmap)
+        self.matrix = np.asarray(embeddings, dtype=np.float32) if upcast else None
+
+    @classmethod
+    def build(cls, store, embedder=None, batch_size=4096):
+        """
+        Embed a store in memory
+
+        Args:
+            store (CompactKnowledgeStore): Knowledge entries
+            embedder (HashedNgramEmbedder, optional): Embedder to use
+            batch_size (int): Questions embedded per batch
+
+        Returns:
+            DenseIndex: The index
+        """
+        embedder = embedder or HashedNgramEmbedder()
+        embeddings = np.empty((len(store), embedder.dimensions), dtype=np.float16)
+        for start, end, questions in _iter_question_batches(store, batch_size):
+            embeddings[start:end] = embedder.embed(questions)
+        return cls(embeddings, embedder)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load embeddings written by write_index
+
+        Args:
+            directory (str): Index directory
+            mmap (bool): Memory-map the matrix instead of reading it
+
+        Returns:
+            tuple: (DenseIndex, manifest dict)
+        """
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+
+        embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r" if mmap else None)
+        embedder = HashedNgramEmbedder(manifest["dimensions"], manifest["ngram_range"])
+        return cls(embeddings, embedder), manifest
+
+    @classmethod
+    def for_store(cls, store, directory=DENSE_INDEX_DIR):
+        """
+        Get the index for a snapshot, preferring the precomputed one
+
+        The precomputed matrix is used when its fingerprint matches the store;
+        otherwise (e.g. a database snapshot with new rows) the store is
+        embedded in memory.
+
+        Args:
+            store (CompactKnowledgeStore): Knowledge entries
+            directory (str): Directory written by write_index
+
+        Returns:
+            DenseIndex: The index
+        """
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("count") == len(store) and manifest.get("fingerprint") == store_fingerprint(store):
+                logger.info("Using precomputed dense embeddings from %s", directory)
+                return cls.load(directory)[0]
+            logger.warning("Dense embeddings in %s don't match the knowledge snapshot, embedding in memory", directory)
+
+        return cls.build(store)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def score(self, query, rows=None):
+        """
+        Cosine similarity between a query and every (or some) entries
+
+        Args:
+            query (str): Query text
+            rows (numpy.ndarray, optional): Only score these rows
+
+        Returns:
+            numpy.ndarray: float32 similarities, aligned with rows when given
+        """
+        query_vector = self.embedder.embed([query])[0]
+        if self.matrix is not None:
+            matrix = self.matrix if rows is None else self.matrix[rows]
+            return matrix @ query_vector
+
+        embeddings = self.embeddings if rows is None else self.embeddings[rows]
+        similarities = np.empty(len(embeddings), dtype=np.float32)
+        for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            np.dot(block, query_vector, out=similarities[start:start + len(block)])
+        return similarities
+
+
+def top_k(similarities, k, threshold):
+    """
+    Positions of the k best scores above a threshold, best first
+
+    Uses argpartition, so only the selected scores are sorted.
+
+    Args:
+        similarities (numpy.ndarray): Scores
+        k (int): Maximum number of positions
+        threshold (float): Minimum score (exclusive)
+
+    Returns:
+        numpy.ndarray: Positions sorted by descending score
+    """
+    candidates = np.flatnonzero(similarities > threshold)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(similarities[candidates], -k)[-k:]]
+    return candidates[np.argsort(-similarities[candidates], kind="stable")]
+
+
+def main(argv=None):
+    """Command line entry point: precompute embeddings for a knowledge file or store"""
+    from knowledge_ingest import iter_entries
+    from knowledge_store import CompactKnowledgeStore
+
+    parser = argparse.ArgumentParser(description="Precompute dense embeddings for the knowledge base")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Embed every question into a float16 matrix")
+    source = build.add_mutually_exclusive_group()
+    source.add_argument("--knowledge", default="data/knowledge.json", help="JSON or NDJSON knowledge file")
+    source.add_argument("--store", help="Directory of a saved CompactKnowledgeStore")
+    build.add_argument("--output", default=DENSE_INDEX_DIR, help="Destination directory")
+    build.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help="Embedding size")
+    build.add_argument("--batch-size", type=int, default=4096, help="Questions embedded per batch")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.store:
+        store = CompactKnowledgeStore.load(args.store)
+    else:
+        store = CompactKnowledgeStore.from_entries(iter_entries(args.knowledge))
+
+    write_index(store, args.output, HashedNgramEmbedder(args.dimensions), batch_size=args.batch_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
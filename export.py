@@ -0,0 +1,422 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, select, table, column, func, text, or_, and_, Integer, DateTime
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Where export files and the watermark state are written
+EXPORT_DIR = os.environ.get("EVA_EXPORT_DIR", "exports")
+
+# Rows fetched per round trip from the server-side cursor (and per Parquet row group)
+EXPORT_BATCH_SIZE = int(os.environ.get("EVA_EXPORT_BATCH_SIZE", 5000))
+
+# Messages younger than this are left for the next run, so transactions still
+# in flight when the export starts have committed before their rows are read
+EXPORT_LAG_SECONDS = float(os.environ.get("EVA_EXPORT_LAG_SECONDS", 300))
+
+STATE_FILE = "state.json"
+FORMATS = {"ndjson": "ndjson", "parquet": "parquet"}
+
+# Lightweight table clauses, so export workers don't need the Flask app or the models
+conversation_table = table(
+    "conversation", column("id", Integer), column("user_id"), column("started_at", DateTime)
+)
+message_table = table(
+    "message", column("id", Integer), column("conversation_id", Integer), column("role"), column("content"),
+    column("timestamp", DateTime),
+)
+
+COLUMNS = ["id", "conversation_id", "user_id", "conversation_started_at", "role", "content", "timestamp"]
+
+# Index the export pages are read in order from (also declared on the model)
+MESSAGE_ORDER_INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_message_timestamp_id ON message (timestamp, id)"
+
+
+def ensure_order_index(engine):
+    """
+    Create the (timestamp, id) index on databases created before the model declared it
+
+    Args:
+        engine (Engine): Database engine
+    """
+    with engine.begin() as connection:
+        connection.execute(text(MESSAGE_ORDER_INDEX_DDL))
+
+
+def message_query(after, until, since=None):
+    """
+    Messages with their conversation fields after a cursor, in (timestamp, id) order
+
+    Args:
+        after (tuple): Exclusive (timestamp, id) cursor, or None to start at the beginning
+        until (datetime): Inclusive upper bound of Message.timestamp
+        since (datetime, optional): Exclusive lower bound of Message.timestamp
+
+    Returns:
+        Select: The statement
+    """
+    message, conversation = message_table, conversation_table
+    statement = (
+        select(
+            message.c.id, message.c.conversation_id, conversation.c.user_id,
+            conversation.c.started_at.label("conversation_started_at"),
+            message.c.role, message.c.content, message.c.timestamp,
+        )
+        .select_from(message.join(conversation, message.c.conversation_id == conversation.c.id))
+        .where(message.c.timestamp <= until)
+        .order_by(message.c.timestamp, message.c.id)
+    )
+    if after is not None:
+        after_timestamp, after_id = after
+        # The plain bound lets the (timestamp, id) index serve the range
+        statement = statement.where(message.c.timestamp >= after_timestamp, or_(
+            message.c.timestamp > after_timestamp,
+            and_(message.c.timestamp == after_timestamp, message.c.id > after_id),
+        ))
+    if since is not None:
+        statement = statement.where(message.c.timestamp > since)
+    return statement
+
+
+def time_slices(connection, after, until, parts):
+    """
+    Split the messages to export into contiguous timestamp ranges
+
+    Each range is read from its own part of the (timestamp, id) index, so
+    parallel workers don't scan each other's rows. The span of the pending
+    messages is divided evenly in time, so the share of rows per range
+    follows the traffic.
+
+    Args:
+        connection (Connection): Database connection
+        after (tuple): Exclusive (timestamp, id) cursor, or None
+        until (datetime): Inclusive upper bound of Message.timestamp
+        parts (int): Number of ranges
+
+    Returns:
+        list: (since, until) per range, since being None for the first one
+        (which starts at the cursor); a single range if there is nothing to split
+    """
+    message = message_table
+    bounds = select(func.min(message.c.timestamp), func.max(message.c.timestamp)).where(message.c.timestamp <= until)
+    if after is not None:
+        bounds = bounds.where(message.c.timestamp >= after[0])
+    start, end = connection.execute(bounds).one()
+    if parts <= 1 or start is None or start >= end:
+        return [(None, until)]
+
+    step = (end - start) / parts
+    bounds = [start + step * index for index in range(1, parts)]
+    return list(zip([None] + bounds, bounds + [until]))
+
+
+def iter_batches(connection, after, until, batch_size=EXPORT_BATCH_SIZE, since=None):
+    """
+    Stream message rows through a server-side cursor, batch by batch
+
+    Args:
+        connection (Connection): Database connection
+        after (tuple): Exclusive (timestamp, id) cursor, or None
+        until (datetime): Inclusive upper bound of Message.timestamp
+        batch_size (int): Rows per batch
+        since (datetime, optional): Exclusive lower bound of Message.timestamp
+
+    Yields:
+        list: Rows
+    """
+    statement = message_query(after, until, since)
+    result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+    for partition in result.partitions():
+        yield partition
+
+
+def _isoformat(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    return value.isoformat()
+
+
+def row_to_dict(row):
+    """Convert a message row to a JSON-serializable dict"""
+    return {
+        "id": row.id,
+        "conversation_id": row.conversation_id,
+        "user_id": row.user_id,
+        "conversation_started_at": _isoformat(row.conversation_started_at),
+        "role": row.role,
+        "content": row.content,
+        "timestamp": _isoformat(row.timestamp),
+    }
+
+
+class NDJSONWriter:
+    """Writes rows as newline-delimited JSON"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write_batch(self, rows):
+        self.file.write("".join(json.dumps(row_to_dict(row), ensure_ascii=False) + "\n" for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes rows as Parquet, one row group per batch"""
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("conversation_id", pyarrow.int64()),
+            ("user_id", pyarrow.string()),
+            ("conversation_started_at", pyarrow.timestamp("us")),
+            ("role", pyarrow.string()),
+            ("content", pyarrow.string()),
+            ("timestamp", pyarrow.timestamp("us")),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write_batch(self, rows):
+        columns = {name: [] for name in COLUMNS}
+        for row in rows:
+            for name in COLUMNS:
+                value = getattr(row, name)
+                if isinstance(value, str) and name in ("conversation_started_at", "timestamp"):
+                    value = datetime.fromisoformat(value)
+                columns[name].append(value)
+        self.writer.write_table(pyarrow.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {"ndjson": NDJSONWriter, "parquet": ParquetWriter}
+
+
+def export_range(database_url, after, until, path, export_format="ndjson", batch_size=EXPORT_BATCH_SIZE,
+                 since=None):
+    """
+    Export the messages between a cursor (or timestamp) and a timestamp to one file
+
+    Writes to a temporary file that is renamed when complete, so a partial
+    file is never mistaken for a finished one. Runs in worker processes.
+
+    Args:
+        database_url (str): SQLAlchemy database URL
+        after (tuple): Exclusive (timestamp, id) cursor, or None
+        until (datetime): Inclusive upper bound of Message.timestamp
+        path (str): Destination file
+        export_format (str): "ndjson" or "parquet"
+        batch_size (int): Rows per batch
+        since (datetime, optional): Exclusive lower bound of Message.timestamp
+
+    Returns:
+        tuple: (rows written, (timestamp, id) of the last row or None)
+    """
+    engine = create_engine(database_url)
+    temporary_path = f"{path}.tmp"
+    writer = WRITERS[export_format](temporary_path)
+    rows = 0
+    last = None
+    try:
+        with engine.connect() as connection:
+            for batch in iter_batches(connection, after, until, batch_size, since):
+                writer.write_batch(batch)
+                rows += len(batch)
+                last = (batch[-1].timestamp, batch[-1].id)
+    finally:
+        writer.close()
+        engine.dispose()
+
+    os.replace(temporary_path, path)
+    return rows, last
+
+
+def read_watermark(output_dir):
+    """
+    Cursor of the last message exported by a previous incremental run
+
+    Args:
+        output_dir (str): Export directory
+
+    Returns:
+        tuple: (timestamp, id) of the last exported message, or None if
+        nothing was exported yet
+    """
+    try:
+        with open(os.path.join(output_dir, STATE_FILE)) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    return datetime.fromisoformat(state["last_timestamp"]), int(state["last_message_id"])
+
+
+def write_watermark(output_dir, cursor):
+    """Atomically record the (timestamp, id) watermark"""
+    last_timestamp, last_message_id = cursor
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({
+            "last_timestamp": last_timestamp.isoformat(),
+            "last_message_id": last_message_id,
+            "exported_at": datetime.utcnow().isoformat(),
+        }, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def run_export(database_url, output_dir=EXPORT_DIR, export_format="ndjson", workers=1, incremental=True,
+               batch_size=EXPORT_BATCH_SIZE, lag_seconds=EXPORT_LAG_SECONDS):
+    """
+    Export messages (with their conversation fields) to files
+
+    Messages are read in (timestamp, id) order up to lag_seconds before the
+    start of the run. Ids are not commit-ordered (sequences hand them out
+    before commit, and SQLite may reuse freed ones), so the watermark is the
+    (timestamp, id) of the last exported message instead of an id; the lag
+    lets transactions in flight commit before their timestamps are passed.
+    With several workers the time span is split into contiguous ranges
+    exported in parallel processes, one file each. The watermark only
+    advances once every range has been written.
+
+    Args:
+        database_url (str): SQLAlchemy database URL
+        output_dir (str): Export directory
+        export_format (str): "ndjson" or "parquet"
+        workers (int): Parallel export processes
+        incremental (bool): Start after the stored watermark instead of the beginning
+        batch_size (int): Rows per batch
+        lag_seconds (float): Age below which messages are left for the next run
+
+    Returns:
+        dict: rows, seconds, rows_per_second, files, after and until
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format == "parquet" and pyarrow is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    after = read_watermark(output_dir) if incremental else None
+    until = datetime.utcnow() - timedelta(seconds=lag_seconds)
+
+    engine = create_engine(database_url)
+    try:
+        ensure_order_index(engine)
+        with engine.connect() as connection:
+            slices = time_slices(connection, after, until, max(1, workers))
+    finally:
+        engine.dispose()
+
+    label = f"{until:%Y%m%dT%H%M%S}"
+    jobs = []
+    for part, (since, slice_until) in enumerate(slices):
+        suffix = f"-part{part:03d}" if len(slices) > 1 else ""
+        path = os.path.join(output_dir, f"messages-{label}{suffix}.{FORMATS[export_format]}")
+        jobs.append((database_url, after if since is None else None, slice_until, path, export_format,
+                     batch_size, since))
+
+    start = time.perf_counter()
+    if len(jobs) == 1:
+        results = [export_range(*jobs[0])]
+    else:
+        with multiprocessing.get_context("spawn").Pool(len(jobs)) as pool:
+            results = pool.starmap(export_range, jobs)
+    elapsed = time.perf_counter() - start
+
+    rows = sum(count for count, _ in results)
+    cursors = [last for _, last in results if last is not None]
+    if incremental and cursors:
+        write_watermark(output_dir, max(cursors))
+
+    # Drop empty files so an idle run leaves nothing behind
+    files = []
+    for (count, _), job in zip(results, jobs):
+        if count:
+            files.append(job[3])
+        else:
+            os.remove(job[3])
+
+    stats = {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed > 0 else 0.0,
+        "files": files,
+        "after": after,
+        "until": until,
+    }
+    logger.info("Exported %d messages up to %s in %.2fs, %.0f rows/s", rows, until, elapsed, stats["rows_per_second"])
+    return stats
+
+
+def stream_ndjson(engine, after=None, batch_size=EXPORT_BATCH_SIZE, lag_seconds=EXPORT_LAG_SECONDS):
+    """
+    Stream messages after a (timestamp, id) cursor as NDJSON lines, for HTTP responses
+
+    Each page is read with its own short connection checkout, released before
+    the page is sent, so a slow download never holds one of the app's pooled
+    connections.
+
+    Args:
+        engine (Engine): Database engine
+        after (tuple): Exclusive (timestamp, id) cursor, or None
+        batch_size (int): Rows per batch
+        lag_seconds (float): Age below which messages are left out
+
+    Yields:
+        str: Chunk of NDJSON lines
+    """
+    until = datetime.utcnow() - timedelta(seconds=lag_seconds)
+    while True:
+        with engine.connect() as connection:
+            batch = connection.execute(message_query(after, until).limit(batch_size)).all()
+        if not batch:
+            return
+        yield "".join(json.dumps(row_to_dict(row), ensure_ascii=False) + "\n" for row in batch)
+        if len(batch) < batch_size:
+            return
+        after = (batch[-1].timestamp, batch[-1].id)
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Export conversations and messages for analytics")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"), help="SQLAlchemy database URL")
+    parser.add_argument("--output-dir", default=EXPORT_DIR, help="Export directory")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="ndjson", help="Output format")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel export processes")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and export everything")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="Rows per batch")
+    parser.add_argument("--lag-seconds", type=float, default=EXPORT_LAG_SECONDS,
+                        help="Leave messages younger than this for the next run")
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    logging.basicConfig(level=logging.INFO)
+    stats = run_export(args.database_url, args.output_dir, args.format, args.workers,
+                       incremental=not args.full, batch_size=args.batch_size, lag_seconds=args.lag_seconds)
+    print(f"{stats['rows']} rows in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s), "
+          f"messages up to {stats['until']:%Y-%m-%d %H:%M:%S}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,35 +5,136 @@ import random
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import metrics
+from knowledge_ingest import iter_entries
+from knowledge_store import CompactKnowledgeStore
+from definition_index import DefinitionIndex
+import dense_retrieval
+from query_normalizer import QueryNormalizer
 
 logger = logging.getLogger(__name__)
 
+# TF-IDF settings, shared with the corpus statistics of sharded knowledge
+TFIDF_OPTIONS = {"stop_words": "english", "strip_accents": "unicode"}
+
+# Saved CompactKnowledgeStore ("flask knowledge-store"), memory-mapped at load
+# instead of parsing the knowledge file or reading every database row
+KNOWLEDGE_STORE_DIR = os.environ.get("EVA_KNOWLEDGE_STORE", "data/knowledge_store")
+
+
+def file_store_metadata(knowledge_file):
+    """
+    Describe a knowledge file for the manifest of a store saved from it
+
+    Args:
+        knowledge_file (str): Path to the JSON or NDJSON knowledge file
+
+    Returns:
+        dict: Source path, size and modification time
+    """
+    stat = os.stat(knowledge_file)
+    return {
+        "source": "file",
+        "path": os.path.abspath(knowledge_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
 class KnowledgeBase:
     """
     Simple knowledge base that stores information and provides
     search capabilities using TF-IDF and cosine similarity
     """
     
-    def __init__(self, knowledge_file="data/knowledge.json"):
+    def __init__(self, knowledge_file="data/knowledge.json", entries=None, store=None, retrieval_mode=None,
+                 statistics=None, normalizer=None):
         """
-        Initialize the knowledge base from a JSON file
+        Initialize the knowledge base from a JSON file, loaded entries or a packed store
+        
+        Entries are kept in a CompactKnowledgeStore; indexing self.knowledge
+        returns dict-like EntryView objects.
         
         Args:
             knowledge_file (str): Path to the JSON file containing knowledge
+            entries (iterable, optional): Entries already loaded (e.g. from the
+                database); the file is not read when given
+            store (CompactKnowledgeStore, optional): Prebuilt (possibly
+                memory-mapped) store; takes precedence over entries
+            retrieval_mode (str, optional): "tfidf", "dense" or "hybrid";
+                defaults to EVA_RETRIEVAL_MODE
+            statistics (CorpusStatistics, optional): Document frequencies of
+                a larger corpus this one is a shard of; TF-IDF weights then
+                use the corpus-wide IDF so scores compare across shards
+            normalizer (QueryNormalizer, optional): Query normalizer to use
+                instead of one built from this knowledge
         """
-        self.knowledge = []
-        self.vectorizer = TfidfVectorizer(stop_words='english')
+        self.knowledge_file = knowledge_file
+        self.load_failed = False
+        self.knowledge = CompactKnowledgeStore.from_entries([])
+        self.vectorizer = TfidfVectorizer(**TFIDF_OPTIONS)
         self.knowledge_vectors = None
+        self.category_index = {}
+        self.definitions = DefinitionIndex()
+        self.normalizer = normalizer or QueryNormalizer()
+        self.statistics = statistics
+        self.retrieval_mode = retrieval_mode or dense_retrieval.RETRIEVAL_MODE
+        self.dense_index = None
+        
+        if store is not None:
+            self.knowledge = store
+            logger.info("Loaded %d knowledge entries", len(self.knowledge))
+        elif entries is not None:
+            self.knowledge = CompactKnowledgeStore.from_entries(entries)
+            logger.info("Loaded %d knowledge entries", len(self.knowledge))
+        else:
+            # Load knowledge from JSON file
+            self._load_knowledge(knowledge_file)
+        
+        # Index rows by category for scoped search and random facts
+        self.category_index = self.knowledge.category_rows()
         
-        # Load knowledge from JSON file
-        self._load_knowledge(knowledge_file)
+        # Index "What is X?" questions for direct definition lookups
+        self.definitions = DefinitionIndex.build(self.knowledge)
+        
+        # Build or load the spelling dictionary used to normalize queries
+        if normalizer is None:
+            self._load_normalizer()
         
         # Create vector representations of knowledge
         self._vectorize_knowledge()
+        
+        # Load or compute dense embeddings when a dense mode is enabled
+        if self.retrieval_mode in ("dense", "hybrid"):
+            self._load_dense_index()
+    
+    def _load_saved_store(self, knowledge_file):
+        """
+        Memory-map the saved store of a knowledge file, if it is up to date
+        
+        Args:
+            knowledge_file (str): Path to the JSON file containing knowledge
+        
+        Returns:
+            CompactKnowledgeStore: The saved store, or None if there is none
+            or the file changed since it was saved
+        """
+        store = CompactKnowledgeStore.load_saved(KNOWLEDGE_STORE_DIR)
+        if store is None:
+            return None
+        if store.metadata != file_store_metadata(knowledge_file):
+            logger.info("Knowledge store in %s is not from the current %s, parsing the file",
+                        KNOWLEDGE_STORE_DIR, knowledge_file)
+            return None
+        return store
     
     def _load_knowledge(self, knowledge_file):
         """
-        Load knowledge from a JSON file
+        Load knowledge from a JSON array or NDJSON file
+        
+        A store saved from the same version of the file is memory-mapped
+        instead. Otherwise the file is parsed incrementally, so only the
+        validated entries are kept in memory, never the whole decoded document.
         
         Args:
             knowledge_file (str): Path to the JSON file containing knowledge
@@ -46,14 +147,18 @@ class KnowledgeBase:
             if not os.path.exists(knowledge_file):
                 self._create_initial_knowledge(knowledge_file)
             
-            # Load the knowledge from file
-            with open(knowledge_file, 'r') as f:
-                self.knowledge = json.load(f)
-                
-            logger.info(f"Loaded {len(self.knowledge)} knowledge entries")
+            # Use the saved store, or stream the knowledge from file
+            store = self._load_saved_store(knowledge_file)
+            if store is not None:
+                self.knowledge = store
+                logger.info("Loaded %d knowledge entries from %s", len(self.knowledge), KNOWLEDGE_STORE_DIR)
+            else:
+                self.knowledge = CompactKnowledgeStore.from_entries(iter_entries(knowledge_file))
+                logger.info("Loaded %d knowledge entries", len(self.knowledge))
         
         except Exception as e:
-            logger.error(f"Error loading knowledge: {str(e)}")
+            logger.error("Error loading knowledge: %s", e)
+            self.load_failed = True
             # Initialize with some basic knowledge if file loading fails
             self._initialize_basic_knowledge()
     
@@ -69,13 +174,13 @@ class KnowledgeBase:
         try:
             with open(knowledge_file, 'w') as f:
                 json.dump(initial_knowledge, f, indent=2)
-            logger.info(f"Created initial knowledge file at {knowledge_file}")
+            logger.info("Created initial knowledge file at %s", knowledge_file)
         except Exception as e:
-            logger.error(f"Error creating initial knowledge file: {str(e)}")
+            logger.error("Error creating initial knowledge file: %s", e)
     
     def _initialize_basic_knowledge(self):
         """Initialize with basic knowledge if file loading fails"""
-        self.knowledge = self._get_initial_knowledge()
+        self.knowledge = CompactKnowledgeStore.from_entries(self._get_initial_knowledge())
         logger.info("Initialized with basic knowledge")
     
     def _get_initial_knowledge(self):
@@ -141,48 +246,121 @@ class KnowledgeBase:
     def _vectorize_knowledge(self):
         """Create vector representations of knowledge for efficient searching"""
         try:
-            # Extract text from knowledge entries
-            knowledge_texts = [f"{entry['question']} {entry['answer']}" for entry in self.knowledge]
+            # Extract text from knowledge entries lazily, one document at a time
+            knowledge_texts = self.knowledge.iter_texts()
             
             # Create TF-IDF vectors
-            self.knowledge_vectors = self.vectorizer.fit_transform(knowledge_texts)
+            if self.statistics is None:
+                self.knowledge_vectors = self.vectorizer.fit_transform(knowledge_texts)
+            else:
+                # Corpus-wide vocabulary and IDF instead of this shard's own
+                self.vectorizer = self.statistics.vectorizer(knowledge_texts)
+                self.knowledge_vectors = self.vectorizer.transform(self.knowledge.iter_texts())
             logger.info("Knowledge vectorization complete")
         
         except Exception as e:
-            logger.error(f"Error vectorizing knowledge: {str(e)}")
+            logger.error("Error vectorizing knowledge: %s", e)
     
-    def search(self, query, threshold=0.3):
+    def _load_normalizer(self):
+        """Attach the query normalizer, without spelling correction if its dictionary can't be built"""
+        try:
+            self.normalizer = QueryNormalizer.for_store(self.knowledge)
+        except Exception as e:
+            logger.error("Error building spelling dictionary: %s", e)
+            self.normalizer = QueryNormalizer()
+    
+    def _load_dense_index(self):
+        """Attach the dense index, falling back to TF-IDF only if it can't be built"""
+        try:
+            self.dense_index = dense_retrieval.DenseIndex.for_store(self.knowledge)
+            logger.info("Dense retrieval enabled (%s mode)", self.retrieval_mode)
+        except Exception as e:
+            logger.error("Error loading dense index, using TF-IDF only: %s", e)
+            self.dense_index = None
+            self.retrieval_mode = "tfidf"
+    
+    def _tfidf_scores(self, query, candidate_vectors):
+        """TF-IDF cosine similarity between the query and the candidate rows"""
+        with metrics.span("knowledge.vectorize_query"):
+            query_vector = self.vectorizer.transform([query])
+        
+        with metrics.span("knowledge.score"):
+            return cosine_similarity(query_vector, candidate_vectors).flatten()
+    
+    def search(self, query, threshold=0.3, category=None):
         """
         Search the knowledge base for relevant information
         
         Args:
             query (str): The search query
             threshold (float): Similarity threshold (0-1)
+            category (str, optional): Only score entries in this category
             
         Returns:
             list: Relevant knowledge entries
         """
+        return [entry for entry, _ in self.search_scored(query, threshold, category)]
+    
+    def search_scored(self, query, threshold=0.3, category=None):
+        """
+        Search the knowledge base, keeping the similarity of each hit
+        
+        Args:
+            query (str): The search query
+            threshold (float): Similarity threshold (0-1)
+            category (str, optional): Only score entries in this category
+            
+        Returns:
+            list: (entry, score) tuples, best first
+        """
         try:
-            # Transform query to vector representation
-            query_vector = self.vectorizer.transform([query])
+            # Restrict scoring to the category's rows of the matrix
+            rows = None
+            candidate_vectors = self.knowledge_vectors
+            if category is not None:
+                rows = self.category_index.get(category)
+                if rows is None or not len(rows):
+                    return []
+                candidate_vectors = self.knowledge_vectors[rows]
             
-            # Calculate similarity with all knowledge entries
-            similarities = cosine_similarity(query_vector, self.knowledge_vectors).flatten()
+            # Fold accents and correct typos before retrieval
+            with metrics.span("knowledge.normalize_query"):
+                query = self.normalizer.normalize(query)
             
-            # Get indices of entries exceeding the threshold
-            relevant_indices = np.where(similarities > threshold)[0]
+            # Calculate similarity with the candidate entries
+            if self.retrieval_mode == "tfidf" or self.dense_index is None:
+                similarities = self._tfidf_scores(query, candidate_vectors)
+            else:
+                with metrics.span("knowledge.dense_score"):
+                    similarities = self.dense_index.score(query, rows)
+                
+                if self.retrieval_mode == "hybrid":
+                    # Fuse both cosine scores with a fixed weight
+                    weight = dense_retrieval.HYBRID_DENSE_WEIGHT
+                    similarities = weight * similarities + (1 - weight) * self._tfidf_scores(query, candidate_vectors)
             
-            # Sort by similarity (highest first)
-            relevant_indices = sorted(relevant_indices, key=lambda idx: similarities[idx], reverse=True)
+            # Get indices of entries exceeding the threshold
+            with metrics.span("knowledge.rank"):
+                if self.retrieval_mode == "tfidf" or self.dense_index is None:
+                    relevant_indices = np.where(similarities > threshold)[0]
+                    
+                    # Sort by similarity (highest first)
+                    relevant_indices = sorted(relevant_indices, key=lambda idx: similarities[idx], reverse=True)
+                else:
+                    # Dense scores are rarely zero, so only keep the top k
+                    relevant_indices = dense_retrieval.top_k(similarities, dense_retrieval.RETRIEVAL_TOP_K, threshold)
             
-            # Return relevant entries
-            results = [self.knowledge[idx] for idx in relevant_indices]
+            # Return relevant entries, mapping candidate positions back to knowledge rows
+            results = [
+                (self.knowledge[rows[idx] if rows is not None else idx], float(similarities[idx]))
+                for idx in relevant_indices
+            ]
             
-            logger.debug(f"Found {len(results)} relevant entries for query: {query}")
+            logger.debug("Found %d relevant entries for query: %s", len(results), query)
             return results
             
         except Exception as e:
-            logger.error(f"Error searching knowledge base: {str(e)}")
+            logger.error("Error searching knowledge base: %s", e)
             return []
     
     def get_definition(self, term):
@@ -195,7 +373,12 @@ class KnowledgeBase:
         Returns:
             str: Definition or None if not found
         """
-        # Search for the term in our knowledge base
+        # Exact or prefix match against the defined terms, no vector scoring
+        row = self.definitions.lookup(term)
+        if row is not None:
+            return self.knowledge.answer(row)
+        
+        # Fall back to searching for the term in our knowledge base
         results = self.search(f"what is {term}")
         
         if results:
@@ -214,9 +397,9 @@ class KnowledgeBase:
             dict: Random knowledge entry
         """
         if category:
-            filtered_knowledge = [entry for entry in self.knowledge if entry.get("category") == category]
-            if filtered_knowledge:
-                return random.choice(filtered_knowledge)
+            rows = self.category_index.get(category)
+            if rows is not None and len(rows):
+                return self.knowledge[rows[random.randrange(len(rows))]]
         
         # Return random entry if no category specified or no entries found for category
         return random.choice(self.knowledge) if self.knowledge else None
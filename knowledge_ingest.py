@@ -0,0 +1,228 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+PORTUGUESE_CHARACTERS = "áàâãéèêíìóòôõúùçñ"
+
+# Column limits from the KnowledgeEntry model
+MAX_QUESTION_LENGTH = 255
+MAX_CATEGORY_LENGTH = 50
+
+
+def iter_ndjson(path):
+    """
+    Yield the objects of a newline-delimited JSON file one line at a time
+
+    Args:
+        path (str): NDJSON file
+
+    Yields:
+        object: Decoded line
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping invalid JSON on line %d of %s: %s", line_number, path, e)
+
+
+def iter_json_array(path, read_size=READ_SIZE):
+    """
+    Yield the elements of a top-level JSON array without loading the whole file
+
+    The file is read in fixed-size blocks and each element is decoded with
+    JSONDecoder.raw_decode as soon as it is complete, so memory use is bounded
+    by the block size and the largest single element.
+
+    Args:
+        path (str): JSON file containing an array
+        read_size (int): Characters read per block
+
+    Yields:
+        object: Decoded array element
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        position = 0
+        eof = False
+        started = False
+
+        while True:
+            # Skip whitespace and separators between elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+
+            if position >= len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON array in {path}")
+                buffer = f.read(read_size)
+                position = 0
+                eof = not buffer
+                continue
+
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError(f"Expected a JSON array in {path}")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element continues in the next block
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            yield element
+            position = end
+
+            # Drop consumed text so the buffer doesn't grow with the file
+            if position > read_size:
+                buffer = buffer[position:]
+                position = 0
+
+
+def iter_knowledge_file(path):
+    """
+    Yield raw entries from a JSON array or NDJSON knowledge file
+
+    The format is taken from the extension (.ndjson / .jsonl) or, failing
+    that, from the first non-blank character of the file.
+
+    Args:
+        path (str): Knowledge file
+
+    Yields:
+        dict: Raw entry
+    """
+    if path.endswith((".ndjson", ".jsonl")):
+        yield from iter_ndjson(path)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        first = ""
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                first = char
+                break
+
+    if first == "[":
+        yield from iter_json_array(path)
+    else:
+        yield from iter_ndjson(path)
+
+
+def detect_language(question):
+    """
+    Guess the language of a question
+
+    Simple rule: Portuguese-specific characters mean "pt", anything else "en"
+
+    Args:
+        question (str): Question text
+
+    Returns:
+        str: Language code
+    """
+    lowered = question.lower()
+    return "pt" if any(c in lowered for c in PORTUGUESE_CHARACTERS) else "en"
+
+
+def validate_entry(raw):
+    """
+    Validate a raw knowledge entry and tag its language
+
+    Values are kept exactly as in the file (whitespace included): the sync
+    matches rows by question, so rewriting them would turn every entry
+    synced before into a new row.
+
+    Args:
+        raw (object): Decoded entry
+
+    Returns:
+        dict: Entry with question, answer, category and language, or None if invalid
+    """
+    if not isinstance(raw, dict):
+        return None
+
+    question = raw.get("question")
+    answer = raw.get("answer")
+    category = raw.get("category")
+
+    if not all(isinstance(value, str) and value.strip() for value in (question, answer, category)):
+        return None
+
+    if len(question) > MAX_QUESTION_LENGTH or len(category) > MAX_CATEGORY_LENGTH:
+        return None
+
+    language = raw.get("language")
+    if not isinstance(language, str) or not language:
+        language = detect_language(question)
+
+    return {
+        "question": question,
+        "answer": answer,
+        "category": category,
+        "language": language,
+    }
+
+
+def iter_entries(path):
+    """
+    Yield validated, language-tagged entries from a knowledge file
+
+    Args:
+        path (str): Knowledge file
+
+    Yields:
+        dict: Valid entry
+    """
+    skipped = 0
+    for raw in iter_knowledge_file(path):
+        entry = validate_entry(raw)
+        if entry is None:
+            skipped += 1
+            continue
+        yield entry
+
+    if skipped:
+        logger.warning("Skipped %d invalid knowledge entries in %s", skipped, path)
+
+
+def iter_chunks(path, chunk_size=1000):
+    """
+    Yield validated entries from a knowledge file in bounded lists
+
+    Args:
+        path (str): Knowledge file
+        chunk_size (int): Entries per chunk
+
+    Yields:
+        list: Up to chunk_size valid entries
+    """
+    chunk = []
+    for entry in iter_entries(path):
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,239 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, func, or_, and_
+from knowledge_base import KnowledgeBase, KNOWLEDGE_STORE_DIR
+from knowledge_store import CompactKnowledgeStore
+from knowledge_reloader import UNCHANGED
+
+logger = logging.getLogger(__name__)
+
+# Incremental reloads re-read rows updated up to this many seconds before the
+# watermark, so rows stamped before it but committed after the previous
+# reload read (long transactions) are not missed
+KNOWLEDGE_RELOAD_LAG = float(os.environ.get("EVA_KNOWLEDGE_RELOAD_LAG", 60))
+
+
+class DatabaseKnowledgeLoader:
+    """
+    Builds KnowledgeBase snapshots from the KnowledgeEntry table
+
+    Rows are read in keyset-paginated pages, each in its own short
+    transaction, straight into a CompactKnowledgeStore, so a load never holds
+    a pooled connection for longer than one page (with SQLite's single pooled
+    connection, /chat requests interleave with the pages). The loader keeps
+    the last store and an updated_at watermark, so each reload only fetches
+    rows changed since shortly before the previous one and merges them into a
+    new store; deleted rows are detected by comparing row counts and pruned
+    with an id-only scan.
+
+    A store saved with save_store() (with its watermark) replaces the first
+    full load: it is memory-mapped and only the rows changed since it was
+    saved are read, and while nothing changes the mapped store is kept.
+    """
+
+    def __init__(self, app, db, entry_model, batch_size=1000, lag_seconds=KNOWLEDGE_RELOAD_LAG,
+                 store_dir=KNOWLEDGE_STORE_DIR):
+        """
+        Initialize the loader
+
+        Args:
+            app (Flask): Application, used for an app context
+            db (SQLAlchemy): Database handle
+            entry_model (Model): The KnowledgeEntry model
+            batch_size (int): Rows fetched per page
+            lag_seconds (float): How far before the watermark reloads re-read
+            store_dir (str): Directory of a store saved by save_store()
+        """
+        self.app = app
+        self.db = db
+        self.entry_model = entry_model
+        self.batch_size = batch_size
+        self.lag = timedelta(seconds=lag_seconds)
+        self.store_dir = store_dir
+        self.store = None
+        self.watermark = None
+        # Store of the last snapshot load() returned
+        self._served_store = None
+        self._next_watermark = None
+        self._lock = threading.Lock()
+
+    def _select_entries(self):
+        model = self.entry_model
+        return select(model.id, model.question, model.answer, model.category, model.language, model.updated_at)
+
+    def _track_watermark(self, row):
+        # Only becomes the watermark once the load succeeds
+        if row.updated_at is not None and (self._next_watermark is None or row.updated_at > self._next_watermark):
+            self._next_watermark = row.updated_at
+
+    def _row_entry(self, row):
+        return {
+            "id": row.id,
+            "question": row.question,
+            "answer": row.answer,
+            "category": row.category,
+            "language": row.language,
+        }
+
+    def _pages(self, statement, next_page):
+        """
+        Run a keyset-paginated statement one page per connection checkout
+
+        Args:
+            statement (Select): Ordered statement
+            next_page (callable): Given the statement and the last row of a
+                page, returns the statement for the next page
+
+        Yields:
+            Row: Rows of every page in order
+        """
+        page_statement = statement.limit(self.batch_size)
+        while True:
+            with self.db.engine.connect() as connection:
+                rows = connection.execute(page_statement).all()
+            yield from rows
+            if len(rows) < self.batch_size:
+                return
+            page_statement = next_page(statement, rows[-1]).limit(self.batch_size)
+
+    def _stream_all(self):
+        """Stream every row in id order"""
+        model = self.entry_model
+        statement = self._select_entries().order_by(model.id)
+        for row in self._pages(statement, lambda statement, last: statement.where(model.id > last.id)):
+            self._track_watermark(row)
+            yield self._row_entry(row)
+
+    def _fetch_changed(self):
+        """Fetch rows updated since shortly before the watermark, keyed by id"""
+        model = self.entry_model
+        # Re-reading rows already loaded is harmless; missing a late commit isn't
+        since = self.watermark - self.lag
+        statement = self._select_entries().where(model.updated_at >= since).order_by(model.updated_at, model.id)
+
+        def next_page(statement, last):
+            return statement.where(or_(
+                model.updated_at > last.updated_at,
+                and_(model.updated_at == last.updated_at, model.id > last.id),
+            ))
+
+        changed = {}
+        for row in self._pages(statement, next_page):
+            self._track_watermark(row)
+            changed[row.id] = self._row_entry(row)
+        return changed
+
+    def _find_deleted(self, changed):
+        """Ids in the current store whose rows no longer exist"""
+        model = self.entry_model
+        old_ids = self.store.ids
+        new_ids = np.fromiter(changed.keys(), dtype=np.int64, count=len(changed))
+        expected = len(old_ids) + int(np.count_nonzero(~np.isin(new_ids, old_ids)))
+
+        with self.db.engine.connect() as connection:
+            total = connection.execute(select(func.count(model.id))).scalar()
+        if total == expected:
+            return set()
+
+        statement = select(model.id).order_by(model.id)
+        live_ids = np.fromiter(
+            (row.id for row in self._pages(statement, lambda statement, last: statement.where(model.id > last.id))),
+            dtype=np.int64,
+        )
+        return set(old_ids[~np.isin(old_ids, live_ids)].tolist())
+
+    def _drop_unchanged(self, changed):
+        """Drop re-read rows that are identical to the ones in the current store"""
+        ids = self.store.ids
+        for entry_id in list(changed):
+            index = int(np.searchsorted(ids, entry_id))
+            if index < len(ids) and ids[index] == entry_id and self.store[index] == changed[entry_id]:
+                del changed[entry_id]
+
+    def _merge(self, changed, deleted):
+        """Merge changed rows into the current store's entries, in id order"""
+        pending = sorted(changed.items())
+        position = 0
+
+        for index in range(len(self.store)):
+            entry_id = self.store.entry_id(index)
+            while position < len(pending) and pending[position][0] < entry_id:
+                yield pending[position][1]
+                position += 1
+            if position < len(pending) and pending[position][0] == entry_id:
+                yield pending[position][1]
+                position += 1
+            elif entry_id not in deleted:
+                yield self.store[index]
+
+        for _, entry in pending[position:]:
+            yield entry
+
+    def _load_saved_store(self):
+        """Start from the saved store and its watermark, if there is one"""
+        store = CompactKnowledgeStore.load_saved(self.store_dir)
+        if store is None:
+            return
+        watermark = store.metadata.get("watermark")
+        if store.metadata.get("source") != "database" or not watermark:
+            logger.info("Knowledge store in %s wasn't saved from the database, ignoring it", self.store_dir)
+            return
+        self.store = store
+        self.watermark = datetime.fromisoformat(watermark)
+        logger.info("Knowledge loader: %d rows from %s, saved at watermark %s",
+                    len(store), self.store_dir, watermark)
+
+    def save_store(self, directory=None):
+        """
+        Save the current store with its watermark for later loads to start from
+
+        Args:
+            directory (str, optional): Destination; defaults to store_dir
+        """
+        with self._lock:
+            if self.store is None or self.watermark is None:
+                raise RuntimeError("Nothing loaded from the database to save")
+            self.store.save(directory or self.store_dir,
+                            metadata={"source": "database", "watermark": self.watermark.isoformat()})
+
+    def load(self):
+        """
+        Refresh the entries from the database and build a new snapshot
+
+        Returns:
+            KnowledgeBase: New snapshot, None if the table is empty, or
+            UNCHANGED if no row changed since the last snapshot returned
+        """
+        with self._lock, self.app.app_context():
+            if self.store is None:
+                self._load_saved_store()
+            self._next_watermark = self.watermark
+            if self.store is None or self.watermark is None:
+                store = CompactKnowledgeStore.from_entries(self._stream_all())
+                logger.info("Knowledge loader: full load of %d rows", len(store))
+            else:
+                changed = self._fetch_changed()
+                deleted = self._find_deleted(changed)
+                self._drop_unchanged(changed)
+                if changed or deleted:
+                    store = CompactKnowledgeStore.from_entries(self._merge(changed, deleted))
+                else:
+                    # Keeps a memory-mapped store mapped
+                    store = self.store
+                logger.info("Knowledge loader: %d changed and %d deleted rows (%d total)",
+                            len(changed), len(deleted), len(store))
+
+            self.store = store
+            self.watermark = self._next_watermark
+
+            if not len(store):
+                return None
+            if store is self._served_store:
+                return UNCHANGED
+
+        knowledge_base = KnowledgeBase(store=store)
+        self._served_store = store
+        return knowledge_base
@@ -0,0 +1,179 @@
+import os
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Returned by a builder when the sources changed but the knowledge didn't
+# (e.g. a version bump that touched no rows): the current snapshot stays
+UNCHANGED = object()
+
+
+def file_mtime_source(path):
+    """
+    Version source that follows a file's modification time
+
+    Args:
+        path (str): File to watch
+
+    Returns:
+        callable: Returns the file's mtime in nanoseconds, or None if missing
+    """
+    def source():
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+    return source
+
+
+def db_version_source(app, db, version_model):
+    """
+    Version source that follows the knowledge version counter in the database
+
+    Args:
+        app (Flask): Application, used for an app context in the watcher thread
+        db (SQLAlchemy): Database handle
+        version_model (Model): The KnowledgeVersion model
+
+    Returns:
+        callable: Returns the current version, or None if it can't be read
+    """
+    def source():
+        with app.app_context():
+            try:
+                row = db.session.get(version_model, 1)
+                return row.version if row else 0
+            except Exception as e:
+                logger.debug("Knowledge version not available: %s", e)
+                return None
+            finally:
+                db.session.remove()
+    return source
+
+
+def bump_db_version(db, version_model):
+    """
+    Increment the knowledge version counter (the caller commits)
+
+    Args:
+        db (SQLAlchemy): Database handle
+        version_model (Model): The KnowledgeVersion model
+    """
+    updated = db.session.query(version_model).filter_by(id=1).update(
+        {version_model.version: version_model.version + 1, version_model.updated_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+    if not updated:
+        row = version_model()
+        row.id = 1
+        row.version = 1
+        db.session.add(row)
+
+
+class KnowledgeReloader(threading.Thread):
+    """
+    Background watcher that rebuilds the knowledge snapshot when its sources change
+
+    The new KnowledgeBase is built entirely on this thread and then swapped into
+    the engine by reference, so requests never wait for a rebuild. A change is
+    only acted on once the same version has been seen on two consecutive polls,
+    which avoids loading a file that is still being written.
+    """
+
+    def __init__(self, engine, builder, sources, interval=10.0, reload_on_start=False):
+        """
+        Initialize the watcher
+
+        Args:
+            engine (AIEngine): Engine whose snapshot is replaced
+            builder (callable): Returns a freshly built KnowledgeBase, None
+                when there is nothing to load, or UNCHANGED when the current
+                snapshot is still up to date
+            sources (list): Callables returning a comparable version token
+            interval (float): Seconds between polls
+            reload_on_start (bool): Build a snapshot as soon as the thread starts
+        """
+        super().__init__(daemon=True, name="eva-knowledge-reloader")
+        self.engine = engine
+        self.builder = builder
+        self.sources = sources
+        self.interval = interval
+        self.reload_on_start = reload_on_start
+        self.current_token = None
+        self._pending_token = None
+        self._stop_event = threading.Event()
+
+    def _read_token(self):
+        return tuple(source() for source in self.sources)
+
+    def run(self):
+        self.current_token = self._read_token()
+        logger.info("Knowledge reloader watching %d sources every %ss", len(self.sources), self.interval)
+
+        if self.reload_on_start:
+            try:
+                self.reload(self.current_token)
+            except Exception as e:
+                logger.error("Error loading initial knowledge snapshot: %s", e)
+
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Error reloading knowledge: %s", e)
+
+    def poll(self):
+        """
+        Check the sources once and reload if they changed and settled
+
+        Returns:
+            bool: True if a new snapshot was swapped in
+        """
+        token = self._read_token()
+        if token == self.current_token:
+            self._pending_token = None
+            return False
+
+        if token != self._pending_token:
+            # Wait one more poll for the change to settle
+            self._pending_token = token
+            return False
+
+        return self.reload(token)
+
+    def reload(self, token=None):
+        """
+        Build a new snapshot and swap it into the engine
+
+        Args:
+            token (tuple, optional): Version token the snapshot corresponds to
+
+        Returns:
+            bool: True if the snapshot was swapped in
+        """
+        token = token if token is not None else self._read_token()
+        knowledge_base = self.builder()
+
+        if knowledge_base is None or knowledge_base is UNCHANGED:
+            # Nothing to load yet (e.g. the database hasn't been synced), or
+            # nothing changed since the snapshot being served
+            self.current_token = token
+            self._pending_token = None
+            return False
+
+        if getattr(knowledge_base, "load_failed", False):
+            # Don't retry until the sources change again
+            logger.warning("Knowledge reload produced an incomplete snapshot, keeping the current one")
+            self.current_token = token
+            self._pending_token = None
+            return False
+
+        self.engine.swap_knowledge_base(knowledge_base)
+        self.current_token = token
+        self._pending_token = None
+        return True
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import base64
+import logging
+import threading
+from sqlalchemy import select, func, text, tuple_
+
+logger = logging.getLogger(__name__)
+
+# Entries per page in the /knowledge admin view
+PAGE_SIZE = int(os.environ.get("EVA_KNOWLEDGE_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = 500
+
+FTS_TABLE = "knowledge_entry_fts"
+
+SQLITE_FTS_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "question, answer, content='knowledge_entry', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    # Keep the external-content index in sync with the table
+    f"CREATE TRIGGER IF NOT EXISTS knowledge_entry_fts_insert AFTER INSERT ON knowledge_entry BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, question, answer) VALUES (new.id, new.question, new.answer); END",
+    f"CREATE TRIGGER IF NOT EXISTS knowledge_entry_fts_delete AFTER DELETE ON knowledge_entry BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer); END",
+    f"CREATE TRIGGER IF NOT EXISTS knowledge_entry_fts_update AFTER UPDATE OF question, answer ON knowledge_entry BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer); "
+    f"INSERT INTO {FTS_TABLE}(rowid, question, answer) VALUES (new.id, new.question, new.answer); END",
+]
+
+POSTGRESQL_FTS_STATEMENTS = [
+    "ALTER TABLE knowledge_entry ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(question, '') || ' ' || coalesce(answer, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_entry_search_vector ON knowledge_entry USING GIN (search_vector)",
+]
+
+
+def encode_cursor(entry):
+    """
+    Encode the sort key of an entry as an opaque page cursor
+
+    Args:
+        entry (KnowledgeEntry): Last (or first) entry of a page
+
+    Returns:
+        str: URL-safe cursor
+    """
+    key = json.dumps([entry.category, entry.language, entry.id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+class InvalidCursor(ValueError):
+    """A page cursor that wasn't made by encode_cursor"""
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor
+
+    Args:
+        cursor (str): Cursor from the query string
+
+    Returns:
+        tuple: (category, language, id)
+
+    Raises:
+        InvalidCursor: The cursor doesn't decode to a category string, a
+            language string and an integer id
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded).decode("utf-8"))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}") from e
+
+    # Only scalars of the sort key's types may reach the keyset comparison
+    if (not isinstance(key, list) or len(key) != 3
+            or not isinstance(key[0], str) or not isinstance(key[1], str)
+            or not isinstance(key[2], int) or isinstance(key[2], bool)):
+        raise InvalidCursor("Cursor is not a (category, language, id) key")
+    return key[0], key[1], key[2]
+
+
+def fts_query(query):
+    """
+    Turn free text into a safe FTS5 query: every word as a quoted prefix term
+
+    Args:
+        query (str): Search text typed by the user
+
+    Returns:
+        str: FTS5 MATCH expression, or None if the text has no words
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def like_escape(value):
+    """
+    Escape LIKE wildcards so the text matches literally (escape character "\\")
+
+    Args:
+        value (str): Text typed by the user
+
+    Returns:
+        str: Escaped text
+    """
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class KnowledgeSearch:
+    """
+    Paginated listing and full-text search over KnowledgeEntry for the admin view
+
+    Pages use keyset pagination on (category, language, id), which the
+    composite index on those columns serves directly, so any page costs the
+    same as the first (language and category are NOT NULL, so no row falls
+    outside the key order). Text search goes through an SQLite FTS5
+    external-content table kept in sync by triggers, or a generated tsvector
+    column with a GIN index on PostgreSQL, both created by create_index;
+    without them (and on other databases) it falls back to LIKE.
+    """
+
+    def __init__(self, db, entry_model):
+        """
+        Initialize the search
+
+        Args:
+            db (SQLAlchemy): Database handle
+            entry_model (Model): The KnowledgeEntry model
+        """
+        self.db = db
+        self.entry_model = entry_model
+        self.backend = None
+        self._warned = False
+        self._lock = threading.Lock()
+
+    def create_index(self):
+        """
+        Create the full-text index (run once per database, not per request)
+
+        Used by the "flask knowledge-index" command: on PostgreSQL it adds a
+        stored generated column, which rewrites the table, and on SQLite it
+        builds the FTS table from every row, so it must not run inside a web
+        request.
+
+        Returns:
+            str: "fts5", "tsvector" or "like" (no full-text index for this database)
+        """
+        dialect = self.db.engine.dialect.name
+        if dialect == "sqlite":
+            with self.db.engine.begin() as connection:
+                existed = self._has_index(connection, dialect)
+                for statement in SQLITE_FTS_STATEMENTS:
+                    connection.execute(text(statement))
+                if not existed:
+                    # Index the rows that were there before the table
+                    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        elif dialect == "postgresql":
+            with self.db.engine.begin() as connection:
+                for statement in POSTGRESQL_FTS_STATEMENTS:
+                    connection.execute(text(statement))
+        with self._lock:
+            self.backend = None
+        return self.detect_backend()
+
+    @staticmethod
+    def _has_index(connection, dialect):
+        if dialect == "sqlite":
+            statement = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name").bindparams(
+                name=FTS_TABLE)
+        elif dialect == "postgresql":
+            statement = text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'knowledge_entry' AND column_name = 'search_vector'"
+            )
+        else:
+            return False
+        return connection.execute(statement).first() is not None
+
+    def detect_backend(self):
+        """
+        Find out which full-text index exists, without creating anything
+
+        A found index is remembered for the life of the process; while there
+        is none, searches use LIKE and the (cheap catalog) check is repeated,
+        so an index created later is picked up without a restart.
+
+        Returns:
+            str: "fts5", "tsvector" or "like"
+        """
+        if self.backend is not None:
+            return self.backend
+
+        dialect = self.db.engine.dialect.name
+        try:
+            # The request's own connection: with SQLite's single pooled
+            # connection, checking out another one would wait for it
+            found = self._has_index(self.db.session.connection(), dialect)
+        except Exception as e:
+            logger.error("Error checking the knowledge full-text index: %s", e)
+            found = False
+
+        if not found:
+            if dialect in ("sqlite", "postgresql") and not self._warned:
+                self._warned = True
+                logger.warning("No knowledge full-text index, searching with LIKE (run 'flask knowledge-index')")
+            return "like"
+
+        with self._lock:
+            self.backend = "fts5" if dialect == "sqlite" else "tsvector"
+        logger.info("Knowledge search backend: %s", self.backend)
+        return self.backend
+
+    def _search_clause(self, query):
+        """WHERE clause restricting entries to those matching the search text"""
+        model = self.entry_model
+        backend = self.detect_backend()
+
+        if backend == "fts5":
+            expression = fts_query(query)
+            if expression is None:
+                return None
+            match = text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=expression)
+            return model.id.in_(select(text("rowid")).select_from(text(FTS_TABLE)).where(match))
+        if backend == "tsvector":
+            return text("search_vector @@ websearch_to_tsquery('simple', :ts_query)").bindparams(ts_query=query)
+
+        # Wildcards typed by the user match literally
+        pattern = "%" + like_escape(query) + "%"
+        return model.question.ilike(pattern, escape="\\") | model.answer.ilike(pattern, escape="\\")
+
+    def page(self, query=None, category=None, language=None, after=None, before=None, page_size=PAGE_SIZE):
+        """
+        Fetch one page of entries
+
+        Args:
+            query (str, optional): Full-text search over question and answer
+            category (str, optional): Only this category
+            language (str, optional): Only this language
+            after (str, optional): Cursor; return the page after it
+            before (str, optional): Cursor; return the page before it
+            page_size (int): Entries per page
+
+        Returns:
+            dict: entries, total (matching entries), next_cursor and
+            prev_cursor (None at either end)
+
+        Raises:
+            InvalidCursor: after or before isn't a cursor from this page
+        """
+        model = self.entry_model
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        sort_key = tuple_(model.category, model.language, model.id)
+
+        filters = []
+        if category:
+            filters.append(model.category == category)
+        if language:
+            filters.append(model.language == language)
+        if query:
+            clause = self._search_clause(query)
+            if clause is not None:
+                filters.append(clause)
+
+        statement = select(model).where(*filters)
+        after_key = decode_cursor(after) if after else None
+        before_key = decode_cursor(before) if before else None
+
+        if before_key is not None:
+            # Walk backwards from the cursor, then restore the display order
+            statement = statement.where(sort_key < tuple_(*before_key)).order_by(
+                model.category.desc(), model.language.desc(), model.id.desc())
+            rows = self.db.session.execute(statement.limit(page_size + 1)).scalars().all()
+            has_more_before = len(rows) > page_size
+            entries = list(reversed(rows[:page_size]))
+            has_more_after = True
+        else:
+            if after_key is not None:
+                statement = statement.where(sort_key > tuple_(*after_key))
+            statement = statement.order_by(model.category, model.language, model.id)
+            rows = self.db.session.execute(statement.limit(page_size + 1)).scalars().all()
+            entries = rows[:page_size]
+            has_more_after = len(rows) > page_size
+            has_more_before = after_key is not None
+
+        # Count through the indexes (composite index for filters, FTS index for text)
+        total = self.db.session.execute(select(func.count(model.id)).where(*filters)).scalar()
+
+        return {
+            "entries": entries,
+            "total": total,
+            "next_cursor": encode_cursor(entries[-1]) if entries and has_more_after else None,
+            "prev_cursor": encode_cursor(entries[0]) if entries and has_more_before else None,
+        }
+
+    def facets(self):
+        """
+        Distinct categories and languages, for the filter dropdowns
+
+        Returns:
+            tuple: (sorted categories, sorted languages)
+        """
+        model = self.entry_model
+        categories = self.db.session.execute(select(model.category).distinct().order_by(model.category)).scalars().all()
+        languages = self.db.session.execute(select(model.language).distinct().order_by(model.language)).scalars().all()
+        return categories, [language for language in languages if language]
@@ -0,0 +1,598 @@
+import os
+import sys
+import json
+import time
+import random
+import heapq
+import hashlib
+import logging
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+import metrics
+from knowledge_base import KnowledgeBase, TFIDF_OPTIONS
+from knowledge_ingest import iter_entries, iter_ndjson, validate_entry
+from query_normalizer import QueryNormalizer, SymSpellIndex, SPELL_CORRECTION
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated shard URLs; when set, AIEngine searches the shards instead of a local KnowledgeBase
+KNOWLEDGE_SHARDS = [url.strip() for url in os.environ.get("EVA_KNOWLEDGE_SHARDS", "").split(",") if url.strip()]
+
+# Directory written by "python knowledge_shard.py partition"
+SHARD_DATA_DIR = os.environ.get("EVA_SHARD_DATA_DIR", "data/shards")
+
+# Time the coordinator waits for all shards; slower shards are left out of the results
+SHARD_TIMEOUT = float(os.environ.get("EVA_SHARD_TIMEOUT", 0.5))
+
+# Results requested from each shard and kept after merging
+SHARD_TOP_K = int(os.environ.get("EVA_SHARD_TOP_K", 10))
+
+# Seconds a shard that failed or timed out is skipped before being tried again
+SHARD_RETRY_AFTER = float(os.environ.get("EVA_SHARD_RETRY_AFTER", 5))
+
+STATISTICS_FILE = "statistics.json"
+SPELL_INDEX_FILE = "spell_index.json"
+STRATEGIES = ("hash", "category")
+
+
+def shard_file(data_dir, shard):
+    """Path of a shard's slice of the knowledge"""
+    return os.path.join(data_dir, f"shard-{shard:03d}.ndjson")
+
+
+def shard_of(entry, shard_count, strategy="hash"):
+    """
+    Pick the shard of an entry
+
+    "hash" spreads entries evenly by question; "category" keeps each category
+    on one shard, so category-scoped searches and random facts touch it only.
+
+    Args:
+        entry (dict): Knowledge entry
+        shard_count (int): Number of shards
+        strategy (str): "hash" or "category"
+
+    Returns:
+        int: Shard number
+    """
+    key = entry["category"] if strategy == "category" else f"{entry['language']}\0{entry['question']}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+class CorpusStatistics:
+    """
+    Document frequencies of the whole corpus, shared by every shard
+
+    Each shard fits TF-IDF over its own slice, which would give every shard
+    different IDF weights and make scores from different shards
+    incomparable. With these statistics all shards use the same vocabulary
+    and the IDF of the whole corpus, so a shard scores an entry exactly as a
+    single KnowledgeBase over everything would.
+    """
+
+    def __init__(self, documents, document_frequencies):
+        """
+        Initialize the statistics
+
+        Args:
+            documents (int): Number of documents in the corpus
+            document_frequencies (dict): Term -> documents containing it
+        """
+        self.documents = documents
+        self.document_frequencies = document_frequencies
+
+    @classmethod
+    def build(cls, texts):
+        """
+        Count document frequencies with the same analyzer KnowledgeBase uses
+
+        Args:
+            texts (iterable): "question answer" documents
+
+        Returns:
+            CorpusStatistics: The statistics
+        """
+        analyzer = TfidfVectorizer(**TFIDF_OPTIONS).build_analyzer()
+        frequencies = Counter()
+        documents = 0
+        for text in texts:
+            frequencies.update(set(analyzer(text)))
+            documents += 1
+        return cls(documents, dict(frequencies))
+
+    def vectorizer(self, texts):
+        """
+        Build a TF-IDF vectorizer with the corpus vocabulary and IDF
+
+        Args:
+            texts (iterable): The shard's documents
+
+        Returns:
+            TfidfVectorizer: Fitted vectorizer
+        """
+        terms = sorted(self.document_frequencies)
+        vectorizer = TfidfVectorizer(vocabulary={term: index for index, term in enumerate(terms)}, **TFIDF_OPTIONS)
+        vectorizer.fit(texts)
+
+        # Same smoothed IDF as TfidfVectorizer, over the whole corpus
+        frequencies = np.array([self.document_frequencies[term] for term in terms], dtype=np.float64)
+        vectorizer.idf_ = np.log((1 + self.documents) / (1 + frequencies)) + 1
+        return vectorizer
+
+    def save(self, path):
+        """Write the statistics to a JSON file (atomically)"""
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents, "document_frequencies": self.document_frequencies},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Load statistics written by save()"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["documents"], data["document_frequencies"])
+
+
+def iter_source_entries(knowledge_file=None, database_url=None):
+    """
+    Yield knowledge entries from a file or from the KnowledgeEntry table
+
+    Args:
+        knowledge_file (str, optional): JSON or NDJSON knowledge file
+        database_url (str, optional): Database to read KnowledgeEntry rows from
+
+    Yields:
+        dict: Entry (with its id when read from the database)
+    """
+    if database_url is None:
+        yield from iter_entries(knowledge_file)
+        return
+
+    from sqlalchemy import create_engine, select, table, column
+
+    knowledge_entry = table("knowledge_entry", column("id"), column("question"), column("answer"),
+                            column("category"), column("language"))
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=1000).execute(
+                select(knowledge_entry).order_by(knowledge_entry.c.id)
+            )
+            for row in result:
+                yield dict(row._mapping)
+    finally:
+        engine.dispose()
+
+
+def partition(entries, output_dir, shard_count, strategy="hash"):
+    """
+    Split knowledge into shard slices and compute the shared statistics
+
+    Streams the entries once, writing each to its shard's NDJSON slice while
+    counting document frequencies, so the corpus is never held in memory.
+    The spelling dictionary of the whole corpus is written alongside, for
+    the coordinator to normalize queries before they are sent to the shards.
+
+    Args:
+        entries (iterable): Knowledge entries
+        output_dir (str): Destination directory
+        shard_count (int): Number of shards
+        strategy (str): "hash" or "category"
+
+    Returns:
+        list: Entries written per shard
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown sharding strategy: {strategy}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = [open(f"{shard_file(output_dir, shard)}.tmp", "w", encoding="utf-8") for shard in range(shard_count)]
+    counts = [0] * shard_count
+
+    def documents():
+        for entry in entries:
+            shard = shard_of(entry, shard_count, strategy)
+            files[shard].write(json.dumps(entry, ensure_ascii=False) + "\n")
+            counts[shard] += 1
+            yield f"{entry['question']} {entry['answer']}"
+
+    try:
+        statistics = CorpusStatistics.build(documents())
+    finally:
+        for f in files:
+            f.close()
+
+    for shard in range(shard_count):
+        os.replace(f"{shard_file(output_dir, shard)}.tmp", shard_file(output_dir, shard))
+    statistics.save(os.path.join(output_dir, STATISTICS_FILE))
+
+    # Second streaming pass, over the slices just written
+    texts = (
+        f"{entry['question']} {entry['answer']}"
+        for shard in range(shard_count)
+        for entry in iter_slice(shard_file(output_dir, shard))
+    )
+    SymSpellIndex.build(texts).save(os.path.join(output_dir, SPELL_INDEX_FILE))
+
+    logger.info("Partitioned %d entries into %d shards by %s: %s", sum(counts), shard_count, strategy, counts)
+    return counts
+
+
+def iter_slice(path):
+    """
+    Yield the validated entries of a shard slice, keeping their ids
+
+    Args:
+        path (str): Shard NDJSON file
+
+    Yields:
+        dict: Entry
+    """
+    for raw in iter_ndjson(path):
+        entry = validate_entry(raw)
+        if entry is None:
+            continue
+        if isinstance(raw.get("id"), int):
+            entry["id"] = raw["id"]
+        yield entry
+
+
+def load_shard(data_dir, shard):
+    """
+    Build the KnowledgeBase of one shard
+
+    Queries arrive already normalized by the coordinator, so the shard only
+    folds accents and doesn't build a spelling dictionary of its own.
+
+    Args:
+        data_dir (str): Directory written by partition()
+        shard (int): Shard number
+
+    Returns:
+        KnowledgeBase: The shard's knowledge
+    """
+    path = shard_file(data_dir, shard)
+    statistics = CorpusStatistics.load(os.path.join(data_dir, STATISTICS_FILE))
+    return KnowledgeBase(path, entries=iter_slice(path), statistics=statistics, normalizer=QueryNormalizer())
+
+
+def make_shard_handler(shard, knowledge_base):
+    """Build the request handler class serving one shard"""
+
+    class ShardHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug("shard %d: " + format, shard, *args)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"shard": shard, "entries": len(knowledge_base.knowledge)})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": "invalid JSON"})
+                return
+
+            if self.path == "/search":
+                scored = knowledge_base.search_scored(
+                    request.get("query", ""), request.get("threshold", 0.3), request.get("category")
+                )
+                top_k = request.get("top_k", SHARD_TOP_K)
+                self._send_json(200, {
+                    "results": [{"entry": entry.to_dict(), "score": score} for entry, score in scored[:top_k]],
+                })
+            elif self.path == "/definition":
+                # Only the term index: the search fallback runs across all shards in the coordinator
+                row = knowledge_base.definitions.lookup(request.get("term", ""))
+                self._send_json(200, {"answer": knowledge_base.knowledge.answer(row) if row is not None else None})
+            elif self.path == "/random":
+                entry = knowledge_base.get_random_fact(request.get("category"))
+                if entry is not None and request.get("category") and entry["category"] != request["category"]:
+                    entry = None
+                self._send_json(200, {"entry": entry.to_dict() if entry is not None else None})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+    return ShardHandler
+
+
+def serve(data_dir, shard, host="127.0.0.1", port=8800):
+    """
+    Serve one shard's search RPC until interrupted
+
+    Args:
+        data_dir (str): Directory written by partition()
+        shard (int): Shard number
+        host (str): Address to bind
+        port (int): Port to listen on
+    """
+    knowledge_base = load_shard(data_dir, shard)
+    server = ThreadingHTTPServer((host, port), make_shard_handler(shard, knowledge_base))
+    server.daemon_threads = True
+    logger.info("Shard %d serving %d entries on http://%s:%d", shard, len(knowledge_base.knowledge), host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class ShardedKnowledgeBase:
+    """
+    Coordinator searching knowledge split across shard servers
+
+    Offers the search interface of KnowledgeBase. Queries are normalized
+    once with the corpus-wide spelling dictionary, sent to every shard in
+    parallel, and the per-shard top-k are merged by score (shards share the
+    corpus IDF, so their scores are comparable). Shards that don't answer
+    within the timeout are left out of that query's results and skipped for
+    a while, so a slow or dead shard costs some recall rather than latency.
+    """
+
+    knowledge_file = None
+    load_failed = False
+
+    def __init__(self, shard_urls, timeout=SHARD_TIMEOUT, top_k=SHARD_TOP_K, retry_after=SHARD_RETRY_AFTER,
+                 data_dir=SHARD_DATA_DIR):
+        """
+        Initialize the coordinator
+
+        Args:
+            shard_urls (list): Base URLs of the shard servers
+            timeout (float): Seconds to wait for the shards of one query
+            top_k (int): Results requested per shard and kept after merging
+            retry_after (float): Seconds a failed shard is skipped
+            data_dir (str): Directory holding the corpus spelling dictionary
+        """
+        self.shard_urls = list(shard_urls)
+        self.timeout = timeout
+        self.top_k = top_k
+        self.retry_after = retry_after
+        self.normalizer = QueryNormalizer()
+        self._down_until = {}
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        spell_index_path = os.path.join(data_dir, SPELL_INDEX_FILE)
+        if SPELL_CORRECTION and os.path.exists(spell_index_path):
+            self.normalizer = QueryNormalizer(SymSpellIndex.load(spell_index_path))
+        logger.info("Searching knowledge across %d shards", len(self.shard_urls))
+
+    def _get_executor(self):
+        # Threads don't survive a fork, so each worker process creates its own pool
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=4 * len(self.shard_urls), thread_name_prefix="eva-shard"
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _call(self, url, path, payload):
+        request = urllib.request.Request(
+            url.rstrip("/") + path, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def _scatter(self, path, payload):
+        """
+        Send a request to every available shard in parallel
+
+        Returns:
+            list: Responses of the shards that answered in time, in shard order
+        """
+        now = time.monotonic()
+        urls = [url for url in self.shard_urls if self._down_until.get(url, 0) <= now]
+        if not urls:
+            # Everything is marked down: trying again beats answering from nothing
+            urls = self.shard_urls
+
+        executor = self._get_executor()
+        with metrics.span("shards.scatter"):
+            futures = {executor.submit(self._call, url, path, payload): url for url in urls}
+            done, not_done = wait(futures, timeout=self.timeout)
+
+        responses = {}
+        for future in done:
+            url = futures[future]
+            try:
+                responses[url] = future.result()
+                self._down_until.pop(url, None)
+            except Exception as e:
+                metrics.increment("shards.error")
+                logger.warning("Shard %s failed: %s", url, e)
+                self._down_until[url] = now + self.retry_after
+        for future in not_done:
+            url = futures[future]
+            future.cancel()
+            metrics.increment("shards.timeout")
+            logger.warning("Shard %s didn't answer within %.2fs", url, self.timeout)
+            self._down_until[url] = now + self.retry_after
+
+        if len(responses) < len(self.shard_urls):
+            metrics.increment("shards.partial")
+        return [responses[url] for url in self.shard_urls if url in responses]
+
+    def search(self, query, threshold=0.3, category=None):
+        """
+        Search all shards for relevant information
+
+        Args:
+            query (str): The search query
+            threshold (float): Similarity threshold (0-1)
+            category (str, optional): Only score entries in this category
+
+        Returns:
+            list: Relevant knowledge entries
+        """
+        return [entry for entry, _ in self.search_scored(query, threshold, category)]
+
+    def search_scored(self, query, threshold=0.3, category=None):
+        """
+        Search all shards, keeping the similarity of each hit
+
+        Args:
+            query (str): The search query
+            threshold (float): Similarity threshold (0-1)
+            category (str, optional): Only score entries in this category
+
+        Returns:
+            list: (entry, score) tuples, best first, at most top_k
+        """
+        with metrics.span("knowledge.normalize_query"):
+            query = self.normalizer.normalize(query)
+
+        responses = self._scatter("/search", {
+            "query": query, "threshold": threshold, "category": category, "top_k": self.top_k,
+        })
+        hits = [(hit["entry"], hit["score"]) for response in responses for hit in response["results"]]
+        with metrics.span("shards.merge"):
+            return heapq.nlargest(self.top_k, hits, key=lambda hit: hit[1])
+
+    def get_definition(self, term):
+        """
+        Get the definition of a term from the first shard that indexes it
+
+        Args:
+            term (str): The term to define
+
+        Returns:
+            str: Definition or None if not found
+        """
+        for response in self._scatter("/definition", {"term": term}):
+            if response["answer"]:
+                return response["answer"]
+
+        results = self.search(f"what is {term}")
+        return results[0]["answer"] if results else None
+
+    def get_random_fact(self, category=None):
+        """
+        Get a random fact from a random shard that has one
+
+        Args:
+            category (str, optional): Category to filter by
+
+        Returns:
+            dict: Random knowledge entry, or None
+        """
+        entries = [response["entry"] for response in self._scatter("/random", {"category": category})
+                   if response["entry"] is not None]
+        if not entries and category:
+            return self.get_random_fact()
+        return random.choice(entries) if entries else None
+
+
+def wait_for_shards(urls, timeout=60.0):
+    """
+    Wait until every shard answers its health check
+
+    Args:
+        urls (list): Shard base URLs
+        timeout (float): Seconds to wait in total
+
+    Returns:
+        bool: True if all shards are up
+    """
+    deadline = time.monotonic() + timeout
+    pending = list(urls)
+    while pending and time.monotonic() < deadline:
+        url = pending[0]
+        try:
+            with urllib.request.urlopen(url.rstrip("/") + "/health", timeout=1.0) as response:
+                response.read()
+            pending.pop(0)
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+    return not pending
+
+
+def main(argv=None):
+    """Command line entry point: partition knowledge, serve a shard, or run all shards locally"""
+    parser = argparse.ArgumentParser(description="Sharded knowledge search")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split = subparsers.add_parser("partition", help="Split knowledge into shard slices")
+    source = split.add_mutually_exclusive_group()
+    source.add_argument("--knowledge", default="data/knowledge.json", help="JSON or NDJSON knowledge file")
+    source.add_argument("--database-url", help="Read KnowledgeEntry rows from this database instead")
+    split.add_argument("--shards", type=int, required=True, help="Number of shards")
+    split.add_argument("--strategy", choices=STRATEGIES, default="hash", help="How entries are assigned")
+    split.add_argument("--output", default=SHARD_DATA_DIR, help="Destination directory")
+
+    shard_server = subparsers.add_parser("serve", help="Serve one shard")
+    shard_server.add_argument("--data", default=SHARD_DATA_DIR, help="Directory written by partition")
+    shard_server.add_argument("--shard", type=int, required=True, help="Shard number")
+    shard_server.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    shard_server.add_argument("--port", type=int, default=8800, help="Port to listen on")
+
+    local = subparsers.add_parser("local", help="Run every shard as a process on localhost")
+    local.add_argument("--data", default=SHARD_DATA_DIR, help="Directory written by partition")
+    local.add_argument("--shards", type=int, required=True, help="Number of shards")
+    local.add_argument("--base-port", type=int, default=8800, help="Port of shard 0; shard N uses base + N")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "partition":
+        counts = partition(iter_source_entries(args.knowledge, args.database_url), args.output, args.shards,
+                           args.strategy)
+        print(f"Shard sizes: {counts}")
+        return 0
+
+    if args.command == "serve":
+        serve(args.data, args.shard, args.host, args.port)
+        return 0
+
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--data", args.data,
+                          "--shard", str(shard), "--port", str(args.base_port + shard)])
+        for shard in range(args.shards)
+    ]
+    urls = [f"http://127.0.0.1:{args.base_port + shard}" for shard in range(args.shards)]
+    try:
+        if not wait_for_shards(urls):
+            print("Some shards didn't start", file=sys.stderr)
+            return 1
+        print(f"EVA_KNOWLEDGE_SHARDS={','.join(urls)}")
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
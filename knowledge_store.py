@@ -0,0 +1,290 @@
+import os
+import json
+import shutil
+import logging
+from array import array
+from collections.abc import Mapping
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Entries without a database id (e.g. loaded from the JSON file)
+NO_ID = -1
+
+_ARRAY_FILES = (
+    "ids", "question_buffer", "question_offsets", "answer_buffer", "answer_offsets",
+    "category_codes", "language_codes",
+)
+
+
+class EntryView(Mapping):
+    """
+    Read-only, dict-like view of one entry in a CompactKnowledgeStore
+
+    Fields are decoded from the store on access, so holding a view costs a
+    store reference and a row number. Supports entry["answer"], entry.get(...),
+    iteration over keys and comparison with plain dicts.
+    """
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def index(self):
+        """Row number of the entry in its store"""
+        return self._index
+
+    def __getitem__(self, key):
+        if key == "answer":
+            return self._store.answer(self._index)
+        elif key == "question":
+            return self._store.question(self._index)
+        elif key == "category":
+            return self._store.category(self._index)
+        elif key == "language":
+            return self._store.language(self._index)
+        elif key == "id":
+            entry_id = self._store.entry_id(self._index)
+            if entry_id is not None:
+                return entry_id
+        raise KeyError(key)
+
+    def __iter__(self):
+        if self._store.entry_id(self._index) is not None:
+            yield "id"
+        yield from ("question", "answer", "category", "language")
+
+    def __len__(self):
+        return 5 if self._store.entry_id(self._index) is not None else 4
+
+    def to_dict(self):
+        """Materialize the entry as a plain dict"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"EntryView({self.to_dict()!r})"
+
+
+class CompactKnowledgeStore:
+    """
+    Array-backed storage for knowledge entries
+
+    Questions and answers are packed into contiguous UTF-8 buffers indexed by
+    offset arrays, categories and languages are interned into small integer
+    codes, and database ids are kept in an int64 array. The arrays can be
+    saved to a directory and loaded back memory-mapped, so several processes
+    can share the same pages.
+
+    The store behaves like a read-only sequence of EntryView objects.
+    """
+
+    def __init__(self, ids, question_buffer, question_offsets, answer_buffer, answer_offsets,
+                 category_codes, categories, language_codes, languages, metadata=None):
+        self.ids = ids
+        self.question_buffer = question_buffer
+        self.question_offsets = question_offsets
+        self.answer_buffer = answer_buffer
+        self.answer_offsets = answer_offsets
+        self.category_codes = category_codes
+        self.categories = categories
+        self.language_codes = language_codes
+        self.languages = languages
+        # Where a saved store came from (source file, database watermark)
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Build a store from an iterable of entry dicts in a single pass
+
+        Args:
+            entries (iterable): Dicts with question, answer, category and
+                optionally id and language
+
+        Returns:
+            CompactKnowledgeStore: The packed entries
+        """
+        ids = array("q")
+        question_buffer = bytearray()
+        question_offsets = array("q", [0])
+        answer_buffer = bytearray()
+        answer_offsets = array("q", [0])
+        category_codes = array("H")
+        language_codes = array("B")
+        categories, category_lookup = [], {}
+        languages, language_lookup = [], {}
+
+        for entry in entries:
+            entry_id = entry.get("id")
+            ids.append(NO_ID if entry_id is None else entry_id)
+
+            question_buffer += entry["question"].encode("utf-8")
+            question_offsets.append(len(question_buffer))
+            answer_buffer += entry["answer"].encode("utf-8")
+            answer_offsets.append(len(answer_buffer))
+
+            category = entry.get("category") or ""
+            code = category_lookup.get(category)
+            if code is None:
+                code = category_lookup[category] = len(categories)
+                categories.append(category)
+            category_codes.append(code)
+
+            language = entry.get("language") or "en"
+            code = language_lookup.get(language)
+            if code is None:
+                code = language_lookup[language] = len(languages)
+                languages.append(language)
+            language_codes.append(code)
+
+        return cls(
+            ids=np.frombuffer(ids, dtype=np.int64) if ids else np.empty(0, dtype=np.int64),
+            question_buffer=np.frombuffer(question_buffer, dtype=np.uint8),
+            question_offsets=np.frombuffer(question_offsets, dtype=np.int64),
+            answer_buffer=np.frombuffer(answer_buffer, dtype=np.uint8),
+            answer_offsets=np.frombuffer(answer_offsets, dtype=np.int64),
+            category_codes=np.frombuffer(category_codes, dtype=np.uint16) if category_codes else np.empty(0, dtype=np.uint16),
+            categories=categories,
+            language_codes=np.frombuffer(language_codes, dtype=np.uint8) if language_codes else np.empty(0, dtype=np.uint8),
+            languages=languages,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("knowledge entry index out of range")
+        return EntryView(self, int(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield EntryView(self, index)
+
+    def question(self, index):
+        start, end = self.question_offsets[index], self.question_offsets[index + 1]
+        return self.question_buffer[start:end].tobytes().decode("utf-8")
+
+    def answer(self, index):
+        start, end = self.answer_offsets[index], self.answer_offsets[index + 1]
+        return self.answer_buffer[start:end].tobytes().decode("utf-8")
+
+    def category(self, index):
+        return self.categories[self.category_codes[index]]
+
+    def language(self, index):
+        return self.languages[self.language_codes[index]]
+
+    def entry_id(self, index):
+        entry_id = int(self.ids[index])
+        return None if entry_id == NO_ID else entry_id
+
+    def category_rows(self):
+        """
+        Group row numbers by category
+
+        Returns:
+            dict: Category -> sorted int64 array of row numbers
+        """
+        if not len(self):
+            return {}
+
+        codes = np.asarray(self.category_codes)
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(self.categories))
+        groups = np.split(order, np.cumsum(counts)[:-1])
+        return {category: groups[code] for code, category in enumerate(self.categories) if counts[code]}
+
+    def iter_texts(self):
+        """
+        Yield "question answer" documents for vectorization
+
+        Yields:
+            str: Text of each entry, in row order
+        """
+        for index in range(len(self)):
+            yield f"{self.question(index)} {self.answer(index)}"
+
+    @property
+    def nbytes(self):
+        """Bytes used by the packed arrays"""
+        return sum(getattr(self, name).nbytes for name in _ARRAY_FILES)
+
+    def save(self, directory, metadata=None):
+        """
+        Write the store to a directory as .npy arrays plus a JSON manifest
+
+        The files are written to a sibling directory that then replaces the
+        destination, so processes loading the store never see a partial one
+        (stores already memory-mapped keep their unlinked files).
+
+        Args:
+            directory (str): Destination directory (created if needed)
+            metadata (dict, optional): JSON-serializable description of the
+                source, returned as store.metadata by load()
+        """
+        directory = os.path.normpath(directory)
+        temporary = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        for name in _ARRAY_FILES:
+            np.save(os.path.join(temporary, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(temporary, "manifest.json"), "w") as f:
+            json.dump({"categories": self.categories, "languages": self.languages, "count": len(self),
+                       "metadata": metadata or {}}, f)
+
+        previous = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.replace(directory, previous)
+        os.replace(temporary, directory)
+        shutil.rmtree(previous, ignore_errors=True)
+        logger.info("Saved %d knowledge entries to %s", len(self), directory)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load a store saved with save()
+
+        Args:
+            directory (str): Directory written by save()
+            mmap (bool): Memory-map the arrays instead of reading them
+
+        Returns:
+            CompactKnowledgeStore: The loaded store
+        """
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in _ARRAY_FILES
+        }
+        return cls(categories=manifest["categories"], languages=manifest["languages"],
+                   metadata=manifest.get("metadata"), **arrays)
+
+    @classmethod
+    def load_saved(cls, directory, mmap=True):
+        """
+        Load a saved store if the directory holds one
+
+        Args:
+            directory (str): Directory written by save()
+            mmap (bool): Memory-map the arrays instead of reading them
+
+        Returns:
+            CompactKnowledgeStore: The loaded store, or None if there is none
+            or it can't be read
+        """
+        if not directory or not os.path.exists(os.path.join(directory, "manifest.json")):
+            return None
+        try:
+            return cls.load(directory, mmap=mmap)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable knowledge store in %s: %s", directory, e)
+            return None
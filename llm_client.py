@@ -0,0 +1,510 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+import atexit
+import numpy as np
+from collections import OrderedDict
+import metrics
+from dense_retrieval import HashedNgramEmbedder
+from query_normalizer import tokenize
+
+logger = logging.getLogger(__name__)
+
+# The fallback tier is used when an API key is configured (EVA_LLM_FALLBACK=0 disables it)
+LLM_FALLBACK = os.environ.get("EVA_LLM_FALLBACK", "1") != "0"
+LLM_MODEL = os.environ.get("EVA_LLM_MODEL", "claude-3-opus-20240229")
+LLM_MAX_TOKENS = int(os.environ.get("EVA_LLM_MAX_TOKENS", 1000))
+
+# Point the client at another server, e.g. a local stub (benchmarks/llm_stub.py)
+LLM_BASE_URL = os.environ.get("EVA_LLM_BASE_URL") or None
+
+# Connection pool and request limits shared by every caller in the process
+LLM_MAX_CONNECTIONS = int(os.environ.get("EVA_LLM_MAX_CONNECTIONS", 20))
+LLM_MAX_CONCURRENCY = int(os.environ.get("EVA_LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_PENDING = int(os.environ.get("EVA_LLM_MAX_PENDING", 64))
+LLM_TIMEOUT = float(os.environ.get("EVA_LLM_TIMEOUT", 30))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("EVA_LLM_CONNECT_TIMEOUT", 5))
+
+# Retries with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.environ.get("EVA_LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.environ.get("EVA_LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get("EVA_LLM_BACKOFF_MAX", 8))
+
+# Persisted answer cache. Lookups are by exact (model, system, normalized
+# prompt) key; with a threshold below 1, prompts whose embeddings are at least
+# that similar to a cached prompt of the same model and system prompt reuse its
+# answer. Semantic reuse is off by default: near-duplicate prompts can ask for
+# different things ("causes of WW1" vs "causes of WW2" score 0.98)
+LLM_CACHE_PATH = os.environ.get("EVA_LLM_CACHE_PATH", "data/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.environ.get("EVA_LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("EVA_LLM_CACHE_MAX_ENTRIES", 10000))
+LLM_SEMANTIC_THRESHOLD = float(os.environ.get("EVA_LLM_SEMANTIC_THRESHOLD", 1))
+
+# HTTP statuses worth retrying (rate limits, overload and server errors)
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt for cache lookups: lowercase, accents folded, punctuation removed
+
+    Args:
+        prompt (str): Prompt text
+
+    Returns:
+        str: Normalized prompt
+    """
+    return " ".join(tokenize(prompt))
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cache_key(model, system, prompt):
+    """
+    Key identifying a request in the cache and among in-flight requests
+
+    Args:
+        model (str): Model name
+        system (str): System prompt, or None
+        prompt (str): User prompt
+
+    Returns:
+        str: Hex digest
+    """
+    return _digest(model, system or "", normalize_prompt(prompt))
+
+
+def cache_scope(model, system):
+    """
+    Cache partition of a request; semantic hits never cross partitions
+
+    Args:
+        model (str): Model name
+        system (str): System prompt, or None
+
+    Returns:
+        str: Hex digest
+    """
+    return _digest(model, system or "")
+
+
+def _numbers(prompt):
+    return [token for token in tokenize(prompt) if any(c.isdigit() for c in token)]
+
+
+class LLMCache:
+    """
+    SQLite-backed cache of LLM answers with optional semantic lookup
+
+    Answers are stored by request key and partitioned by model and system
+    prompt. When semantic lookup is enabled (threshold below 1), the
+    embeddings of the most recent prompts are also kept in memory per
+    partition, so a prompt that is a near-duplicate of a cached one for the
+    same model and system prompt (cosine similarity above the threshold, and
+    the same numbers) reuses its answer.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 semantic_threshold=LLM_SEMANTIC_THRESHOLD, embedder=None):
+        """
+        Initialize the cache (the database is opened on first use)
+
+        Args:
+            path (str): SQLite file
+            ttl (float): Seconds an answer stays valid
+            max_entries (int): Entries kept; the oldest are evicted
+            semantic_threshold (float): Minimum similarity for a semantic hit; 1 disables them
+            embedder (HashedNgramEmbedder, optional): Prompt embedder
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self.embedder = embedder or HashedNgramEmbedder()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+        # Cached keys, oldest first, with their partition
+        self._order = OrderedDict()
+        # Per partition: keys and prompt embeddings (semantic lookup only)
+        self._partitions = {}
+
+    @property
+    def semantic(self):
+        return self.semantic_threshold < 1
+
+    def _connect(self):
+        # A connection inherited through fork must not be reused
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, scope TEXT, prompt TEXT NOT NULL, response TEXT NOT NULL, "
+                "embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(llm_cache)")}
+            if "scope" not in columns:
+                # Entries cached before partitioning only serve exact hits
+                connection.execute("ALTER TABLE llm_cache ADD COLUMN scope TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache (created_at)")
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+            self._load_entries()
+        return self._connection
+
+    def _load_entries(self):
+        cutoff = time.time() - self.ttl
+        rows = self._connection.execute(
+            "SELECT key, scope, embedding FROM llm_cache WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?",
+            (cutoff, self.max_entries),
+        ).fetchall()
+        self._order = OrderedDict()
+        self._partitions = {}
+        for key, scope, embedding in reversed(rows):
+            self._add(key, scope, np.frombuffer(embedding, dtype=np.float16))
+        logger.info("LLM cache opened with %d entries", len(self._order))
+
+    def _add(self, key, scope, vector):
+        self._order[key] = scope
+        if self.semantic and scope is not None:
+            partition = self._partitions.setdefault(scope, {"keys": [], "vectors": [], "matrix": None})
+            partition["keys"].append(key)
+            partition["vectors"].append(vector)
+            partition["matrix"] = None
+
+    def _remove(self, key):
+        scope = self._order.pop(key)
+        partition = self._partitions.get(scope)
+        if partition is not None and key in partition["keys"]:
+            position = partition["keys"].index(key)
+            del partition["keys"][position]
+            del partition["vectors"][position]
+            partition["matrix"] = None
+
+    def _embed(self, prompt):
+        return self.embedder.embed([normalize_prompt(prompt)])[0]
+
+    def _fetch(self, connection, key):
+        row = connection.execute(
+            "SELECT response, created_at, prompt FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return row
+
+    def get(self, key, prompt, scope=None):
+        """
+        Look up an answer by exact key, then (if enabled) by prompt similarity
+
+        Args:
+            key (str): Request key
+            prompt (str): User prompt
+            scope (str, optional): Request partition (cache_scope); without
+                one only exact hits are returned
+
+        Returns:
+            str: Cached answer, or None
+        """
+        with self._lock:
+            connection = self._connect()
+            row = self._fetch(connection, key)
+            if row is not None:
+                return row[0]
+
+            partition = self._partitions.get(scope) if self.semantic else None
+            if not partition or not partition["keys"]:
+                return None
+
+            if partition["matrix"] is None:
+                partition["matrix"] = np.vstack(partition["vectors"]).astype(np.float32)
+            similarities = partition["matrix"] @ self._embed(prompt)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.semantic_threshold:
+                return None
+            row = self._fetch(connection, partition["keys"][best])
+            # Similar wording with different numbers (years, quantities) asks something else
+            if row is None or _numbers(row[2]) != _numbers(prompt):
+                return None
+            logger.debug("Semantic LLM cache hit (%.3f)", similarities[best])
+            return row[0]
+
+    def put(self, key, prompt, response, scope=None):
+        """
+        Store an answer, evicting the oldest entries past max_entries
+
+        Args:
+            key (str): Request key
+            prompt (str): User prompt
+            response (str): Answer
+            scope (str, optional): Request partition (cache_scope)
+        """
+        vector = self._embed(prompt).astype(np.float16)
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, scope, prompt, response, embedding, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, prompt, response, vector.tobytes(), time.time()),
+            )
+            if key in self._order:
+                self._remove(key)
+            self._add(key, scope, vector)
+
+            evicted = []
+            while len(self._order) > self.max_entries:
+                oldest = next(iter(self._order))
+                self._remove(oldest)
+                evicted.append((oldest,))
+            if evicted:
+                connection.executemany("DELETE FROM llm_cache WHERE key = ?", evicted)
+            connection.commit()
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+
+class LLMClient:
+    """
+    Shared, concurrency-limited client for the LLM fallback tier
+
+    One AsyncAnthropic client (and its connection pool) runs on a background
+    event loop thread, started on the first request so that it is created in
+    the process serving requests (a thread started before a fork, e.g. by a
+    preloading server, doesn't exist in the workers). Callers block on
+    complete(), which checks the cache, joins an identical in-flight request
+    if there is one, and otherwise queues a request behind a global
+    semaphore. Failed requests are retried with jittered exponential backoff,
+    and answers are written to the cache.
+    """
+
+    def __init__(self, api_key=None, base_url=LLM_BASE_URL, model=LLM_MODEL, cache=None,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_pending=LLM_MAX_PENDING):
+        """
+        Initialize the client (the event loop thread starts on first use)
+
+        Args:
+            api_key (str, optional): API key; defaults to ANTHROPIC_API_KEY
+            base_url (str, optional): API base URL (e.g. a local stub)
+            model (str): Model name
+            cache (LLMCache, optional): Answer cache; None disables caching
+            max_concurrency (int): Requests sent at the same time
+            max_pending (int): Requests allowed to wait for a slot; more are rejected
+        """
+        import anthropic
+
+        self._anthropic = anthropic
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start the event loop thread and the HTTP client in this process"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            import httpx
+
+            anthropic = self._anthropic
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="eva-llm-loop", daemon=True)
+            thread.start()
+
+            async def create():
+                # Loop-bound objects must be created on the loop's thread
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._pending = 0
+                self._inflight = {}
+                return anthropic.AsyncAnthropic(
+                    api_key=self.api_key or os.environ.get("ANTHROPIC_API_KEY"),
+                    base_url=self.base_url,
+                    max_retries=0,
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                    http_client=anthropic.DefaultAsyncHttpxClient(
+                        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                            max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                    ),
+                )
+
+            try:
+                self._client = asyncio.run_coroutine_threadsafe(create(), loop).result()
+            except Exception:
+                loop.call_soon_threadsafe(loop.stop)
+                raise
+            self._loop = loop
+            self._thread = thread
+            self._pid = os.getpid()
+            logger.info("LLM client started (model %s, %d concurrent requests)", self.model, self.max_concurrency)
+
+    def complete(self, prompt, system=None, max_tokens=LLM_MAX_TOKENS, timeout=LLM_TIMEOUT):
+        """
+        Get an answer for a prompt
+
+        Args:
+            prompt (str): User prompt
+            system (str, optional): System prompt
+            max_tokens (int): Maximum tokens in the answer
+            timeout (float): Seconds to wait, including queueing and retries
+
+        Returns:
+            str: The answer, or None if it couldn't be obtained in time
+        """
+        key = cache_key(self.model, system, prompt)
+        scope = cache_scope(self.model, system)
+
+        with metrics.span("llm.complete"):
+            if self.cache is not None:
+                try:
+                    with metrics.span("llm.cache_lookup"):
+                        cached = self.cache.get(key, prompt, scope)
+                    if cached is not None:
+                        return cached
+                except Exception as e:
+                    logger.error("Error reading LLM cache: %s", e)
+
+            try:
+                self._ensure_started()
+                future = asyncio.run_coroutine_threadsafe(
+                    self._complete(key, scope, prompt, system, max_tokens), self._loop
+                )
+                return future.result(timeout)
+            except TimeoutError:
+                future.cancel()
+                logger.warning("LLM request timed out after %.1fs", timeout)
+            except Exception as e:
+                logger.error("LLM request failed: %s", e)
+            return None
+
+    async def _complete(self, key, scope, prompt, system, max_tokens):
+        """Join an identical in-flight request or start a new one"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(key, scope, prompt, system, max_tokens))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug("Coalesced LLM request")
+
+        # Shield the shared task so one caller giving up doesn't cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _request(self, key, scope, prompt, system, max_tokens):
+        """Send one request through the concurrency cap, with retries"""
+        if self._pending >= self.max_pending:
+            logger.warning("LLM queue full (%d waiting), rejecting request", self._pending)
+            return None
+
+        self._pending += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._pending -= 1
+
+        try:
+            response = await self._send_with_retries(prompt, system, max_tokens)
+        finally:
+            self._semaphore.release()
+
+        text = "".join(block.text for block in response.content if block.type == "text")
+        if self.cache is not None and text:
+            try:
+                await asyncio.to_thread(self.cache.put, key, prompt, text, scope)
+            except Exception as e:
+                logger.error("Error writing LLM cache: %s", e)
+        return text
+
+    async def _send_with_retries(self, prompt, system, max_tokens):
+        parameters = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if system:
+            parameters["system"] = system
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                with metrics.span("llm.request"):
+                    return await self._client.messages.create(**parameters)
+            except (self._anthropic.APIConnectionError, self._anthropic.APIStatusError) as e:
+                status = getattr(e, "status_code", None)
+                retryable = status is None or status in RETRYABLE_STATUSES
+                if not retryable or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+                logger.warning("LLM request failed (%s), retrying in %.2fs", status or type(e).__name__, delay)
+                await asyncio.sleep(delay)
+
+    def close(self):
+        """Close the HTTP client and stop the event loop"""
+        if self._loop is None or self._pid != os.getpid() or not self._loop.is_running():
+            if self.cache is not None:
+                self.cache.close()
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result(5)
+        except Exception as e:
+            logger.error("Error closing LLM client: %s", e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        if self.cache is not None:
+            self.cache.close()
+
+
+_client = None
+_client_failed = False
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """
+    Get the process-wide LLM client, creating it on first use
+
+    Returns:
+        LLMClient: The shared client, or None if the fallback is disabled, no
+        API key is configured or the client can't be created
+    """
+    global _client, _client_failed
+    if _client is not None or _client_failed or not LLM_FALLBACK or not os.environ.get("ANTHROPIC_API_KEY"):
+        return _client
+
+    with _client_lock:
+        if _client is None and not _client_failed:
+            try:
+                _client = LLMClient(cache=LLMCache())
+                atexit.register(_client.close)
+            except Exception as e:
+                # Don't retry on every request; the fallback stays off for this process
+                logger.error("Error creating LLM client: %s", e)
+                _client_failed = True
+    return _client
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import atexit
+import logging
+import threading
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener
+
+# Per-environment defaults, overridable with EVA_LOG_LEVEL, EVA_LOG_FORMAT
+# and EVA_LOG_DEBUG_SAMPLE_RATE
+ENVIRONMENTS = {
+    "development": {"level": "DEBUG", "format": "text", "debug_sample_rate": 1.0},
+    "production": {"level": "INFO", "format": "json", "debug_sample_rate": 0.01},
+    "test": {"level": "WARNING", "format": "text", "debug_sample_rate": 1.0},
+}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including `extra` fields"""
+
+    def format(self, record):
+        payload = {
+            "timestamp": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                payload[key] = value
+
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Keeps one in every N DEBUG records per message template
+
+    Sampling is keyed on the unformatted message, so it only groups records
+    that use lazy %-style arguments. Records above DEBUG always pass.
+    """
+
+    MAX_TEMPLATES = 10000
+
+    def __init__(self, rate):
+        """
+        Initialize the filter
+
+        Args:
+            rate (float): Fraction of DEBUG records to keep (0-1)
+        """
+        super().__init__()
+        self.every = max(1, int(round(1.0 / rate))) if rate > 0 else 0
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.every == 0:
+            return False
+        if self.every == 1:
+            return True
+
+        key = (record.name, record.msg)
+        with self.lock:
+            if len(self.counts) >= self.MAX_TEMPLATES:
+                self.counts.clear()
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+        return count % self.every == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread
+
+    The stock handler formats every record before enqueueing it so it can be
+    pickled. The queue here never leaves the process, so the record is passed
+    as-is and the message is only built off the request thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _get_environment(environment):
+    # Unset means production: debug logging has to be asked for (EVA_ENV=development)
+    environment = environment or os.environ.get("EVA_ENV") or os.environ.get("FLASK_ENV") or "production"
+    if environment not in ENVIRONMENTS:
+        environment = "production"
+    return environment
+
+
+def configure_logging(environment=None, stream=None):
+    """
+    Configure logging for an environment
+
+    Records are filtered and sampled on the calling thread, then handed to a
+    queue; a QueueListener thread formats and writes them.
+
+    Args:
+        environment (str, optional): "development", "production" or "test";
+            defaults to EVA_ENV / FLASK_ENV, and to "production" when neither is set
+        stream (file, optional): Output stream, defaults to stderr
+
+    Returns:
+        QueueListener: The running listener
+    """
+    global _listener
+
+    settings = dict(ENVIRONMENTS[_get_environment(environment)])
+    settings["level"] = os.environ.get("EVA_LOG_LEVEL", settings["level"]).upper()
+    settings["format"] = os.environ.get("EVA_LOG_FORMAT", settings["format"]).lower()
+    try:
+        settings["debug_sample_rate"] = float(os.environ.get("EVA_LOG_DEBUG_SAMPLE_RATE", settings["debug_sample_rate"]))
+    except ValueError:
+        pass
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if settings["format"] == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    queue = SimpleQueue()
+    queue_handler = DeferredQueueHandler(queue)
+    queue_handler.addFilter(DebugSamplingFilter(settings["debug_sample_rate"]))
+
+    if _listener is not None:
+        _listener.stop()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings["level"])
+
+    _listener = QueueListener(queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
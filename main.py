@@ -1,11 +1,9 @@
 from app import app
-import anthropic
-import os
 # Import models para criar as tabelas
 from app import db
 import models  # noqa: F401
-# Initialize the client with import osmy_secret = os.environ['ANTHROPIC_KEY_CLIENT']API key
-client = anthropic.Anthropic(api_key="sk-ant-REDACTED")
+# Cliente compartilhado (pool de conexões, limite de concorrência e cache); a chave vem de ANTHROPIC_API_KEY
+from llm_client import get_llm_client
 
 def conversar_com_claude(mensagem):
     # Adiciona contexto sobre o nome Eve
@@ -13,14 +11,13 @@ def conversar_com_claude(mensagem):
         context = "Você é uma assistente chamada Eve. Sempre que perguntarem seu nome, responda que seu nome é Eve. "
         mensagem = context + mensagem
     
-    resposta = client.messages.create(
-        model="claude-3-opus-20240229",  # ou "claude-3-sonnet-20240229" (mais rápido e barato)
-        max_tokens=1000,
-        messages=[
-            {"role": "user", "content": mensagem}
-        ]
-    )
-    return resposta.content
+    client = get_llm_client()
+    if client is None:
+        return "Defina ANTHROPIC_API_KEY para conversar comigo."
+    
+    # O modelo é configurado por EVA_LLM_MODEL
+    resposta = client.complete(mensagem)
+    return resposta or "Desculpe, não consegui responder agora. Tente novamente."
 
 # Loop de conversa
 print("Eve: Olá! Sou a Eve, como posso ajudar?")
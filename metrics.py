@@ -0,0 +1,321 @@
+import os
+import bisect
+import threading
+from time import perf_counter_ns
+
+# Instrumentation can be switched off entirely with EVA_METRICS=0
+_enabled = os.environ.get("EVA_METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Log-linear buckets: every power of two is split into 2**SUB_BUCKET_BITS sub-buckets,
+# which keeps the relative error under 25% from 1 microsecond up to MAX_VALUE_US
+SUB_BUCKET_BITS = 2
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+MAX_VALUE_US = (1 << 27) - 1  # ~134 seconds
+
+
+def _bucket_index(value_us):
+    """Map a latency in microseconds to its histogram bucket"""
+    if value_us < SUB_BUCKET_COUNT:
+        return value_us if value_us > 0 else 0
+    if value_us > MAX_VALUE_US:
+        value_us = MAX_VALUE_US
+    shift = value_us.bit_length() - SUB_BUCKET_BITS - 1
+    return ((shift + 1) << SUB_BUCKET_BITS) + (value_us >> shift) - SUB_BUCKET_COUNT
+
+
+def _bucket_upper_bound_us(index):
+    """Exclusive upper bound, in microseconds, of a histogram bucket"""
+    if index < SUB_BUCKET_COUNT:
+        return index + 1
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = (index & (SUB_BUCKET_COUNT - 1)) + SUB_BUCKET_COUNT
+    return (mantissa + 1) << shift
+
+
+BUCKET_COUNT = _bucket_index(MAX_VALUE_US) + 1
+
+# Bucket bounds (seconds) exported to Prometheus. They are fixed, so every
+# stage exposes the same small set of series no matter which latencies were
+# seen; the fine-grained buckets above only serve in-process percentiles
+EXPORT_BUCKETS = tuple(sorted(float(bound) for bound in os.environ.get(
+    "EVA_METRICS_BUCKETS", "0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30"
+).split(",")))
+_EXPORT_BOUNDS_US = tuple(bound * 1e6 for bound in EXPORT_BUCKETS)
+
+
+class Histogram:
+    """
+    Fixed-size latency histogram with HDR-style log-linear buckets
+
+    Recording is a bucket computation and an increment under a lock, so the
+    cost per observation stays constant regardless of how many were recorded.
+    """
+
+    __slots__ = ("name", "counts", "export_counts", "total_us", "count", "max_index", "_lock")
+
+    def __init__(self, name):
+        """
+        Initialize an empty histogram
+
+        Args:
+            name (str): Stage name used as the Prometheus label
+        """
+        self.name = name
+        self.counts = [0] * BUCKET_COUNT
+        # Per EXPORT_BUCKETS bound, plus one past the last (non-cumulative)
+        self.export_counts = [0] * (len(EXPORT_BUCKETS) + 1)
+        self.total_us = 0
+        self.count = 0
+        self.max_index = -1
+        self._lock = threading.Lock()
+
+    def record_ns(self, elapsed_ns):
+        """
+        Record one observation
+
+        Args:
+            elapsed_ns (int): Elapsed time in nanoseconds
+        """
+        value_us = elapsed_ns // 1000
+        index = _bucket_index(value_us)
+        export_index = bisect.bisect_left(_EXPORT_BOUNDS_US, elapsed_ns / 1000)
+        with self._lock:
+            self.counts[index] += 1
+            self.export_counts[export_index] += 1
+            self.total_us += value_us
+            self.count += 1
+            if index > self.max_index:
+                self.max_index = index
+
+    def snapshot(self):
+        """
+        Get a consistent copy of the histogram state
+
+        Returns:
+            tuple: (bucket counts, sum in microseconds, count, highest used bucket)
+        """
+        with self._lock:
+            return list(self.counts), self.total_us, self.count, self.max_index
+
+    def export_snapshot(self):
+        """
+        Get a consistent copy of the Prometheus view of the histogram
+
+        Returns:
+            tuple: (counts per EXPORT_BUCKETS bound, sum in microseconds, count)
+        """
+        with self._lock:
+            return list(self.export_counts), self.total_us, self.count
+
+    def percentile(self, fraction):
+        """
+        Estimate a percentile from the buckets
+
+        Args:
+            fraction (float): Percentile as a fraction (0-1)
+
+        Returns:
+            float: Upper bound of the bucket holding the percentile, in seconds
+        """
+        counts, _, count, _ = self.snapshot()
+        if not count:
+            return 0.0
+        target = fraction * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if bucket_count and seen >= target:
+                return _bucket_upper_bound_us(index) / 1e6
+        return MAX_VALUE_US / 1e6
+
+
+class Counter:
+    """Monotonic event counter"""
+
+    __slots__ = ("name", "value", "_lock")
+
+    def __init__(self, name):
+        """
+        Initialize a counter at zero
+
+        Args:
+            name (str): Event name used as the Prometheus label
+        """
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self, amount=1):
+        """
+        Add to the counter
+
+        Args:
+            amount (int): Amount to add
+        """
+        with self._lock:
+            self.value += amount
+
+
+class _Span:
+    """Context manager that records its duration into a histogram"""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.record_ns(perf_counter_ns() - self.start)
+        return False
+
+
+class _NullSpan:
+    """Shared no-op span used while instrumentation is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_histograms = {}
+_counters = {}
+_registry_lock = threading.Lock()
+
+
+def get_histogram(name):
+    """
+    Get or create the histogram for a stage
+
+    Args:
+        name (str): Stage name, e.g. "knowledge.search"
+
+    Returns:
+        Histogram: The stage histogram
+    """
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _registry_lock:
+            histogram = _histograms.setdefault(name, Histogram(name))
+    return histogram
+
+
+def get_counter(name):
+    """
+    Get or create the counter for an event
+
+    Args:
+        name (str): Event name, e.g. "admission.admitted"
+
+    Returns:
+        Counter: The event counter
+    """
+    counter = _counters.get(name)
+    if counter is None:
+        with _registry_lock:
+            counter = _counters.setdefault(name, Counter(name))
+    return counter
+
+
+def increment(name, amount=1):
+    """
+    Count an event
+
+    Args:
+        name (str): Event name
+        amount (int): Amount to add
+    """
+    if _enabled:
+        get_counter(name).increment(amount)
+
+
+def span(name):
+    """
+    Time a block of code as a named stage
+
+    Usage:
+        with metrics.span("knowledge.search"):
+            ...
+
+    Args:
+        name (str): Stage name
+
+    Returns:
+        Context manager recording the block's latency
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = get_histogram(name)
+    return _Span(histogram)
+
+
+def is_enabled():
+    """Return whether instrumentation is active"""
+    return _enabled
+
+
+def set_enabled(enabled):
+    """
+    Switch instrumentation on or off at runtime
+
+    Args:
+        enabled (bool): Whether spans should record
+    """
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def reset():
+    """Drop all recorded histograms and counters"""
+    with _registry_lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def render_prometheus():
+    """
+    Render all histograms and counters in the Prometheus text exposition format
+
+    Histograms and counters are per process, so under a multi-worker server each scrape
+    reflects the worker that served it.
+
+    Returns:
+        str: Prometheus text format payload
+    """
+    lines = [
+        "# HELP eva_stage_latency_seconds Latency of chat pipeline stages",
+        "# TYPE eva_stage_latency_seconds histogram",
+    ]
+
+    with _registry_lock:
+        histograms = dict(_histograms)
+
+    for name in sorted(histograms):
+        counts, total_us, count = histograms[name].export_snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(EXPORT_BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f'eva_stage_latency_seconds_bucket{{stage="{name}",le="{bound:g}"}} {cumulative}')
+        lines.append(f'eva_stage_latency_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+        lines.append(f'eva_stage_latency_seconds_sum{{stage="{name}"}} {total_us / 1e6:.6f}')
+        lines.append(f'eva_stage_latency_seconds_count{{stage="{name}"}} {count}')
+
+    with _registry_lock:
+        counters = dict(_counters)
+    if counters:
+        lines.append("# HELP eva_events_total Events counted by the application")
+        lines.append("# TYPE eva_events_total counter")
+        for name in sorted(counters):
+            lines.append(f'eva_events_total{{event="{name}"}} {counters[name].value}')
+
+    return "\n".join(lines) + "\n"
@@ -5,8 +5,11 @@ from app import db
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(64), index=True, nullable=True)  # Para identificação anônima de usuários
-    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Seleção de conversas para arquivamento
     messages = db.relationship('Message', backref='conversation', lazy='dynamic', cascade="all, delete-orphan")
+    
+    # Ids nunca reutilizados no SQLite: uma conversa arquivada e apagada não pode ser sombreada por uma nova
+    __table_args__ = {'sqlite_autoincrement': True}
 
 
 class Message(db.Model):
@@ -16,12 +19,47 @@ class Message(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     
+    # Mensagens de uma conversa em ordem, e checagem de atividade recente no arquivamento;
+    # páginas da exportação em ordem de (timestamp, id), lidas direto do índice;
+    # ids nunca reutilizados no SQLite (cursor da exportação e apagamento por id no arquivamento)
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),
+        db.Index('ix_message_timestamp_id', 'timestamp', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+    
     
 class KnowledgeEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String(255), nullable=False)
     answer = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(50), nullable=False)
-    language = db.Column(db.String(5), default='en')  # Código do idioma: 'en', 'pt', etc
+    language = db.Column(db.String(5), nullable=False, default='en')  # Código do idioma: 'en', 'pt', etc (parte da chave de paginação)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Marca d'água da carga incremental
+    
+    # Paginação por (categoria, idioma, id) e contagens por filtro direto do índice
+    __table_args__ = (db.Index('ix_knowledge_entry_category_language_id', 'category', 'language', 'id'),)
+
+
+class KnowledgeVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Incrementado a cada sincronização da base
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IntentRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    intent = db.Column(db.String(20), nullable=False)
+    language = db.Column(db.String(5), nullable=False)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    knowledge_hits = db.Column(db.Integer, nullable=False, default=0)
+    knowledge_misses = db.Column(db.Integer, nullable=False, default=0)  # Respondidas pelo LLM ou pela resposta genérica
+    llm_fallbacks = db.Column(db.Integer, nullable=False, default=0)
+    unknown_responses = db.Column(db.Integer, nullable=False, default=0)
+    scored_hits = db.Column(db.Integer, nullable=False, default=0)  # Acertos com similaridade (definições diretas não têm)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)  # Soma das melhores similaridades, para a média dos scored_hits
+    
+    # Chave dos upserts incrementais (ON CONFLICT) e das consultas por período
+    __table_args__ = (db.UniqueConstraint('day', 'intent', 'language', name='uq_intent_rollup_day_intent_language'),)
@@ -8,6 +8,7 @@ from nltk.stem import WordNetLemmatizer
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.naive_bayes import MultinomialNB
 import numpy as np
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +37,7 @@ class NLPProcessor:
             logger.info("NLP processor initialized successfully")
         
         except Exception as e:
-            logger.error(f"Error initializing NLP processor: {str(e)}")
+            logger.error("Error initializing NLP processor: %s", e)
     
     def _init_intent_classifier(self):
         """Initialize the intent classifier with training data"""
@@ -120,19 +121,21 @@ class NLPProcessor:
             text = text.translate(str.maketrans('', '', string.punctuation))
             
             # Tokenize
-            tokens = word_tokenize(text)
+            with metrics.span("nlp.tokenize"):
+                tokens = word_tokenize(text)
             
             # Remove stop words
             tokens = [token for token in tokens if token not in self.stop_words]
             
             # Lemmatize
-            tokens = [self.lemmatizer.lemmatize(token) for token in tokens]
+            with metrics.span("nlp.lemmatize"):
+                tokens = [self.lemmatizer.lemmatize(token) for token in tokens]
             
             # Rejoin tokens
             return ' '.join(tokens)
         
         except Exception as e:
-            logger.error(f"Error preprocessing text: {str(e)}")
+            logger.error("Error preprocessing text: %s", e)
             return text
     
     def classify_intent(self, text):
@@ -147,10 +150,12 @@ class NLPProcessor:
         """
         try:
             # Convert text to vector
-            text_vec = self.vectorizer.transform([text])
+            with metrics.span("nlp.intent_vectorize"):
+                text_vec = self.vectorizer.transform([text])
             
             # Predict intent
-            intent = self.intent_classifier.predict(text_vec)[0]
+            with metrics.span("nlp.intent_predict"):
+                intent = self.intent_classifier.predict(text_vec)[0]
             
             # Rule-based refinements for better accuracy
             if '?' in text:
@@ -163,7 +168,7 @@ class NLPProcessor:
             return intent
         
         except Exception as e:
-            logger.error(f"Error classifying intent: {str(e)}")
+            logger.error("Error classifying intent: %s", e)
             return "conversation"  # Default to conversation
     
     def extract_entities(self, text):
@@ -227,7 +232,7 @@ class NLPProcessor:
             return entities
         
         except Exception as e:
-            logger.error(f"Error extracting entities: {str(e)}")
+            logger.error("Error extracting entities: %s", e)
             return []
     
     def extract_topics(self, text):
@@ -257,7 +262,7 @@ class NLPProcessor:
             return topics
         
         except Exception as e:
-            logger.error(f"Error extracting topics: {str(e)}")
+            logger.error("Error extracting topics: %s", e)
             return []
     
     def is_question(self, text):
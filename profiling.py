@@ -0,0 +1,321 @@
+import os
+import sys
+import hmac
+import pstats
+import logging
+import cProfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Per-request profiling is only available when an admin token is configured
+PROFILE_TOKEN = os.environ.get("EVA_PROFILE_TOKEN")
+PROFILE_HEADER = "X-Eva-Profile"
+PROFILE_MODE_HEADER = "X-Eva-Profile-Mode"
+
+PROFILE_DIR = os.environ.get("EVA_PROFILE_DIR", "profiles")
+PROFILE_MAX_BYTES = int(os.environ.get("EVA_PROFILE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Reports are named eva-profile-<label>-<timestamp>.<ext>; rotation only ever
+# deletes files matching this, whatever else shares the directory
+REPORT_PREFIX = "eva-profile-"
+REPORT_EXTENSIONS = (".prof", ".txt", ".folded")
+
+# Sampling interval (seconds) used while profiling a single request
+REQUEST_SAMPLE_INTERVAL = float(os.environ.get("EVA_PROFILE_REQUEST_INTERVAL", 0.001))
+
+
+def _frame_label(frame):
+    """Format a frame as a flame graph node"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """
+    Convert a frame and its callers into a collapsed stack line (root first)
+
+    Args:
+        frame (frame): Innermost frame
+
+    Returns:
+        str: Frames joined by ';'
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+def _timestamp():
+    return datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def _report_base(label):
+    return os.path.join(PROFILE_DIR, f"{REPORT_PREFIX}{label}-{_timestamp()}")
+
+
+def _is_report(name):
+    return name.startswith(REPORT_PREFIX) and name.endswith(REPORT_EXTENSIONS)
+
+
+def rotate_reports(directory=None, max_bytes=None):
+    """
+    Delete the oldest reports until they fit within the size budget
+
+    Only this module's own reports count towards the budget and are deleted;
+    other files in the directory are left alone.
+
+    Args:
+        directory (str, optional): Report directory
+        max_bytes (int, optional): Size budget in bytes
+    """
+    directory = directory or PROFILE_DIR
+    max_bytes = PROFILE_MAX_BYTES if max_bytes is None else max_bytes
+
+    try:
+        reports = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if _is_report(name) and os.path.isfile(path):
+                stat = os.stat(path)
+                reports.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in reports)
+        for _, size, path in sorted(reports):
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+    except OSError as e:
+        logger.error("Error rotating profile reports: %s", e)
+
+
+def write_collapsed(path, stacks):
+    """
+    Write aggregated stacks in the collapsed format used by flame graph tools
+
+    Args:
+        path (str): Destination file
+        stacks (Counter): Collapsed stack -> sample count
+    """
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+class _ThreadSampler(threading.Thread):
+    """Samples the stack of one thread (or all threads) at a fixed interval"""
+
+    def __init__(self, interval, target_thread_id=None):
+        super().__init__(daemon=True, name="eva-profile-sampler")
+        self.interval = interval
+        self.target_thread_id = target_thread_id
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                if self.target_thread_id is not None:
+                    frame = frames.get(self.target_thread_id)
+                    if frame is not None:
+                        self.stacks[collapse_stack(frame)] += 1
+                else:
+                    # Leave the profiler's own threads out of the aggregate
+                    ignored = {thread.ident for thread in threading.enumerate() if thread.name.startswith("eva-profile")}
+                    for thread_id, frame in frames.items():
+                        if thread_id not in ignored:
+                            self.stacks[collapse_stack(frame)] += 1
+
+    def drain(self):
+        """Return the collected stacks and start a new aggregation window"""
+        with self.lock:
+            stacks, self.stacks = self.stacks, Counter()
+        return stacks
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class RequestProfiler:
+    """
+    Context manager that profiles one block of code when enabled
+
+    The deterministic mode runs the block under cProfile and writes a .prof
+    file plus a text summary; the sampling mode samples the calling thread's
+    stack and writes a collapsed-stack (.folded) file.
+    """
+
+    def __init__(self, mode=None, label="request"):
+        """
+        Initialize the profiler
+
+        Args:
+            mode (str, optional): "deterministic", "sampling" or None to disable
+            label (str): Prefix for the report file name
+        """
+        self.mode = mode
+        self.label = label
+        self.report_path = None
+        self._profile = None
+        self._sampler = None
+
+    @property
+    def enabled(self):
+        return self.mode is not None
+
+    def __enter__(self):
+        if self.mode == "deterministic":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.mode == "sampling":
+            self._sampler = _ThreadSampler(REQUEST_SAMPLE_INTERVAL, threading.get_ident())
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.enabled:
+            return False
+
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = _report_base(self.label)
+
+            if self._profile is not None:
+                self._profile.disable()
+                self.report_path = f"{base}.prof"
+                self._profile.dump_stats(self.report_path)
+                with open(f"{base}.txt", "w") as f:
+                    stats = pstats.Stats(self._profile, stream=f)
+                    stats.sort_stats("cumulative").print_stats(50)
+            elif self._sampler is not None:
+                self._sampler.stop()
+                self._sampler.join()
+                self.report_path = f"{base}.folded"
+                write_collapsed(self.report_path, self._sampler.drain())
+
+            rotate_reports()
+            logger.info("Profile report written to %s", self.report_path)
+        except Exception as e:
+            logger.error("Error writing profile report: %s", e)
+
+        return False
+
+
+def request_profiler(request):
+    """
+    Build a profiler for a Flask request
+
+    Profiling is enabled only when EVA_PROFILE_TOKEN is set and the request
+    carries it in the X-Eva-Profile header. The token is never read from the
+    query string, where it would end up in access logs and browser history.
+    The mode comes from X-Eva-Profile-Mode and defaults to the sampling
+    profiler.
+
+    Args:
+        request (Request): The current Flask request
+
+    Returns:
+        RequestProfiler: Profiler (disabled unless the request is authorized)
+    """
+    if not PROFILE_TOKEN:
+        return RequestProfiler()
+
+    token = request.headers.get(PROFILE_HEADER)
+    if not token or not hmac.compare_digest(token, PROFILE_TOKEN):
+        return RequestProfiler()
+
+    mode = request.headers.get(PROFILE_MODE_HEADER) or "sampling"
+    if mode not in ("deterministic", "sampling"):
+        mode = "sampling"
+    return RequestProfiler(mode, label="chat")
+
+
+class BackgroundSampler:
+    """
+    Low-rate sampler that aggregates stacks from every thread across requests
+
+    Every flush interval the aggregated stacks are written to a collapsed-stack
+    file, ready to be rendered as a flame graph.
+    """
+
+    def __init__(self, interval=0.05, flush_interval=300):
+        """
+        Initialize the sampler
+
+        Args:
+            interval (float): Seconds between samples
+            flush_interval (float): Seconds between report files
+        """
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._sampler = None
+        self._flusher = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Start sampling in background threads"""
+        self._sampler = _ThreadSampler(self.interval)
+        self._sampler.start()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="eva-profile-flusher")
+        self._flusher.start()
+        logger.info("Background stack sampling every %ss, flushing every %ss", self.interval, self.flush_interval)
+
+    def stop(self):
+        """Stop sampling and write the last window"""
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler.join()
+            self.flush()
+
+    def flush(self):
+        """Write the stacks collected since the last flush"""
+        stacks = self._sampler.drain()
+        if not stacks:
+            return None
+
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = f"{_report_base('sampled')}.folded"
+            write_collapsed(path, stacks)
+            rotate_reports()
+            return path
+        except Exception as e:
+            logger.error("Error writing sampled stacks: %s", e)
+            return None
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+
+_background_sampler = None
+
+
+def start_background_sampler():
+    """
+    Start the process-wide background sampler if EVA_PROFILE_SAMPLING is enabled
+
+    Returns:
+        BackgroundSampler: The running sampler, or None when disabled
+    """
+    global _background_sampler
+
+    if os.environ.get("EVA_PROFILE_SAMPLING", "0").strip().lower() not in ("1", "true", "yes", "on"):
+        return None
+
+    if _background_sampler is None:
+        _background_sampler = BackgroundSampler(
+            interval=float(os.environ.get("EVA_PROFILE_SAMPLE_INTERVAL", 0.05)),
+            flush_interval=float(os.environ.get("EVA_PROFILE_FLUSH_INTERVAL", 300)),
+        )
+        _background_sampler.start()
+    return _background_sampler
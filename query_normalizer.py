@@ -0,0 +1,463 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import threading
+import unicodedata
+from collections import Counter
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Spelling dictionary precomputed with "python query_normalizer.py build"
+SPELL_INDEX_PATH = os.environ.get("EVA_SPELL_INDEX", "data/spell_index.json")
+
+# Spelling correction can be turned off (EVA_SPELL_CORRECTION=0); accents are always folded
+SPELL_CORRECTION = os.environ.get("EVA_SPELL_CORRECTION", "1") != "0"
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+
+# Tokens shorter than this are never corrected; up to LONG_WORD_LENGTH - 1
+# characters only one edit is allowed
+MIN_CORRECTION_LENGTH = 4
+LONG_WORD_LENGTH = 8
+
+# Corrections remembered per normalizer
+CORRECTION_CACHE_SIZE = 10000
+
+# Valid words the knowledge may not use ("weather", "today") are never
+# corrected: NLTK's English word list and stopwords (downloaded by
+# NLPProcessor) plus an optional word list, one word per line
+SPELL_LEXICON_PATH = os.environ.get("EVA_SPELL_LEXICON", "data/lexicon.txt")
+
+# A correction must occur at least this many times in the knowledge, so a
+# word seen once doesn't capture every token near it
+SPELL_MIN_COUNT = int(os.environ.get("EVA_SPELL_MIN_COUNT", 2))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text):
+    """
+    Remove diacritics ("inteligência" -> "inteligencia")
+
+    Args:
+        text (str): Input text
+
+    Returns:
+        str: Text without combining marks
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    """
+    Split text into lowercase, accent-folded alphanumeric tokens
+
+    Args:
+        text (str): Input text
+
+    Returns:
+        list: Tokens
+    """
+    return TOKEN_PATTERN.findall(fold_accents(text.lower()))
+
+
+def edit_distance(source, target, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions)
+
+    Args:
+        source (str): First string
+        target (str): Second string
+        max_distance (int): Distances above this aren't needed exactly
+
+    Returns:
+        int: The distance, or max_distance + 1 if it is larger than max_distance
+    """
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+
+    previous_previous = None
+    previous = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and source[i - 1] == target[j - 2]
+                    and source[i - 2] == target[j - 1]):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+def general_lexicon():
+    """
+    Words known to be spelled correctly, independently of the knowledge
+
+    Loaded once per process from the NLTK corpora that are installed and
+    from SPELL_LEXICON_PATH if it exists; empty if neither is available.
+
+    Returns:
+        frozenset: Lowercase, accent-folded words
+    """
+    global _lexicon
+    if _lexicon is not None:
+        return _lexicon
+
+    with _lexicon_lock:
+        if _lexicon is not None:
+            return _lexicon
+
+        words = set()
+        try:
+            from nltk.corpus import stopwords, words as word_list
+            words.update(word_list.words())
+            for language in ("english", "portuguese"):
+                words.update(stopwords.words(language))
+        except Exception as e:
+            logger.warning("NLTK word lists not available for the spelling lexicon: %s", e)
+
+        if os.path.exists(SPELL_LEXICON_PATH):
+            with open(SPELL_LEXICON_PATH, "r", encoding="utf-8") as f:
+                words.update(line.strip() for line in f)
+
+        _lexicon = frozenset(token for word in words for token in tokenize(word))
+        logger.info("Spelling lexicon loaded with %d words", len(_lexicon))
+        return _lexicon
+
+
+def vocabulary_fingerprint(store):
+    """
+    Fingerprint the texts of a knowledge store
+
+    Used to check that a persisted spelling dictionary belongs to the snapshot
+    loading it.
+
+    Args:
+        store (CompactKnowledgeStore): Knowledge entries
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ("question_offsets", "question_buffer", "answer_offsets", "answer_buffer"):
+        digest.update(np.ascontiguousarray(getattr(store, name)).tobytes())
+    return digest.hexdigest()
+
+
+class SymSpellIndex:
+    """
+    Symmetric-delete spelling dictionary (SymSpell)
+
+    Every vocabulary word is indexed under all strings obtained by deleting up
+    to max_distance characters from its first prefix_length characters. A
+    lookup generates the same deletes for the query token, so candidate
+    corrections are found with a handful of dict probes instead of comparing
+    against the whole vocabulary; only those candidates get a real edit
+    distance.
+    """
+
+    def __init__(self, words, deletes, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH, fingerprint=None):
+        """
+        Initialize the index
+
+        Args:
+            words (dict): Word -> frequency
+            deletes (dict): Delete string -> list of words
+            max_distance (int): Maximum edit distance indexed
+            prefix_length (int): Characters of each word used for deletes
+            fingerprint (str, optional): Fingerprint of the source texts
+        """
+        self.words = words
+        self.deletes = deletes
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def _edits(word, max_distance):
+        """All strings reachable from word with up to max_distance deletes"""
+        edits = {word}
+        frontier = [word]
+        for _ in range(max_distance):
+            next_frontier = []
+            for candidate in frontier:
+                if len(candidate) <= 1:
+                    continue
+                for position in range(len(candidate)):
+                    deleted = candidate[:position] + candidate[position + 1:]
+                    if deleted not in edits:
+                        edits.add(deleted)
+                        next_frontier.append(deleted)
+            frontier = next_frontier
+        return edits
+
+    @classmethod
+    def build(cls, texts, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH, fingerprint=None):
+        """
+        Build the dictionary from the vocabulary of some texts
+
+        Args:
+            texts (iterable): Documents (e.g. "question answer" of each entry)
+            max_distance (int): Maximum edit distance to support
+            prefix_length (int): Characters of each word used for deletes
+            fingerprint (str, optional): Fingerprint of the texts
+
+        Returns:
+            SymSpellIndex: The index
+        """
+        words = Counter()
+        for text in texts:
+            words.update(token for token in tokenize(text) if not token.isdigit())
+
+        deletes = {}
+        for word in words:
+            for edit in cls._edits(word[:prefix_length], max_distance):
+                deletes.setdefault(edit, []).append(word)
+
+        logger.info("Spelling dictionary built with %d words and %d deletes", len(words), len(deletes))
+        return cls(dict(words), deletes, max_distance, prefix_length, fingerprint)
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def lookup(self, token, max_distance=None):
+        """
+        Find the closest vocabulary word to a token
+
+        Args:
+            token (str): Lowercase, accent-folded token
+            max_distance (int, optional): Maximum edit distance (capped at the
+                indexed one)
+
+        Returns:
+            str: The token itself if known, the closest word (most frequent on
+            ties), or None if nothing is within max_distance
+        """
+        if token in self.words:
+            return token
+
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        prefix = token[:self.prefix_length]
+        best, best_distance, best_count = None, max_distance + 1, 0
+
+        # Breadth-first over deletes of the token, so edits come in increasing order
+        queue = [prefix]
+        seen = {prefix}
+        position = 0
+        while position < len(queue):
+            candidate = queue[position]
+            position += 1
+
+            deleted_count = len(prefix) - len(candidate)
+            if deleted_count > max_distance or deleted_count > best_distance:
+                break
+
+            for suggestion in self.deletes.get(candidate, ()):
+                if abs(len(suggestion) - len(token)) > max_distance:
+                    continue
+                distance = edit_distance(token, suggestion, max_distance)
+                count = self.words[suggestion]
+                if distance < best_distance or (distance == best_distance and count > best_count):
+                    best, best_distance, best_count = suggestion, distance, count
+
+            if deleted_count < max_distance and len(candidate) > 1:
+                for index in range(len(candidate)):
+                    deleted = candidate[:index] + candidate[index + 1:]
+                    if deleted not in seen:
+                        seen.add(deleted)
+                        queue.append(deleted)
+
+        return best
+
+    def save(self, path):
+        """
+        Write the dictionary to a JSON file (atomically)
+
+        Args:
+            path (str): Destination file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "max_distance": self.max_distance,
+                "prefix_length": self.prefix_length,
+                "fingerprint": self.fingerprint,
+                "words": self.words,
+                "deletes": self.deletes,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporary_path, path)
+        logger.info("Saved spelling dictionary to %s", path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a dictionary written by save()
+
+        Args:
+            path (str): Dictionary file
+
+        Returns:
+            SymSpellIndex: The index
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["words"], data["deletes"], data["max_distance"], data["prefix_length"], data.get("fingerprint"))
+
+    @classmethod
+    def for_store(cls, store, path=SPELL_INDEX_PATH):
+        """
+        Get the dictionary for a snapshot, preferring the persisted one
+
+        Args:
+            store (CompactKnowledgeStore): Knowledge entries
+            path (str): File written by save()
+
+        Returns:
+            SymSpellIndex: The index
+        """
+        fingerprint = vocabulary_fingerprint(store)
+        if os.path.exists(path):
+            index = cls.load(path)
+            if index.fingerprint == fingerprint:
+                logger.info("Using precomputed spelling dictionary from %s", path)
+                return index
+            logger.warning("Spelling dictionary in %s doesn't match the knowledge snapshot, rebuilding in memory", path)
+
+        return cls.build(store.iter_texts(), fingerprint=fingerprint)
+
+
+class QueryNormalizer:
+    """
+    Normalization stage run on queries before retrieval
+
+    Lowercases, folds accents and drops punctuation, then replaces tokens
+    that are neither in the knowledge vocabulary nor valid words of the
+    general lexicon with their closest spelling from the knowledge, if that
+    word is frequent enough there. Corrections are cached per token.
+    """
+
+    def __init__(self, spell_index=None, lexicon=None, min_count=SPELL_MIN_COUNT):
+        """
+        Initialize the normalizer
+
+        Args:
+            spell_index (SymSpellIndex, optional): Dictionary for spelling
+                correction; without it only accents and case are normalized
+            lexicon (set, optional): Words never corrected; defaults to
+                general_lexicon(), loaded here (while the snapshot is built)
+                so no request pays for it
+            min_count (int): Occurrences in the knowledge a correction needs
+        """
+        self.spell_index = spell_index
+        if lexicon is None and spell_index is not None:
+            lexicon = general_lexicon()
+        self.lexicon = lexicon
+        self.min_count = min_count
+        self._corrections = {}
+
+    @classmethod
+    def for_store(cls, store):
+        """
+        Create the normalizer of a knowledge snapshot
+
+        Args:
+            store (CompactKnowledgeStore): Knowledge entries
+
+        Returns:
+            QueryNormalizer: The normalizer
+        """
+        if not SPELL_CORRECTION:
+            return cls()
+        return cls(SymSpellIndex.for_store(store))
+
+    def correct(self, token):
+        """
+        Correct the spelling of one token
+
+        Args:
+            token (str): Lowercase, accent-folded token
+
+        Returns:
+            str: Corrected token, or the token itself when it is a known word,
+            too short, or has no close and frequent enough correction
+        """
+        if self.spell_index is None or len(token) < MIN_CORRECTION_LENGTH or token.isdigit():
+            return token
+
+        correction = self._corrections.get(token)
+        if correction is None:
+            if token in self.spell_index or token in self.lexicon:
+                correction = token
+            else:
+                max_distance = 1 if len(token) < LONG_WORD_LENGTH else 2
+                suggestion = self.spell_index.lookup(token, max_distance)
+                if suggestion is not None and self.spell_index.words[suggestion] >= self.min_count:
+                    correction = suggestion
+                else:
+                    correction = token
+            if len(self._corrections) >= CORRECTION_CACHE_SIZE:
+                self._corrections.clear()
+            self._corrections[token] = correction
+        return correction
+
+    def normalize(self, query):
+        """
+        Normalize a query
+
+        Args:
+            query (str): Raw or preprocessed query
+
+        Returns:
+            str: Accent-folded, spelling-corrected tokens separated by spaces
+        """
+        return " ".join(self.correct(token) for token in tokenize(query))
+
+
+def main(argv=None):
+    """Command line entry point: precompute the spelling dictionary for a knowledge file or store"""
+    from knowledge_ingest import iter_entries
+    from knowledge_store import CompactKnowledgeStore
+
+    parser = argparse.ArgumentParser(description="Precompute the query spelling dictionary")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Build the symmetric-delete dictionary")
+    source = build.add_mutually_exclusive_group()
+    source.add_argument("--knowledge", default="data/knowledge.json", help="JSON or NDJSON knowledge file")
+    source.add_argument("--store", help="Directory of a saved CompactKnowledgeStore")
+    build.add_argument("--output", default=SPELL_INDEX_PATH, help="Destination file")
+    build.add_argument("--max-distance", type=int, default=MAX_EDIT_DISTANCE, help="Maximum edit distance")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.store:
+        store = CompactKnowledgeStore.load(args.store)
+    else:
+        store = CompactKnowledgeStore.from_entries(iter_entries(args.knowledge))
+
+    index = SymSpellIndex.build(store.iter_texts(), max_distance=args.max_distance,
+                                fingerprint=vocabulary_fingerprint(store))
+    index.save(args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -92,7 +92,7 @@ class ResponseGenerator:
             return response
         
         except Exception as e:
-            logger.error(f"Error generating knowledge response: {str(e)}")
+            logger.error("Error generating knowledge response: %s", e)
             return self.generate_unknown_response()
     
     def generate_unknown_response(self):
@@ -121,7 +121,7 @@ class ResponseGenerator:
                 return random.choice(self.generic_responses["conversation"])
         
         except Exception as e:
-            logger.error(f"Error generating generic response: {str(e)}")
+            logger.error("Error generating generic response: %s", e)
             return "Desculpe, estou com dificuldades para entender no momento."
     
     def generate_contextual_response(self, user_input, context):
@@ -155,5 +155,5 @@ class ResponseGenerator:
             return self.generate_generic_response("conversation")
         
         except Exception as e:
-            logger.error(f"Error generating contextual response: {str(e)}")
+            logger.error("Error generating contextual response: %s", e)
             return "Estou tentando entender o contexto. Você poderia reformular isso?"
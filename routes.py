@@ -1,72 +1,186 @@
-import json
 import os
-from flask import render_template, request, jsonify, session, redirect, url_for, flash
+import hmac
+import click
+from datetime import datetime
+from flask import render_template, request, jsonify, session, redirect, url_for, flash, Response, stream_with_context
 from app import app, db
+import metrics
+import profiling
 from ai_engine import AIEngine
-from models import Conversation, Message, KnowledgeEntry
+from knowledge_base import KnowledgeBase, KNOWLEDGE_STORE_DIR, file_store_metadata
+from knowledge_loader import DatabaseKnowledgeLoader
+from knowledge_ingest import iter_chunks, iter_entries
+from knowledge_store import CompactKnowledgeStore
+from knowledge_reloader import KnowledgeReloader, file_mtime_source, db_version_source, bump_db_version
+from knowledge_shard import KNOWLEDGE_SHARDS
+from models import Conversation, Message, KnowledgeEntry, KnowledgeVersion, IntentRollup
+from conversation_context import ConversationContext
+from archive import ConversationArchive, ARCHIVE_AFTER_DAYS
+from knowledge_search import KnowledgeSearch, InvalidCursor
+from admission import AdmissionController, client_key
+from analytics import AnalyticsRecorder, ResponseDecision, rollup_report
+import export
+
+# Entries written per commit by /knowledge/sync
+SYNC_CHUNK_SIZE = int(os.environ.get("EVA_SYNC_CHUNK_SIZE", 1000))
+
+# Token required by /export/messages (the endpoint is disabled when unset)
+EXPORT_TOKEN = os.environ.get("EVA_EXPORT_TOKEN")
+
+# Knowledge comes from the KnowledgeEntry table (EVA_KNOWLEDGE_SOURCE=database,
+# the default) or straight from the JSON file (EVA_KNOWLEDGE_SOURCE=file). Until
+# the database has been synced the engine keeps the file-based snapshot.
+knowledge_source = os.environ.get("EVA_KNOWLEDGE_SOURCE", "database")
+knowledge_loader = DatabaseKnowledgeLoader(app, db, KnowledgeEntry)
+
+def load_initial_knowledge():
+    """Load the starting snapshot from the database (None to read the JSON file)"""
+    if KNOWLEDGE_SHARDS or knowledge_source == "file":
+        return None
+    try:
+        return knowledge_loader.load()
+    except Exception as e:
+        app.logger.error("Error loading knowledge from the database: %s", e)
+        return None
 
 # Initialize AI engine
-ai_engine = AIEngine()
+ai_engine = AIEngine(knowledge_base=load_initial_knowledge())
+
+# Rebuild the knowledge snapshot in the background when its source changes
+# (EVA_KNOWLEDGE_RELOAD_INTERVAL=0 disables it)
+knowledge_reload_interval = float(os.environ.get("EVA_KNOWLEDGE_RELOAD_INTERVAL", 10))
+if ai_engine.sharded:
+    # Cada shard carrega sua própria fatia da base; nada a recarregar aqui
+    knowledge_reloader = None
+elif knowledge_source == "file":
+    knowledge_reloader = KnowledgeReloader(
+        ai_engine,
+        builder=lambda: KnowledgeBase(ai_engine.knowledge_base.knowledge_file),
+        sources=[file_mtime_source(ai_engine.knowledge_base.knowledge_file)],
+        interval=knowledge_reload_interval,
+    )
+else:
+    # Recarga incremental ao iniciar: cobre mudanças feitas desde a carga inicial
+    knowledge_reloader = KnowledgeReloader(
+        ai_engine,
+        builder=knowledge_loader.load,
+        sources=[db_version_source(app, db, KnowledgeVersion)],
+        interval=knowledge_reload_interval,
+        reload_on_start=True,
+    )
+if knowledge_reloader is not None and knowledge_reload_interval > 0:
+    knowledge_reloader.start()
+
+# Listagem paginada e busca textual da base de conhecimento (/knowledge)
+knowledge_search = KnowledgeSearch(db, KnowledgeEntry)
+
+# Conversas antigas arquivadas em segmentos comprimidos (flask archive-conversations)
+conversation_archive = ConversationArchive()
+
+# Limite por conversa/IP e de concorrência para o /chat (EVA_ADMISSION=0 desativa)
+admission_controller = AdmissionController()
+
+# Decisões de resposta agregadas por (dia, intenção, idioma) para o /analytics
+analytics_recorder = AnalyticsRecorder(app, db, IntentRollup)
+
+# Opt-in low-rate stack sampling across requests (EVA_PROFILE_SAMPLING=1)
+profiling.start_background_sampler()
+
+def render_knowledge_page(message=None):
+    """Render one page of the knowledge base with the filters from the query string"""
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'category': request.args.get('category', ''),
+        'language': request.args.get('language', ''),
+    }
+    
+    # Paginação por cursor: o custo de qualquer página é o mesmo da primeira
+    page = knowledge_search.page(
+        query=filters['q'] or None,
+        category=filters['category'] or None,
+        language=filters['language'] or None,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+    )
+    categories, languages = knowledge_search.facets()
+    
+    return render_template('knowledge.html',
+                          entries=page['entries'],
+                          total=page['total'],
+                          next_cursor=page['next_cursor'],
+                          prev_cursor=page['prev_cursor'],
+                          filters=filters,
+                          categories=categories,
+                          languages=languages,
+                          message=message)
 
 # Rotas para gerenciamento da base de conhecimento
 @app.route('/knowledge')
 def knowledge_base():
     """View knowledge base entries"""
     try:
-        entries = KnowledgeEntry.query.order_by(KnowledgeEntry.category, KnowledgeEntry.language).all()
-        return render_template('knowledge.html', entries=entries)
+        return render_knowledge_page()
+    except InvalidCursor:
+        return "Cursor inválido", 400
     except Exception as e:
-        app.logger.error(f"Error in knowledge_base endpoint: {str(e)}")
+        app.logger.error("Error in knowledge_base endpoint: %s", e)
         return "Erro ao carregar a base de conhecimento", 500
 
 @app.route('/knowledge/sync')
 def sync_knowledge():
     """Synchronize knowledge from JSON file to database"""
     try:
-        # Carregar dados do arquivo JSON
+        # Ler o arquivo JSON/NDJSON em blocos, sem carregá-lo inteiro na memória
         knowledge_file = "data/knowledge.json"
-        with open(knowledge_file, 'r') as f:
-            knowledge_data = json.load(f)
         
         # Contar entradas sincronizadas
         count = 0
         
-        # Sincronizar com o banco de dados
-        for entry in knowledge_data:
-            # Determinar o idioma baseado na pergunta
-            # Regra simples: se contém caracteres especiais do português, é pt, senão en
-            language = "pt" if any(c in entry["question"].lower() for c in "áàâãéèêíìóòôõúùçñ") else "en"
+        # Sincronizar com o banco de dados, um bloco por vez
+        for chunk in iter_chunks(knowledge_file, chunk_size=SYNC_CHUNK_SIZE):
+            # Buscar de uma vez as entradas existentes do bloco
+            questions = {entry["question"] for entry in chunk}
+            existing_entries = {
+                (existing.question, existing.language): existing
+                for existing in KnowledgeEntry.query.filter(KnowledgeEntry.question.in_(questions))
+            }
             
-            # Verificar se a entrada já existe
-            existing = KnowledgeEntry.query.filter_by(
-                question=entry["question"],
-                language=language
-            ).first()
+            for entry in chunk:
+                existing = existing_entries.get((entry["question"], entry["language"]))
+                
+                if existing:
+                    # Atualizar apenas se mudou, para não mover a marca d'água da carga incremental
+                    if existing.answer != entry["answer"] or existing.category != entry["category"]:
+                        existing.answer = entry["answer"]
+                        existing.category = entry["category"]
+                else:
+                    # Criar nova entrada
+                    new_entry = KnowledgeEntry()
+                    new_entry.question = entry["question"]
+                    new_entry.answer = entry["answer"]
+                    new_entry.category = entry["category"]
+                    new_entry.language = entry["language"]
+                    db.session.add(new_entry)
+                    existing_entries[(entry["question"], entry["language"])] = new_entry
+                    count += 1
             
-            if existing:
-                # Atualizar entrada existente
-                existing.answer = entry["answer"]
-                existing.category = entry["category"]
-            else:
-                # Criar nova entrada
-                new_entry = KnowledgeEntry()
-                new_entry.question = entry["question"]
-                new_entry.answer = entry["answer"]
-                new_entry.category = entry["category"]
-                new_entry.language = language
-                db.session.add(new_entry)
-                count += 1
+            # Gravar cada bloco para manter a sessão pequena
+            db.session.commit()
+            db.session.expunge_all()
+        
+        # Sinalizar aos workers que a base mudou
+        bump_db_version(db, KnowledgeVersion)
         
         # Salvar alterações
         db.session.commit()
         
         # Retornar à página da base de conhecimento com mensagem de sucesso
         message = f"Sincronização concluída com sucesso. {count} novas entradas adicionadas."
-        return render_template('knowledge.html', 
-                              entries=KnowledgeEntry.query.order_by(KnowledgeEntry.category, KnowledgeEntry.language).all(),
-                              message=message)
+        return render_knowledge_page(message=message)
+    except InvalidCursor:
+        return "Cursor inválido", 400
     except Exception as e:
-        app.logger.error(f"Error in sync_knowledge endpoint: {str(e)}")
+        app.logger.error("Error in sync_knowledge endpoint: %s", e)
         return "Erro ao sincronizar a base de conhecimento", 500
         
 @app.route('/knowledge/view/<int:entry_id>')
@@ -76,7 +190,7 @@ def view_knowledge_entry(entry_id):
         entry = KnowledgeEntry.query.get_or_404(entry_id)
         return render_template('knowledge_view.html', entry=entry)
     except Exception as e:
-        app.logger.error(f"Error in view_knowledge_entry endpoint: {str(e)}")
+        app.logger.error("Error in view_knowledge_entry endpoint: %s", e)
         return "Erro ao visualizar entrada da base de conhecimento", 500
 
 @app.route('/')
@@ -113,47 +227,82 @@ def history():
                     'message_count': len(messages)
                 })
         
+        # Conversas arquivadas vêm do índice do arquivo, sem ler os segmentos
+        for conv in conversation_archive.list_conversations(session.get('user_id')):
+            history_data.append({
+                'id': conv['id'],
+                'date': conv['started_at'].strftime('%d/%m/%Y %H:%M') if conv['started_at'] else '',
+                'preview': conv['preview'] or "Conversa sem mensagens",
+                'message_count': conv['message_count']
+            })
+        
         return render_template('history.html', conversations=history_data)
     except Exception as e:
-        app.logger.error(f"Error in history endpoint: {str(e)}")
+        app.logger.error("Error in history endpoint: %s", e)
         return "Erro ao carregar o histórico de conversas", 500
 
 @app.route('/conversation/<int:conversation_id>')
 def view_conversation(conversation_id):
     """View a specific conversation"""
     try:
-        # Verificar se a conversa existe
-        conversation = Conversation.query.get_or_404(conversation_id)
+        # Verificar se a conversa existe na tabela ativa
+        conversation = db.session.get(Conversation, conversation_id)
         
-        # Obter mensagens da conversa
-        messages = Message.query.filter_by(
-            conversation_id=conversation.id
-        ).order_by(Message.timestamp).all()
+        if conversation:
+            # Obter mensagens da conversa
+            messages = Message.query.filter_by(
+                conversation_id=conversation.id
+            ).order_by(Message.timestamp).all()
+            messages = [{'role': msg.role, 'content': msg.content, 'timestamp': msg.timestamp} for msg in messages]
+            started_at = conversation.started_at
+        else:
+            # Procurar nos segmentos arquivados
+            archived = conversation_archive.get_conversation(conversation_id)
+            if archived is None:
+                return "Conversa não encontrada", 404
+            messages = archived['messages']
+            started_at = archived['started_at']
         
         # Converter para formato de exibição
         message_data = []
         for msg in messages:
             message_data.append({
-                'role': msg.role,
-                'content': msg.content,
-                'timestamp': msg.timestamp.strftime('%H:%M:%S')
+                'role': msg['role'],
+                'content': msg['content'],
+                'timestamp': msg['timestamp'].strftime('%H:%M:%S') if msg['timestamp'] else ''
             })
         
         # Dados da conversa
         conversation_data = {
-            'id': conversation.id,
-            'date': conversation.started_at.strftime('%d/%m/%Y %H:%M'),
+            'id': conversation_id,
+            'date': started_at.strftime('%d/%m/%Y %H:%M') if started_at else '',
             'messages': message_data
         }
         
         return render_template('conversation.html', conversation=conversation_data)
     except Exception as e:
-        app.logger.error(f"Error in view_conversation endpoint: {str(e)}")
+        app.logger.error("Error in view_conversation endpoint: %s", e)
         return "Erro ao carregar a conversa", 500
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Process user message and generate AI response"""
+    # Recusar cedo, antes de qualquer trabalho de NLP ou de banco de dados
+    admission = admission_controller.admit(client_key(session, request))
+    if not admission.admitted:
+        if admission.reason == "rate_limited":
+            message = "Você está enviando mensagens rápido demais. Aguarde um instante e tente novamente."
+        else:
+            message = "Estou sobrecarregada no momento. Tente novamente em alguns segundos."
+        result = jsonify({'response': message})
+        result.headers['Retry-After'] = str(max(1, int(admission.retry_after + 0.999)))
+        return result, admission.status
+    
+    with admission:
+        return process_chat()
+
+def process_chat():
+    """Run an admitted /chat request"""
     try:
         user_message = request.json.get('message', '')
         
@@ -163,9 +312,11 @@ def chat():
             conversation = Conversation()
             conversation.user_id = session.get('user_id')
             db.session.add(conversation)
-            db.session.commit()
+            with metrics.span("db.commit.conversation"):
+                db.session.commit()
             session['conversation_id'] = conversation.id
             session['conversation'] = []
+            session['context'] = None
         else:
             # Get existing conversation
             conversation = Conversation.query.get(session['conversation_id'])
@@ -174,9 +325,11 @@ def chat():
                 conversation = Conversation()
                 conversation.user_id = session.get('user_id')
                 db.session.add(conversation)
-                db.session.commit()
+                with metrics.span("db.commit.conversation"):
+                    db.session.commit()
                 session['conversation_id'] = conversation.id
                 session['conversation'] = []
+                session['context'] = None
         
         # Add user message to conversation history in session
         session['conversation'].append({"role": "user", "content": user_message})
@@ -187,10 +340,26 @@ def chat():
         user_msg.role = "user"
         user_msg.conversation_id = conversation.id
         db.session.add(user_msg)
-        db.session.commit()
+        with metrics.span("db.commit.user_message"):
+            db.session.commit()
+        
+        # Restaurar o contexto incremental da conversa (reconstruído apenas em sessões antigas)
+        if 'context' in session:
+            context = ConversationContext.from_dict(session['context'])
+        else:
+            context = ai_engine.build_context(session['conversation'][:-1])
         
-        # Generate AI response
-        response = ai_engine.generate_response(user_message, session['conversation'])
+        # Generate AI response (profiled when an admin asks for it)
+        profiler = profiling.request_profiler(request)
+        decision = ResponseDecision()
+        with profiler:
+            response = ai_engine.generate_response(user_message, session['conversation'], context, decision)
+        
+        # Contabilizar a decisão nos agregados (gravados em lote em segundo plano)
+        analytics_recorder.record(decision)
+        
+        # Guardar o contexto atualizado junto com a conversa
+        session['context'] = context.to_dict()
         
         # Add AI response to conversation history in session
         session['conversation'].append({"role": "assistant", "content": response})
@@ -201,7 +370,8 @@ def chat():
         ai_msg.role = "assistant"
         ai_msg.conversation_id = conversation.id
         db.session.add(ai_msg)
-        db.session.commit()
+        with metrics.span("db.commit.assistant_message"):
+            db.session.commit()
         
         # Limit conversation history to last 20 messages in session
         if len(session['conversation']) > 20:
@@ -210,18 +380,38 @@ def chat():
         # Persist the session
         session.modified = True
         
-        return jsonify({'response': response})
+        result = jsonify({'response': response})
+        if profiler.report_path:
+            result.headers['X-Eva-Profile-Report'] = os.path.basename(profiler.report_path)
+        return result
     
     except Exception as e:
-        app.logger.error(f"Error in chat endpoint: {str(e)}")
+        app.logger.error("Error in chat endpoint: %s", e)
         return jsonify({'response': "Peço desculpas, mas estou tendo problemas para processar sua solicitação no momento."}), 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose pipeline latency histograms in the Prometheus text format"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/analytics')
+def analytics_endpoint():
+    """Unknown-response and knowledge-miss rates by day, intent and language"""
+    try:
+        # Lê apenas os agregados, sem varrer a tabela de mensagens
+        days = max(1, min(request.args.get('days', 30, type=int), 366))
+        return jsonify(rollup_report(db, IntentRollup, days))
+    except Exception as e:
+        app.logger.error("Error in analytics endpoint: %s", e)
+        return jsonify({'error': "Erro ao carregar as estatísticas"}), 500
+
 @app.route('/reset', methods=['POST'])
 def reset_conversation():
     """Reset the conversation history"""
     try:
         # Limpar a sessão atual
         session['conversation'] = []
+        session['context'] = None
         
         # Iniciar uma nova conversa no banco de dados
         conversation = Conversation()
@@ -233,5 +423,74 @@ def reset_conversation():
         session.modified = True
         return jsonify({'status': 'success', 'message': 'Conversa reiniciada com sucesso'})
     except Exception as e:
-        app.logger.error(f"Error in reset endpoint: {str(e)}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
\ No newline at end of file
+        app.logger.error("Error in reset endpoint: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.cli.command('archive-conversations')
+@click.option('--older-than-days', default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Arquivar conversas sem mensagens mais recentes que isso')
+@click.option('--batch-size', default=500, show_default=True, help='Conversas movidas por transação')
+def archive_conversations_command(older_than_days, batch_size):
+    """Move old conversations into compressed archive segments"""
+    count = conversation_archive.archive_old_conversations(
+        db, Conversation, Message, older_than_days=older_than_days, batch_size=batch_size
+    )
+    click.echo(f"{count} conversas arquivadas em {conversation_archive.directory}")
+
+@app.cli.command('knowledge-index')
+def knowledge_index_command():
+    """Create the full-text index used by the /knowledge search"""
+    # Linhas antigas sem idioma ficariam fora da paginação por (categoria, idioma, id)
+    filled = KnowledgeEntry.query.filter(KnowledgeEntry.language.is_(None)).update(
+        {KnowledgeEntry.language: 'en'}, synchronize_session=False
+    )
+    db.session.commit()
+    if filled:
+        click.echo(f"{filled} entradas sem idioma marcadas como 'en'")
+    backend = knowledge_search.create_index()
+    click.echo(f"Busca da base de conhecimento usando: {backend}")
+
+@app.cli.command('knowledge-store')
+def knowledge_store_command():
+    """Save the knowledge as a store that the app memory-maps at startup"""
+    if knowledge_source == "file":
+        knowledge_file = ai_engine.knowledge_base.knowledge_file
+        store = CompactKnowledgeStore.from_entries(iter_entries(knowledge_file))
+        store.save(KNOWLEDGE_STORE_DIR, metadata=file_store_metadata(knowledge_file))
+    else:
+        # Salva com a marca d'água, para as próximas cargas lerem só o que mudou depois
+        knowledge_loader.load()
+        knowledge_loader.save_store()
+        store = knowledge_loader.store
+    click.echo(f"{len(store)} entradas salvas em {KNOWLEDGE_STORE_DIR}")
+
+@app.route('/export/messages')
+def export_messages():
+    """Stream messages after a (timestamp, id) cursor as NDJSON for analytics"""
+    # Exige o token de exportação; sem token configurado o endpoint fica desativado
+    token = request.headers.get('X-Eva-Export-Token')
+    if not EXPORT_TOKEN or not token or not hmac.compare_digest(token, EXPORT_TOKEN):
+        return "Não autorizado", 403
+    
+    # Cursor (timestamp, id) da última mensagem já recebida pelo cliente
+    after = None
+    after_timestamp = request.args.get('after_timestamp')
+    if after_timestamp:
+        try:
+            after = (datetime.fromisoformat(after_timestamp), request.args.get('after_id', 0, type=int))
+        except ValueError:
+            return "Cursor inválido", 400
+    
+    return Response(stream_with_context(export.stream_ndjson(db.engine, after)), mimetype='application/x-ndjson')
+
+@app.cli.command('export-messages')
+@click.option('--output-dir', default=export.EXPORT_DIR, show_default=True, help='Diretório dos arquivos exportados')
+@click.option('--format', 'export_format', type=click.Choice(sorted(export.FORMATS)), default='ndjson', show_default=True)
+@click.option('--workers', default=1, show_default=True, help='Processos exportando partes dos ids em paralelo')
+@click.option('--full', is_flag=True, help='Ignorar a marca d\'água e exportar tudo')
+def export_messages_command(output_dir, export_format, workers, full):
+    """Export conversations and messages to NDJSON or Parquet files"""
+    stats = export.run_export(app.config["SQLALCHEMY_DATABASE_URI"], output_dir, export_format, workers,
+                              incremental=not full)
+    click.echo(f"{stats['rows']} mensagens exportadas em {stats['seconds']:.2f}s "
+               f"({stats['rows_per_second']:.0f} linhas/s)")